@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import asyncio
-import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.dispatcher.middlewares.base import BaseMiddleware
@@ -10,48 +9,136 @@ from redis.asyncio import Redis
 
 from bot_config import load_settings
 from handlers.chat import router as chat_router
+from logging_setup import setup_logging
+from shared.metrics import REGISTRY, instrument_redis, serve_metrics, timed_handler
 from services.dialogs import DialogService
+from services.expiry import ExpiryReconciler, ExpiryScheduler
+from services.matchmaker import Matchmaker
 from services.matchmaking import MatchmakingService
+from services.relay import MediaRelay
+from services.safe_sender import install_scheduler
+from services.send_scheduler import SendScheduler
 from services.topics import TopicService
+from storage.key_cache import KeyCache
+from storage.last_seen import LastSeenTracker
+from storage.partner_cache import PartnerCache
+from storage.pg_writer import PostgresWriteBehind
 from storage.postgres_store import PostgresStorage
 from storage.redis_store import RedisStorage
+from shared.webhook import run_webhook
 
 
 class ServicesMiddleware(BaseMiddleware):
-    def __init__(self, redis: RedisStorage, pg: PostgresStorage):
+    def __init__(self, redis: RedisStorage, pg: PostgresWriteBehind, last_seen: LastSeenTracker, relay: MediaRelay):
         self.redis = redis
         self.pg = pg
+        self.last_seen = last_seen
+        self.relay = relay
 
     async def __call__(self, handler, event, data):
         data["redis"] = self.redis
         data["pg"] = self.pg
+        data["last_seen"] = self.last_seen
+        data["relay"] = self.relay
         settings = data["settings"]
-        data["matchmaking"] = MatchmakingService(self.redis, self.pg, settings.dialog_ttl_seconds)
+        data["matchmaking"] = MatchmakingService(
+            self.redis, self.pg, settings.dialog_ttl_seconds, settings.search_timeout_seconds
+        )
         data["dialogs"] = DialogService(self.redis, self.pg, settings.ban_ttl_seconds)
         data["topics"] = TopicService(self.redis, self.pg, settings.topic_ttl_seconds)
-        return await handler(event, data)
+        return await timed_handler(handler, event, data)
 
 
 async def main() -> None:
     load_dotenv()
     settings = load_settings()
-    logging.basicConfig(level=settings.log_level)
+    log_listener = setup_logging(settings.log_level, settings.log_format, settings.log_sample_rate)
 
     bot = Bot(token=settings.bot_token)
-    redis_client = Redis.from_url(settings.redis_url)
-    redis_store = RedisStorage(redis_client)
+    send_scheduler = SendScheduler(settings.telegram_global_rate, settings.telegram_per_chat_rate)
+    install_scheduler(send_scheduler)
+    send_scheduler_task = send_scheduler.start()
+    redis_client = instrument_redis(Redis.from_url(settings.redis_url))
+    key_cache = KeyCache(settings.key_cache_size) if settings.key_cache_size else None
+    partner_cache = PartnerCache(settings.partner_cache_size)
+    redis_store = RedisStorage(redis_client, partner_cache, key_cache)
     pg_store = await PostgresStorage.from_dsn(settings.postgres_dsn)
+    await redis_store.backfill_topic_index()
+    await redis_store.backfill_dialog_expiry()
+    await redis_store.migrate_search_queue()
+    # Handlers only enqueue Postgres writes; pg_writer.run() flushes them.
+    pg_writer = PostgresWriteBehind(
+        redis_client,
+        pg_store,
+        settings.pg_writer_consumer,
+        batch_size=settings.pg_write_batch_size,
+        flush_interval=settings.pg_flush_interval_seconds,
+        max_pending=settings.pg_max_pending_writes,
+    )
+    pg_writer_task = asyncio.create_task(pg_writer.run())
+    last_seen = LastSeenTracker(
+        redis_client, pg_store, settings.pg_writer_consumer, settings.last_seen_flush_seconds
+    )
 
     dp = Dispatcher()
     dp["settings"] = settings
-    dp.message.middleware(ServicesMiddleware(redis_store, pg_store))
+    relay = MediaRelay(settings.relay_linger_seconds, settings.relay_album_linger_seconds, settings.relay_max_delay_seconds)
+    dp.message.middleware(ServicesMiddleware(redis_store, pg_writer, last_seen, relay))
     dp.include_router(chat_router)
 
+    matchmaker = Matchmaker(
+        MatchmakingService(redis_store, pg_writer, settings.dialog_ttl_seconds, settings.search_timeout_seconds),
+        redis_store,
+        bot,
+    )
+    background = [send_scheduler_task]
+    background.extend(asyncio.create_task(matchmaker.run()) for _ in range(settings.matchmaker_workers))
+    background.append(asyncio.create_task(redis_store.listen_partner_invalidations()))
+    expiry = ExpiryScheduler(redis_store, pg_writer, bot)
+    reconciler = ExpiryReconciler(redis_store, expiry, sweep_seconds=settings.expiry_sweep_seconds)
+    background.append(asyncio.create_task(expiry.run()))
+    background.append(asyncio.create_task(reconciler.listen()))
+    background.append(asyncio.create_task(reconciler.run_sweeper()))
+    if key_cache is not None:
+        background.append(asyncio.create_task(redis_store.listen_key_invalidations()))
+        REGISTRY.gauge("key_cache_hit_ratio", "Share of ban/state/dialog reads served in-process", lambda: key_cache.hit_rate)
+    REGISTRY.gauge("partner_cache_hit_ratio", "Share of relay partner lookups served in-process", lambda: partner_cache.hit_rate)
+    background.append(asyncio.create_task(last_seen.run()))
+    background.append(asyncio.create_task(pg_store.run_partition_maintenance(settings.pg_retention_months)))
+    REGISTRY.gauge("search_queue_depth", "Users waiting for a partner", redis_store.search_queue_size)
+    REGISTRY.gauge("telegram_send_queue_depth", "Bot API calls waiting in the send scheduler", lambda: send_scheduler.pending)
+    metrics_runner = await serve_metrics(settings.metrics_host, settings.metrics_port) if settings.metrics_port else None
+
     try:
-        await dp.start_polling(bot, settings=settings)
+        if settings.webhook_url:
+            await run_webhook(
+                dp,
+                bot,
+                settings.webhook_url,
+                host=settings.webhook_host,
+                port=settings.webhook_port,
+                path=settings.webhook_path,
+                secret=settings.webhook_secret or None,
+                workers=settings.update_workers,
+                queue_size=settings.update_queue_size,
+                settings=settings,
+            )
+        else:
+            await dp.start_polling(bot, settings=settings)
     finally:
+        # Relayed messages still go through the send scheduler.
+        await relay.close()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await last_seen.flush()
+        pg_writer.close()
+        await pg_writer_task
         await redis_client.aclose()
         await pg_store.close()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+"""Memory of ThrottlingMiddleware under 100k distinct users.
+
+Every user sends two messages back to back, so the second one is throttled
+and lands in the local deny cache. Python memory allocated by the middleware
+and the bot Redis client is sampled with tracemalloc; it must stay flat once
+the cache is full.
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.antiflood
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import bot.storage.redis_client as redis_client_module
+import bot.utils.antiflood as antiflood_module
+from benchmarks.common import make_redis, percentile, print_table
+from bot.storage.redis_client import redis_client
+from bot.utils.antiflood import ThrottlingMiddleware
+
+USERS = 100_000
+CHECKPOINT = 10_000
+
+
+async def handler(event, data) -> None:
+    return None
+
+
+async def main() -> None:
+    redis = make_redis()
+    redis_client.client = redis
+    middleware = ThrottlingMiddleware(rate=1, burst=1, local_cache_size=10_000)
+    filters = [
+        tracemalloc.Filter(True, antiflood_module.__file__),
+        tracemalloc.Filter(True, redis_client_module.__file__),
+    ]
+    tracemalloc.start()
+
+    rows = []
+    samples: list[float] = []
+    for user_id in range(1, USERS + 1):
+        message = SimpleNamespace(from_user=SimpleNamespace(id=user_id))
+        for _ in range(2):
+            started = time.perf_counter()
+            await middleware(handler, message, {})
+            samples.append((time.perf_counter() - started) * 1000)
+        if user_id % CHECKPOINT == 0:
+            snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+            traced = sum(stat.size for stat in snapshot.statistics("filename"))
+            rows.append([
+                user_id,
+                len(middleware.blocked_until),
+                f"{traced / 1024:.0f}",
+                f"{percentile(samples, 50):.3f}",
+                f"{percentile(samples, 99):.3f}",
+            ])
+            samples.clear()
+    tracemalloc.stop()
+    print_table(["users", "deny cache", "KiB", "p50 ms", "p99 ms"], rows)
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""Dialog/topic payload codecs: encode/decode CPU and Redis memory per 100k.
+
+CPU rows time encode() and decode() of one payload (decode gets bytes, as
+HGETALL returns them). Memory rows write 100k hashes with each codec and
+report used_memory growth from INFO; with fakeredis (no INFO memory) they
+report the raw field+value bytes instead, which ignores per-key overhead.
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.codecs
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+from benchmarks.common import make_redis, print_table
+from storage.codecs import DIALOG_CODEC, TOPIC_CODEC, JsonFieldCodec
+
+KEYS = 100_000
+ROUNDS = 100_000
+
+DIALOG = {"user1": 412345678, "user2": 598765432, "started_at": "2025-10-09T08:53:20.123456+00:00", "expires_at": 1760003600.123456}
+TOPIC = {
+    "text": "Кто хочет обсудить последнюю книгу, которую прочитал?",
+    "owner": 412345678,
+    "expires_at": 1760003600.123456,
+    "active": True,
+}
+
+CASES = [
+    ("dialog", "json", JsonFieldCodec(), DIALOG),
+    ("dialog", "scalar", DIALOG_CODEC, DIALOG),
+    ("topic", "json", JsonFieldCodec(), TOPIC),
+    ("topic", "packed", TOPIC_CODEC, TOPIC),
+]
+
+
+def as_hgetall(fields: dict) -> dict[bytes, bytes]:
+    return {
+        key.encode(): value if isinstance(value, bytes) else str(value).encode()
+        for key, value in fields.items()
+    }
+
+
+def per_call_us(fn, arg) -> float:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(arg)
+    return (time.perf_counter() - started) / ROUNDS * 1e6
+
+
+async def used_memory(redis) -> int | None:
+    if not os.getenv("BENCH_REDIS_URL"):
+        return None
+    return (await redis.info("memory"))["used_memory"]
+
+
+async def memory_per_keys(redis, kind: str, codec, payload: dict) -> int:
+    await redis.flushdb()
+    fields = codec.encode(payload)
+    before = await used_memory(redis)
+    for offset in range(0, KEYS, 5_000):
+        pipe = redis.pipeline(transaction=False)
+        for idx in range(offset, offset + 5_000):
+            pipe.hset(f"{kind}:{idx:032x}", mapping=fields)
+        await pipe.execute()
+    after = await used_memory(redis)
+    if before is None:
+        return KEYS * sum(len(key) + len(value) for key, value in as_hgetall(fields).items())
+    return after - before
+
+
+async def main() -> None:
+    redis = make_redis()
+    rows = []
+    for kind, name, codec, payload in CASES:
+        raw = as_hgetall(codec.encode(payload))
+        assert codec.decode(raw) == payload
+        memory = await memory_per_keys(redis, kind, codec, payload)
+        rows.append(
+            [
+                kind,
+                name,
+                f"{per_call_us(codec.encode, payload):.2f}",
+                f"{per_call_us(codec.decode, raw):.2f}",
+                f"{memory / 1024 / 1024:.1f}",
+            ]
+        )
+    await redis.flushdb()
+    await redis.aclose()
+    label = "used_memory MiB" if os.getenv("BENCH_REDIS_URL") else "payload MiB"
+    print_table(["hash", "codec", "encode us", "decode us", f"{label} / {KEYS // 1000}k"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
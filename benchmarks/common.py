@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import os
+from typing import Any
+
+
+def make_redis() -> Any:
+    """Real Redis from BENCH_REDIS_URL, otherwise an in-process fakeredis.
+
+    fakeredis numbers show relative cost only: there is no network round trip.
+    """
+    url = os.getenv("BENCH_REDIS_URL")
+    if url:
+        from redis.asyncio import Redis
+
+        return Redis.from_url(url)
+    from fakeredis import aioredis as fake_aioredis
+
+    return fake_aioredis.FakeRedis()
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def print_table(headers: list[str], rows: list[list[Any]]) -> None:
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).rjust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(c).rjust(w) for c, w in zip(row, widths)))
+
+
+def postgres_dsn() -> str | None:
+    """DSN of a disposable database for Postgres benchmarks (BENCH_POSTGRES_DSN)."""
+    return os.getenv("BENCH_POSTGRES_DSN")
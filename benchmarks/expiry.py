@@ -0,0 +1,62 @@
+"""Dialog expiry at 200k pending timers: claim cost per batch and drain time.
+
+Every dialog is a sorted-set member scored by its expiry, not an asyncio
+task; the rows show that claiming a batch stays flat while the set is large,
+and how long one scheduler takes to end a burst of dialogs that all expired
+at once (state reset + hash delete per participant, no Telegram calls).
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.expiry
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from benchmarks.common import make_redis, percentile, print_table
+from storage.redis_store import DIALOG_EXPIRY_KEY, RedisStorage
+
+PENDING = 200_000
+DUE = 20_000
+BATCH = 500
+
+
+async def fill(store: RedisStorage, now: float) -> None:
+    await store.redis.flushdb()
+    for offset in range(0, PENDING, 5_000):
+        pipe = store.redis.pipeline(transaction=False)
+        for idx in range(offset, offset + 5_000):
+            dialog_id = f"d-{idx}"
+            # The first DUE dialogs are already past their expiry.
+            expires_at = now - 1 if idx < DUE else now + 3600 + idx
+            pipe.hset(f"dialog:{dialog_id}", mapping={"user1": 2 * idx, "user2": 2 * idx + 1, "expires_at": expires_at})
+            pipe.set(f"user:{2 * idx}:dialog_id", dialog_id)
+            pipe.set(f"user:{2 * idx + 1}:dialog_id", dialog_id)
+            pipe.zadd(DIALOG_EXPIRY_KEY, {dialog_id: expires_at})
+        await pipe.execute()
+
+
+async def main() -> None:
+    store = RedisStorage(make_redis())
+    now = time.time()
+    await fill(store, now)
+    samples = []
+    ended = 0
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        claimed, dialogs = await store.expire_dialogs(now, BATCH)
+        samples.append((time.perf_counter() - batch_started) * 1000)
+        ended += len(dialogs)
+        if claimed < BATCH:
+            break
+    drain = time.perf_counter() - started
+    remaining = await store.redis.zcard(DIALOG_EXPIRY_KEY)
+    print_table(
+        ["pending", "due", "ended", "left", "batch p50 ms", "batch p99 ms", "drain s"],
+        [[PENDING, DUE, ended, remaining, f"{percentile(samples, 50):.2f}", f"{percentile(samples, 99):.2f}", f"{drain:.2f}"]],
+    )
+    await store.redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
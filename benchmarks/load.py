@@ -0,0 +1,313 @@
+"""End-to-end load: simulated users driving handlers/chat.py via feed_update.
+
+Every simulated user walks the bot's state machine with a weighted mix of
+actions (search / cancel, dialog relay / end / report, topic creation,
+browsing) and a random think time between messages. Updates go through the
+same Dispatcher setup as app.py (ServicesMiddleware + chat router) and the
+Matchmaker loop runs alongside, so background matching is part of the load.
+Telegram is replaced by a session that answers every call locally and counts
+it.
+
+Redis is fakeredis unless BENCH_REDIS_URL is set; Postgres writes go to an
+in-memory recorder unless BENCH_POSTGRES_DSN is set (then through
+PostgresWriteBehind as in production).
+
+Results are compared with benchmarks/baselines/load.json for the same
+profile (redis/postgres backend + users); --save-baseline records a new one.
+
+    python -m benchmarks.load --users 200 --duration 10
+    python -m benchmarks.load --users 200 --duration 10 --save-baseline
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import CopyMessage
+from aiogram.types import Chat, Message, MessageId, Update
+
+from app import ServicesMiddleware
+from benchmarks.common import percentile, postgres_dsn, print_table
+from bot_config import Settings
+from handlers.chat import router as chat_router
+from keyboards import (
+    BTN_BACK,
+    BTN_BROWSE_TOPICS,
+    BTN_CANCEL,
+    BTN_CANCEL_SEARCH,
+    BTN_CONFIRM,
+    BTN_CREATE_TOPIC,
+    BTN_END_DIALOG,
+    BTN_FIND,
+    BTN_NEXT_TOPIC,
+    BTN_REPORT,
+    BTN_START_DIALOG,
+)
+from shared.metrics import REDIS_SECONDS, instrument_redis
+from services.matchmaker import Matchmaker
+from services.matchmaking import MatchmakingService
+from services.relay import MediaRelay
+from states import UserState
+from storage.last_seen import LastSeenTracker
+from storage.partner_cache import PartnerCache
+from storage.pg_writer import PostgresWriteBehind
+from storage.postgres_store import PostgresStorage
+from storage.redis_store import RedisStorage
+
+BASELINES = Path(__file__).with_name("baselines") / "load.json"
+
+# Next message per state: (weight, text, action label).
+MIX: dict[UserState, list[tuple[float, str, str]]] = {
+    UserState.IDLE: [
+        (0.50, BTN_FIND, "search"),
+        (0.15, BTN_CREATE_TOPIC, "create_topic"),
+        (0.25, BTN_BROWSE_TOPICS, "browse"),
+        (0.10, "/start", "start"),
+    ],
+    UserState.SEARCHING: [(0.25, BTN_CANCEL_SEARCH, "cancel"), (0.75, "есть кто?", "search_poll")],
+    UserState.CREATE_TOPIC: [(0.90, "topic", "topic_text"), (0.10, BTN_CANCEL, "topic_cancel")],
+    UserState.CONFIRM_TOPIC: [(0.80, BTN_CONFIRM, "topic_confirm"), (0.20, BTN_CANCEL, "topic_cancel")],
+    UserState.BROWSING_TOPICS: [
+        (0.60, BTN_NEXT_TOPIC, "browse_next"),
+        (0.30, BTN_BACK, "browse_back"),
+        (0.10, BTN_START_DIALOG, "browse_start_dialog"),
+    ],
+    UserState.IN_DIALOG: [(0.85, "привет", "relay"), (0.13, BTN_END_DIALOG, "end_dialog"), (0.02, BTN_REPORT, "report")],
+    UserState.BANNED: [(1.0, "/start", "start")],
+}
+
+
+class FakeTelegramSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.calls: dict[str, int] = {}
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method: Any, timeout: int | None = None) -> Any:
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self._message_id += 1
+        if isinstance(method, CopyMessage):
+            return MessageId(message_id=self._message_id)
+        chat_id = getattr(method, "chat_id", 0)
+        return Message(message_id=self._message_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"))
+
+    async def stream_content(self, *args: Any, **kwargs: Any):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self) -> None:
+        return None
+
+
+class MemoryPG:
+    def __init__(self):
+        self.writes = 0
+
+    async def _write(self, *args: Any, **kwargs: Any) -> None:
+        self.writes += 1
+
+    create_dialog = end_dialog = create_topic = create_report = upsert_user = _write
+
+    async def touch_users(self, seen: list) -> None:
+        self.writes += len(seen)
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update.model_validate(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "load"},
+                "text": text,
+            },
+        }
+    )
+
+
+def make_redis_pair() -> tuple[Any, Any]:
+    # The bot and the load driver (which polls user states) get separate
+    # clients on the same data, so only the bot's commands are counted.
+    url = os.getenv("BENCH_REDIS_URL")
+    if url:
+        from redis.asyncio import Redis
+
+        return Redis.from_url(url), Redis.from_url(url)
+    from fakeredis import FakeServer
+    from fakeredis import aioredis as fake_aioredis
+
+    server = FakeServer()
+    return fake_aioredis.FakeRedis(server=server), fake_aioredis.FakeRedis(server=server)
+
+
+def redis_round_trips() -> int:
+    return sum(child.count for child in REDIS_SECONDS._children.values())
+
+
+class LoadRun:
+    def __init__(self, dp: Dispatcher, bot: Bot, redis: RedisStorage, args: argparse.Namespace):
+        self.dp = dp
+        self.bot = bot
+        self.redis = redis
+        self.args = args
+        self.latencies: list[float] = []
+        self.actions: dict[str, int] = {}
+        self.errors = 0
+        self._update_id = 0
+
+    async def user(self, user_id: int, deadline: float) -> None:
+        rng = random.Random(self.args.seed * 1_000_003 + user_id)
+        await self.send(user_id, "/start", "start")
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(rng.expovariate(1000 / self.args.think_ms))
+            state = await self.redis.get_state(user_id)
+            weights, texts, labels = zip(*MIX[state])
+            idx = rng.choices(range(len(texts)), weights=weights)[0]
+            await self.send(user_id, texts[idx], labels[idx])
+
+    async def send(self, user_id: int, text: str, label: str) -> None:
+        self._update_id += 1
+        update = make_update(self._update_id, user_id, text)
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            self.errors += 1
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.actions[label] = self.actions.get(label, 0) + 1
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    redis_client, driver_client = make_redis_pair()
+    instrument_redis(redis_client)
+    await redis_client.flushdb()
+    redis_store = RedisStorage(redis_client, PartnerCache(10_000))
+    dsn = postgres_dsn()
+    background: list[asyncio.Task] = []
+    pg_store = None
+    if dsn:
+        pg_store = await PostgresStorage.from_dsn(dsn)
+        pg: Any = PostgresWriteBehind(redis_client, pg_store, "load")
+        background.append(asyncio.create_task(pg.run()))
+        touch_target: Any = pg_store
+    else:
+        pg = touch_target = MemoryPG()
+    settings = Settings(bot_token="42:LOAD", redis_url="", postgres_dsn="", ban_ttl_seconds=2, search_timeout_seconds=5)
+    last_seen = LastSeenTracker(redis_client, touch_target, "load")
+
+    session = FakeTelegramSession()
+    bot = Bot("42:LOAD", session=session)
+    dp = Dispatcher()
+    dp["settings"] = settings
+    relay = MediaRelay()
+    dp.message.middleware(ServicesMiddleware(redis_store, pg, last_seen, relay))
+    dp.include_router(chat_router)
+    matchmaking = MatchmakingService(redis_store, pg, settings.dialog_ttl_seconds, settings.search_timeout_seconds)
+    background.append(asyncio.create_task(Matchmaker(matchmaking, redis_store, bot, tick_seconds=0.2).run()))
+
+    load = LoadRun(dp, bot, RedisStorage(driver_client), args)
+    round_trips_before = redis_round_trips()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(load.user(user_id, deadline) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+    round_trips = redis_round_trips() - round_trips_before
+    await relay.close()
+
+    for task in background[-1:]:
+        task.cancel()
+    await asyncio.gather(*background[-1:], return_exceptions=True)
+    if dsn:
+        pg.close()
+        await background[0]
+        await pg_store.close()
+    await redis_client.aclose()
+    await driver_client.aclose()
+
+    updates = len(load.latencies)
+    return {
+        "updates": updates,
+        "errors": load.errors,
+        "throughput": updates / elapsed,
+        "p50_ms": percentile(load.latencies, 50),
+        "p95_ms": percentile(load.latencies, 95),
+        "p99_ms": percentile(load.latencies, 99),
+        "redis_ops_per_update": round_trips / max(1, updates),
+        "telegram_calls_per_update": sum(session.calls.values()) / max(1, updates),
+        "actions": dict(sorted(load.actions.items())),
+    }
+
+
+def profile_name(args: argparse.Namespace) -> str:
+    redis_kind = "redis" if os.getenv("BENCH_REDIS_URL") else "fakeredis"
+    pg_kind = "postgres" if postgres_dsn() else "memory"
+    return f"{redis_kind}-{pg_kind}-{args.users}u"
+
+
+def compare(result: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    # Lower is better for everything except throughput.
+    regressions = []
+    for key in ("p50_ms", "p95_ms", "p99_ms", "redis_ops_per_update", "telegram_calls_per_update"):
+        if result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]:.3f} -> {result[key]:.3f}")
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput: {baseline['throughput']:.1f} -> {result['throughput']:.1f}")
+    return regressions
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--think-ms", type=float, default=200.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    result = await run(args)
+    profile = profile_name(args)
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    baseline = baselines.get(profile)
+
+    rows = []
+    for key in ("updates", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms", "redis_ops_per_update", "telegram_calls_per_update"):
+        value = result[key]
+        base = baseline.get(key) if baseline else None
+        fmt = (lambda v: f"{v:.3f}") if isinstance(value, float) else str
+        rows.append([key, fmt(value), fmt(base) if base is not None else "-"])
+    print(f"profile {profile}")
+    print_table(["metric", "run", "baseline"], rows)
+    print("actions:", ", ".join(f"{name}={count}" for name, count in result["actions"].items()))
+
+    if args.save_baseline:
+        baselines[profile] = {k: round(v, 4) for k, v in result.items() if k != "actions"}
+        BASELINES.parent.mkdir(exist_ok=True)
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"baseline saved to {BASELINES}")
+        return
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("REGRESSIONS (tolerance %.0f%%):" % (args.tolerance * 100))
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("no regressions against baseline")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
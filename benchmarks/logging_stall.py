@@ -0,0 +1,103 @@
+"""Event-loop stalls from hot-path logging at 5k msg/s.
+
+Each simulated message runs the log calls of on_message -> handle_idle ->
+begin_search. "before" is the previous setup: basicConfig-style synchronous
+StreamHandler and eager f-strings at INFO. "after" is setup_logging(): lazy
+messages with extra= fields, per-call-site sampling, and a QueueHandler that
+hands records to a writer thread. The sink sleeps 200 us per write to stand in
+for a congested stderr pipe.
+
+    python -m benchmarks.logging_stall
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from benchmarks.common import percentile, print_table
+from logging_setup import setup_logging
+
+RATE = 5_000
+SECONDS = 2.0
+TICK = 0.01
+
+
+class SlowStream:
+    def write(self, text: str) -> int:
+        time.sleep(0.0002)
+        return len(text)
+
+    def flush(self) -> None:
+        return None
+
+
+def reset_root() -> logging.Logger:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    return root
+
+
+def before_calls(logger: logging.Logger, user_id: int, text: str) -> None:
+    logger.info(f"on_message: user={user_id}, state=UserState.IDLE, text={text!r}")
+    logger.info(f"handle_idle: user={user_id}, text={text!r}")
+    logger.info(f"begin_search: user={user_id}")
+    logger.info(f"begin_search: user={user_id} added to queue")
+
+
+def after_calls(logger: logging.Logger, user_id: int, text: str) -> None:
+    logger.debug("message", extra={"user": user_id, "state": "IDLE"})
+    logger.info("search started", extra={"user": user_id})
+
+
+async def monitor(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        expected = time.perf_counter() + 0.001
+        await asyncio.sleep(0.001)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+
+async def drive(calls) -> tuple[list[float], float]:
+    logger = logging.getLogger("services.matchmaking")
+    lags: list[float] = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(monitor(lags, stop))
+    per_tick = int(RATE * TICK)
+    sent = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < SECONDS:
+        tick_started = time.perf_counter()
+        for _ in range(per_tick):
+            calls(logger, sent, "Найти собеседника")
+            sent += 1
+        await asyncio.sleep(max(0.0, TICK - (time.perf_counter() - tick_started)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    return lags, sent / elapsed
+
+
+async def main() -> None:
+    rows = []
+
+    root = reset_root()
+    handler = logging.StreamHandler(SlowStream())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    lags, achieved = await drive(before_calls)
+    rows.append(["before", f"{achieved:.0f}", f"{percentile(lags, 50):.2f}", f"{percentile(lags, 99):.2f}", f"{max(lags):.2f}"])
+
+    reset_root()
+    listener = setup_logging("INFO", "kv", sample_rate=10, stream=SlowStream())
+    lags, achieved = await drive(after_calls)
+    listener.stop()
+    rows.append(["after", f"{achieved:.0f}", f"{percentile(lags, 50):.2f}", f"{percentile(lags, 99):.2f}", f"{max(lags):.2f}"])
+
+    reset_root()
+    print_table(["logging", "msg/s", "lag p50 ms", "lag p99 ms", "lag max ms"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""Match latency vs. search queue depth.
+
+Compares the scripted MatchmakingService.try_match with the previous
+LPOP/GET/RPUSH loop. Half of the queued users are stale (no longer SEARCHING),
+which is what the old loop had to walk and re-queue on every attempt.
+
+    python -m benchmarks.matchmaking            # fakeredis
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.matchmaking
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from uuid import uuid4
+
+from benchmarks.common import make_redis, percentile, print_table
+from services.matchmaking import MatchmakingService
+from states import UserState
+from storage.redis_store import SEARCH_QUEUE_KEY, RedisStorage
+
+DEPTHS = (10, 100, 1000, 5000)
+ATTEMPTS = 50
+
+
+class NullPG:
+    async def create_dialog(self, dialog_id, user1, user2, wait_seconds=None):
+        return None
+
+
+async def legacy_try_match(redis: RedisStorage, user_id: int, ttl: int) -> int | None:
+    seen: list[int] = []
+    partner: int | None = None
+    while True:
+        candidate = await redis.dequeue_search()
+        if candidate is None:
+            break
+        if candidate == user_id:
+            seen.append(candidate)
+            continue
+        if await redis.get_state(candidate) == UserState.SEARCHING:
+            partner = candidate
+            break
+        seen.append(candidate)
+    for item in seen:
+        if item != partner:
+            await redis.enqueue_search(item)
+    if partner is None:
+        return None
+    dialog_id = str(uuid4())
+    await redis.create_dialog(dialog_id, {"user1": user_id, "user2": partner}, ttl)
+    await redis.set_dialog(user_id, dialog_id)
+    await redis.set_dialog(partner, dialog_id)
+    await redis.set_state(user_id, UserState.IN_DIALOG)
+    await redis.set_state(partner, UserState.IN_DIALOG)
+    return partner
+
+
+async def fill_queue(store: RedisStorage, depth: int) -> None:
+    await store.redis.flushdb()
+    pipe = store.redis.pipeline(transaction=False)
+    for user_id in range(depth):
+        # Stale users first: they sit in front of every real searcher.
+        state = UserState.IDLE if user_id < depth // 2 else UserState.SEARCHING
+        pipe.set(f"user:{user_id}:state", state.value)
+        pipe.zadd(SEARCH_QUEUE_KEY, {user_id: user_id})
+    await pipe.execute()
+
+
+async def measure(store: RedisStorage, depth: int, scripted: bool) -> list[float]:
+    samples: list[float] = []
+    service = MatchmakingService(store, NullPG(), 3600)
+    for attempt in range(ATTEMPTS):
+        await fill_queue(store, depth)
+        user_id = depth + attempt
+        await store.set_state(user_id, UserState.SEARCHING)
+        started = time.perf_counter()
+        if scripted:
+            await service.try_match(user_id)
+        else:
+            await legacy_try_match(store, user_id, 3600)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+async def main() -> None:
+    store = RedisStorage(make_redis())
+    rows = []
+    for depth in DEPTHS:
+        for scripted in (False, True):
+            samples = await measure(store, depth, scripted)
+            rows.append([
+                depth,
+                "script" if scripted else "legacy",
+                f"{percentile(samples, 50):.3f}",
+                f"{percentile(samples, 99):.3f}",
+            ])
+    print_table(["depth", "impl", "p50 ms", "p99 ms"], rows)
+    await store.redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
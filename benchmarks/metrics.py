@@ -0,0 +1,63 @@
+"""Per-update cost of the metrics layer (budget: under 5 us).
+
+Times a no-op handler called directly and through timed_handler, which is
+what ServicesMiddleware and UpdateMetricsMiddleware add to every update, plus
+the raw counter/histogram operations.
+
+    python -m benchmarks.metrics
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from benchmarks.common import print_table
+from shared.metrics import Registry, timed_handler
+
+ROUNDS = 200_000
+BUDGET_US = 5.0
+
+
+async def handler(event, data) -> None:
+    return None
+
+
+async def per_call_us(call) -> float:
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(ROUNDS):
+            await call()
+        best = min(best, (time.perf_counter() - started) / ROUNDS * 1e6)
+    return best
+
+
+async def main() -> None:
+    registry = Registry()
+    counter = registry.counter("c_total", "c", ("outcome",))
+    histogram = registry.histogram("h_seconds", "h")
+
+    async def direct():
+        await handler(None, {})
+
+    async def timed():
+        await timed_handler(handler, None, {})
+
+    async def raw():
+        histogram.observe(0.003)
+        counter.labels("ok").inc()
+
+    baseline = await per_call_us(direct)
+    wrapped = await per_call_us(timed)
+    rows = [
+        ["direct handler", f"{baseline:.3f}", ""],
+        ["timed_handler", f"{wrapped:.3f}", f"{wrapped - baseline:.3f}"],
+        ["observe + inc", f"{await per_call_us(raw):.3f}", ""],
+    ]
+    print_table(["path", "us/call", "overhead us"], rows)
+    overhead = wrapped - baseline
+    print(f"per-update overhead {overhead:.3f} us ({'within' if overhead < BUDGET_US else 'OVER'} {BUDGET_US} us budget)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""Bot API calls and delivery time per relayed album.
+
+Each round, one sender posts an album whose items arrive as separate updates
+30-80 ms apart (as Telegram delivers them), followed by a text message. All
+sends go through a SendScheduler at the default per-chat rate of one call per
+second. "single" is the old path: safe_copy_to for every update. "relay" is
+MediaRelay with its default linger and delay settings.
+
+    python -m benchmarks.relay
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks.common import print_table
+from services.relay import MediaRelay
+from services.safe_sender import install_scheduler, safe_copy_to
+from services.send_scheduler import SendScheduler
+
+ALBUM_SIZES = (2, 5, 10)
+ROUNDS = 3
+PARTNER = 2
+
+
+class CountingBot:
+    def __init__(self):
+        self.calls = 0
+        self.delivered = 0
+        self.last_at = 0.0
+
+    def _record(self, messages: int) -> None:
+        self.calls += 1
+        self.delivered += messages
+        self.last_at = time.monotonic()
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids):
+        self._record(len(message_ids))
+
+
+class AlbumItem:
+    def __init__(self, bot: CountingBot, message_id: int, media_group_id: str | None):
+        self.bot = bot
+        self.message_id = message_id
+        self.media_group_id = media_group_id
+        self.chat = SimpleNamespace(id=1)
+
+    async def send_copy(self, chat_id):
+        self.bot._record(1)
+
+
+async def run_round(name: str, size: int, rng: random.Random) -> tuple[int, float]:
+    bot = CountingBot()
+    scheduler = SendScheduler()
+    install_scheduler(scheduler)
+    runner = scheduler.start()
+    relay = MediaRelay()
+    items = [AlbumItem(bot, idx, "album") for idx in range(size)] + [AlbumItem(bot, size, None)]
+    pending = []
+    started = time.monotonic()
+    for item in items:
+        if name == "single":
+            pending.append(asyncio.create_task(safe_copy_to(item, PARTNER)))
+        else:
+            relay.relay(item, PARTNER)
+        await asyncio.sleep(rng.uniform(0.03, 0.08))
+    await asyncio.gather(*pending)
+    await relay.close()
+    runner.cancel()
+    install_scheduler(None)
+    assert bot.delivered == len(items)
+    return bot.calls, bot.last_at - started
+
+
+async def main() -> None:
+    logging.disable(logging.WARNING)
+    rng = random.Random(1)
+    rows = []
+    for size in ALBUM_SIZES:
+        for name in ("single", "relay"):
+            calls, seconds = 0, 0.0
+            for _ in range(ROUNDS):
+                round_calls, elapsed = await run_round(name, size, rng)
+                calls += round_calls
+                seconds += elapsed
+            rows.append([size, name, f"{calls / ROUNDS:.1f}", f"{seconds / ROUNDS:.2f}"])
+    print_table(["album", "impl", "calls/album", "delivered_s"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
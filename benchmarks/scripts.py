@@ -0,0 +1,89 @@
+"""Bytes on the wire and latency of the bot match path: EVAL vs registry.
+
+The match path is find_match followed by create_dialog. EVAL ships both Lua
+sources on every call; the registry sends a 40-byte SHA (EVALSHA) or the
+function name (FCALL on Redis 7).
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.scripts
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from redis.connection import Connection
+
+from benchmarks.common import make_redis, percentile, print_table
+from bot.storage.redis_client import SEARCH_QUEUE_KEY
+from bot.storage.scripts import CREATE_DIALOG, FIND_MATCH, ScriptRegistry
+
+ROUNDS = 2_000
+
+
+def wire_bytes(*args) -> int:
+    return sum(len(chunk) for chunk in Connection().pack_command(*args))
+
+
+def match_path_args(user1: int, user2: int) -> list[tuple[str, list, list]]:
+    return [
+        ("find_match", [SEARCH_QUEUE_KEY], []),
+        (
+            "create_dialog",
+            [f"user:{user1}:state", f"user:{user2}:state", SEARCH_QUEUE_KEY],
+            [str(user1), str(user2), "00000000-0000-0000-0000-000000000000", "", "2026-01-01 00:00:00"],
+        ),
+    ]
+
+
+async def seed(redis, user1: int, user2: int) -> None:
+    pipe = redis.pipeline(transaction=False)
+    pipe.zadd(SEARCH_QUEUE_KEY, {user1: 1.0, user2: 2.0})
+    pipe.set(f"user:{user1}:state", "SEARCHING")
+    pipe.set(f"user:{user2}:state", "SEARCHING")
+    await pipe.execute()
+
+
+async def main() -> None:
+    redis = make_redis()
+    registry = ScriptRegistry()
+    await registry.load(redis)
+    sources = {"find_match": FIND_MATCH, "create_dialog": CREATE_DIALOG}
+
+    sizes = {"EVAL": 0, "EVALSHA": 0, "FCALL": 0}
+    for name, keys, args in match_path_args(1, 2):
+        sha = "0" * 40
+        sizes["EVAL"] += wire_bytes("EVAL", sources[name], len(keys), *keys, *args)
+        sizes["EVALSHA"] += wire_bytes("EVALSHA", sha, len(keys), *keys, *args)
+        sizes["FCALL"] += wire_bytes("FCALL", f"{registry.library}_{name}", len(keys), *keys, *args)
+
+    samples: dict[str, list[float]] = {"EVAL": [], "registry": []}
+    for round_no in range(ROUNDS):
+        user1, user2 = 2 * round_no, 2 * round_no + 1
+        for mode in samples:
+            await seed(redis, user1, user2)
+            started = time.perf_counter()
+            for name, keys, args in match_path_args(user1, user2):
+                if mode == "EVAL":
+                    await redis.eval(sources[name], len(keys), *keys, *args)
+                else:
+                    await registry.call(redis, name, keys, args)
+            samples[mode].append((time.perf_counter() - started) * 1000)
+
+    registry_mode = "FCALL" if registry.use_functions else "EVALSHA"
+    print_table(
+        ["mode", "bytes/match", "p50 ms", "p99 ms"],
+        [
+            ["EVAL", sizes["EVAL"], f"{percentile(samples['EVAL'], 50):.3f}", f"{percentile(samples['EVAL'], 99):.3f}"],
+            [
+                registry_mode,
+                sizes[registry_mode],
+                f"{percentile(samples['registry'], 50):.3f}",
+                f"{percentile(samples['registry'], 99):.3f}",
+            ],
+        ],
+    )
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
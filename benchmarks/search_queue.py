@@ -0,0 +1,66 @@
+"""Search queue operations at 10k/100k waiting users: list vs sorted set.
+
+Each row times the Redis command begin_search/cancel_search issue for a user
+somewhere in the middle of the queue, plus the pop the matcher does. The list
+columns are the old LREM/RPUSH/LPOP on search:queue; the sorted-set columns
+are the current ZREM/ZADD/ZPOPMIN on search:waiting.
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.search_queue
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+
+from benchmarks.common import make_redis, percentile, print_table
+from storage.redis_store import LEGACY_SEARCH_QUEUE_KEY, SEARCH_QUEUE_KEY, RedisStorage
+
+DEPTHS = (10_000, 100_000)
+OPERATIONS = 200
+
+
+async def fill(store: RedisStorage, depth: int) -> None:
+    await store.redis.flushdb()
+    for offset in range(0, depth, 10_000):
+        chunk = range(offset, min(depth, offset + 10_000))
+        pipe = store.redis.pipeline(transaction=False)
+        pipe.rpush(LEGACY_SEARCH_QUEUE_KEY, *chunk)
+        pipe.zadd(SEARCH_QUEUE_KEY, {user_id: float(user_id) for user_id in chunk})
+        await pipe.execute()
+
+
+async def timed(operation) -> float:
+    started = time.perf_counter()
+    await operation
+    return (time.perf_counter() - started) * 1000
+
+
+async def main() -> None:
+    store = RedisStorage(make_redis())
+    rows = []
+    for depth in DEPTHS:
+        await fill(store, depth)
+        users = random.sample(range(depth // 4, depth), OPERATIONS)
+        results: dict[str, list[float]] = {}
+        for user_id in users:
+            # begin_search on the list: remove any old entry, then push.
+            results.setdefault("list requeue", []).append(
+                await timed(store.redis.lrem(LEGACY_SEARCH_QUEUE_KEY, 0, user_id))
+                + await timed(store.redis.rpush(LEGACY_SEARCH_QUEUE_KEY, user_id))
+            )
+            results.setdefault("zset requeue", []).append(await timed(store.enqueue_search(user_id, now=depth + user_id)))
+        for user_id in users:
+            results.setdefault("list cancel", []).append(await timed(store.redis.lrem(LEGACY_SEARCH_QUEUE_KEY, 0, user_id)))
+            results.setdefault("zset cancel", []).append(await timed(store.remove_from_queue(user_id)))
+        for _ in range(OPERATIONS):
+            results.setdefault("list pop", []).append(await timed(store.redis.lpop(LEGACY_SEARCH_QUEUE_KEY)))
+            results.setdefault("zset pop", []).append(await timed(store.dequeue_search()))
+        for name, samples in results.items():
+            rows.append([depth, name, f"{percentile(samples, 50):.3f}", f"{percentile(samples, 99):.3f}"])
+    print_table(["depth", "op", "p50 ms", "p99 ms"], rows)
+    await store.redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""Burst of match notifications against a fake Bot that enforces Telegram limits.
+
+The fake answers 429 (retry_after=1) when more than 30 calls land in any
+second globally or more than one per second in a chat. "direct" is the old
+behaviour: every coroutine sends on its own and sleeps after a 429.
+
+The second table is dispatch overhead alone: a backlog of two sends to each
+of N chats, no global limit, one send per second per chat. It times how long
+the first send of every chat takes to go out while the second ones wait.
+
+    python -m benchmarks.send_scheduler
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from benchmarks.common import print_table
+from services.safe_sender import _retry_op
+from services.send_scheduler import PRIORITY_NOTIFY, SendScheduler
+
+CHATS = 75
+MESSAGES_PER_CHAT = 2
+# Sliding windows are slightly shorter than a second so timer jitter in the
+# fake does not count as a violation.
+WINDOW = 0.98
+
+
+class LimitedBot:
+    def __init__(self):
+        self.sent = 0
+        self.rejected = 0
+        self._global: deque[float] = deque()
+        self._chats: dict[int, deque[float]] = defaultdict(deque)
+
+    async def send_message(self, chat_id: int, text: str):
+        now = time.monotonic()
+        for window in (self._global, self._chats[chat_id]):
+            while window and now - window[0] > WINDOW:
+                window.popleft()
+        if len(self._global) >= 30 or self._chats[chat_id]:
+            self.rejected += 1
+            raise TelegramRetryAfter(SendMessage(chat_id=chat_id, text=text), "Too Many Requests", 1)
+        self._global.append(now)
+        self._chats[chat_id].append(now)
+        self.sent += 1
+
+
+async def direct(bot: LimitedBot, jobs: list[int]) -> None:
+    await asyncio.gather(*(_retry_op(lambda c=chat: bot.send_message(c, "hi"), retries=10) for chat in jobs))
+
+
+async def scheduled(bot: LimitedBot, jobs: list[int]) -> None:
+    scheduler = SendScheduler(global_rate=30, per_chat_rate=1)
+    runner = scheduler.start()
+    await asyncio.gather(
+        *(scheduler.submit(chat, lambda c=chat: bot.send_message(c, "hi"), PRIORITY_NOTIFY) for chat in jobs)
+    )
+    runner.cancel()
+
+
+async def backlog(chats: int) -> float:
+    scheduler = SendScheduler(global_rate=1e9, per_chat_rate=1)
+    sent = 0
+    done = asyncio.Event()
+
+    async def send():
+        nonlocal sent
+        sent += 1
+        if sent == chats:
+            done.set()
+
+    runner = scheduler.start()
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    jobs = [asyncio.create_task(scheduler.submit(idx // 2, send, PRIORITY_NOTIFY)) for idx in range(2 * chats)]
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    runner.cancel()
+    await asyncio.gather(*jobs, return_exceptions=True)
+    return elapsed
+
+
+async def main() -> None:
+    logging.disable(logging.ERROR)
+    jobs = [chat for chat in range(CHATS) for _ in range(MESSAGES_PER_CHAT)]
+    rows = []
+    for name, runner in (("direct", direct), ("scheduler", scheduled)):
+        bot = LimitedBot()
+        started = time.monotonic()
+        await runner(bot, jobs)
+        elapsed = time.monotonic() - started
+        rows.append([name, bot.sent, bot.rejected, f"{elapsed:.1f}", f"{bot.sent / elapsed:.1f}"])
+    print_table(["impl", "sent", "429s", "seconds", "msg/s"], rows)
+    print()
+    rows = []
+    for chats in (1_000, 5_000, 20_000):
+        elapsed = await backlog(chats)
+        rows.append([chats, f"{elapsed:.2f}", f"{elapsed / chats * 1e6:.1f}"])
+    print_table(["chats", "seconds", "us/send"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""Update throughput: long polling vs webhook + UpdatePool.
+
+Handlers simulate a Redis/Telegram round trip with a short sleep. Polling is
+modelled the way aiogram runs it: getUpdates batches of 100 (one API round
+trip each) fed to the dispatcher either sequentially or as one task per
+update. The webhook run POSTs the same updates over local HTTP with 40
+concurrent connections (Telegram's default max_connections).
+
+    python -m benchmarks.webhook
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message, Update
+from aiohttp import ClientSession, web
+
+from benchmarks.common import print_table
+from shared.webhook import UpdatePool, build_webhook_app
+
+UPDATES = 5_000
+USERS = 500
+HANDLER_LATENCY = 0.005
+POLL_RTT = 0.05
+POLL_BATCH = 100
+CONNECTIONS = 40
+PORT = 8089
+
+
+def make_updates() -> list[dict]:
+    return [
+        {
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": 0,
+                "chat": {"id": i % USERS + 1, "type": "private"},
+                "from": {"id": i % USERS + 1, "is_bot": False, "first_name": "u"},
+                "text": str(i),
+            },
+        }
+        for i in range(UPDATES)
+    ]
+
+
+def make_dispatcher(seen: dict[int, list[int]]) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def handle(message: Message) -> None:
+        await asyncio.sleep(HANDLER_LATENCY)
+        seen.setdefault(message.from_user.id, []).append(int(message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def reordered(seen: dict[int, list[int]]) -> int:
+    return sum(1 for ids in seen.values() for a, b in zip(ids, ids[1:]) if b < a)
+
+
+async def run_polling(bot: Bot, raw: list[dict], as_tasks: bool) -> tuple[float, int]:
+    seen: dict[int, list[int]] = {}
+    dp = make_dispatcher(seen)
+    started = time.perf_counter()
+    tasks = []
+    for offset in range(0, len(raw), POLL_BATCH):
+        await asyncio.sleep(POLL_RTT)
+        for item in raw[offset : offset + POLL_BATCH]:
+            update = Update.model_validate(item, context={"bot": bot})
+            if as_tasks:
+                tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+            else:
+                await dp.feed_update(bot, update)
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, reordered(seen)
+
+
+async def run_webhook(bot: Bot, raw: list[dict], workers: int) -> tuple[float, int]:
+    seen: dict[int, list[int]] = {}
+    pool = UpdatePool(make_dispatcher(seen), bot, workers=workers, queue_size=UPDATES)
+    runner = web.AppRunner(build_webhook_app(pool, "/webhook"), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", PORT)
+    await site.start()
+    pool.start()
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in raw:
+        queue.put_nowait(item)
+
+    async def sender(session: ClientSession) -> None:
+        # Telegram waits for the response before sending the next update of a chat.
+        while not queue.empty():
+            item = queue.get_nowait()
+            async with session.post(f"http://127.0.0.1:{PORT}/webhook", json=item) as response:
+                assert response.status == 200
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(CONNECTIONS)))
+    await pool.stop(timeout=60)
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return elapsed, reordered(seen)
+
+
+async def main() -> None:
+    bot = Bot("42:BENCH")
+    raw = make_updates()
+    rows = []
+    for name, runner in (
+        ("polling sequential", lambda: run_polling(bot, raw, as_tasks=False)),
+        ("polling tasks", lambda: run_polling(bot, raw, as_tasks=True)),
+        ("webhook 8 lanes", lambda: run_webhook(bot, raw, 8)),
+        ("webhook 32 lanes", lambda: run_webhook(bot, raw, 32)),
+    ):
+        elapsed, out_of_order = await runner()
+        rows.append([name, f"{elapsed:.2f}", f"{UPDATES / elapsed:.0f}", out_of_order])
+    print_table(["mode", "seconds", "updates/s", "out of order"], rows)
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
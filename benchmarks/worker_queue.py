@@ -0,0 +1,97 @@
+"""bot/worker.py throughput: old BLPOP loop vs the Redis Streams worker.
+
+Each row drains TASKS queued tasks whose handler awaits HANDLER_MS of
+simulated I/O (a Telegram call, a cleanup script). The BLPOP row replays the
+previous loop: one task per round trip, handled before the next pop. The
+streams rows run Worker with the given consumers and per-worker concurrency.
+
+    BENCH_REDIS_URL=redis://localhost:6380/1 python -m benchmarks.worker_queue
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+from benchmarks.common import print_table
+from bot.storage.redis_client import RedisClient
+from bot.worker import Worker
+
+TASKS = 2_000
+HANDLER_MS = (0.0, 1.0)
+LEGACY_QUEUE = "bench:legacy_queue"
+STREAM = "bench:tasks"
+
+
+class BenchWorker(Worker):
+    def __init__(self, redis, consumer, handler_ms, **kwargs):
+        super().__init__(redis, db=object(), consumer=consumer, stream=STREAM, group="bench", **kwargs)
+        self.handler_ms = handler_ms
+
+    async def handle_task(self, task):
+        await asyncio.sleep(self.handler_ms / 1000)
+
+
+async def run_blpop(redis, handler_ms: float) -> float:
+    await redis.client.rpush(LEGACY_QUEUE, *(f"notify:{i}:hi" for i in range(TASKS)))
+    started = time.perf_counter()
+    done = 0
+    while done < TASKS:
+        task = await redis.client.blpop(LEGACY_QUEUE, timeout=1)
+        if task:
+            _, task_data = task
+            task_data.split(":", 1)
+            await asyncio.sleep(handler_ms / 1000)
+            done += 1
+    return time.perf_counter() - started
+
+
+async def run_streams(redis, handler_ms: float, consumers: int, concurrency: int) -> float:
+    pipe = redis.client.pipeline(transaction=False)
+    for i in range(TASKS):
+        pipe.xadd(STREAM, {"type": "notify", "data": f'{{"user_id": {i}, "text": "hi"}}'})
+    await pipe.execute()
+    workers = [BenchWorker(redis, f"c{i}", handler_ms, concurrency=concurrency) for i in range(consumers)]
+    await workers[0].ensure_group()
+    started = time.perf_counter()
+
+    async def drive(worker: Worker) -> None:
+        while sum(w.processed for w in workers) < TASKS:
+            await worker.run_once(block_ms=None)
+            await asyncio.sleep(0)
+        await worker.drain()
+
+    await asyncio.gather(*(drive(worker) for worker in workers))
+    return time.perf_counter() - started
+
+
+async def main() -> None:
+    redis = RedisClient()
+    redis.client = make_decoded_redis()
+    rows = []
+    for handler_ms in HANDLER_MS:
+        await redis.client.flushdb()
+        elapsed = await run_blpop(redis, handler_ms)
+        rows.append([handler_ms, "blpop loop", 1, 1, f"{TASKS / elapsed:,.0f}"])
+        for consumers, concurrency in ((1, 1), (1, 32), (2, 32)):
+            await redis.client.flushdb()
+            elapsed = await run_streams(redis, handler_ms, consumers, concurrency)
+            rows.append([handler_ms, "streams", consumers, concurrency, f"{TASKS / elapsed:,.0f}"])
+    print_table(["handler ms", "queue", "consumers", "concurrency", "tasks/s"], rows)
+    await redis.client.aclose()
+
+
+def make_decoded_redis():
+    # Like make_redis(), but decoding responses as the bot's client does.
+    url = os.getenv("BENCH_REDIS_URL")
+    if url:
+        from redis.asyncio import Redis
+
+        return Redis.from_url(url, decode_responses=True)
+    from fakeredis import aioredis as fake_aioredis
+
+    return fake_aioredis.FakeRedis(decode_responses=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
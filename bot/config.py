@@ -19,10 +19,34 @@ class Settings:
     TOPIC_TTL = 3600  # 1 час в секундах
     DIALOG_INACTIVITY_TTL = 1800  # 30 минут
     BAN_DURATION = 3600  # 1 час
-    MESSAGES_PER_SECOND = 30.0  # Лимит Telegram
+    USER_RATE_LIMIT = float(os.getenv('USER_RATE_LIMIT', '1'))  # сообщений в секунду на пользователя
+    USER_BURST = int(os.getenv('USER_BURST', '3'))
+    
+    # Webhook (если WEBHOOK_URL не задан - long polling)
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+    UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', '1000'))
+    
+    # Метрики Prometheus (0 - выключено)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
     
     # Воркеры (опционально)
     USE_WORKERS = os.getenv('USE_WORKERS', 'false').lower() == 'true'
-    QUEUE_NAME = "anon_chat_queue"
+    QUEUE_NAME = "anon_chat_queue"  # старая очередь-список, переносится при старте воркера
+    QUEUE_STREAM = "anon_chat_tasks"
+    DELAYED_TASKS_KEY = "anon_chat_tasks:delayed"  # отложенные задачи, score - время запуска
+    DIALOG_CLEANUP_GRACE = 300  # сколько запись диалога живет после срока (секунд)
+    QUEUE_GROUP = "workers"
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '32'))  # задач одновременно на воркер
+    WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '100'))
+    WORKER_CLAIM_IDLE_MS = int(os.getenv('WORKER_CLAIM_IDLE_MS', '60000'))  # когда забирать задачи упавшего воркера
+    WORKER_MAX_DELIVERIES = int(os.getenv('WORKER_MAX_DELIVERIES', '5'))  # попыток до переноса в QUEUE_DEAD_STREAM
+    QUEUE_DEAD_STREAM = "anon_chat_tasks:dead"  # задачи, которые не удалось выполнить
+    WORKER_SEND_ATTEMPTS = int(os.getenv('WORKER_SEND_ATTEMPTS', '5'))  # попыток отправки внутри одной задачи
 
 settings = Settings()
@@ -12,16 +12,19 @@ async def cmd_stats(message: Message, db: Database):
     if message.from_user.id not in [123456789]:  # Заменить на реальные ID админов
         return
     
-    # Получаем статистику из Redis
-    search_queue_len = await redis_client.client.llen("search:queue")
-    active_topics = await redis_client.client.scard("topics:active")
-    active_dialogs = len(await redis_client.client.keys("dialog:*")) // 2
+    # Счетчики из Redis (bot/storage/counters.py), без сканирования ключей
+    stats = await redis_client.stats()
+    ended = ", ".join(f"{reason}: {count}" for reason, count in sorted(stats.ended.items())) or "нет"
     
     stats_text = (
         f" <b>Статистика бота</b>\n\n"
-        f" В поиске: {search_queue_len}\n"
-        f" Активных тем: {active_topics}\n"
-        f" Активных диалогов: {active_dialogs}\n"
+        f" В поиске: {stats.searching}\n"
+        f" В диалогах: {stats.in_dialog}\n"
+        f" Активных диалогов: {stats.dialogs}\n"
+        f" Активных тем: {stats.topics}\n"
+        f" Активных банов: {stats.bans}\n"
+        f" Пар за минуту: {stats.matches_last_minute} (в среднем за час {stats.matches_per_minute:.1f})\n"
+        f" Завершено за час: {ended}\n"
     )
     
     await message.answer(stats_text)
@@ -87,7 +87,8 @@ async def forward_message(message: Message):
         return
     
     # Обновляем TTL диалога при активности
-    await redis_client.client.expire(f"dialog:{dialog_id}", settings.DIALOG_INACTIVITY_TTL)
+    # (и срок задачи очистки, иначе воркер завершит активный диалог)
+    await redis_client.touch_dialog(dialog_id)
     
     # Пересылаем сообщение (в реальной реализации)
     await forward_to_partner(partner_id, message)
@@ -10,6 +10,8 @@ from bot.storage.redis_client import redis_client
 from bot.storage.postgres_client import Database
 from bot.handlers import register_handlers
 from bot.utils.antiflood import ThrottlingMiddleware
+from shared.metrics import REGISTRY, UpdateMetricsMiddleware, instrument_redis, serve_metrics
+from shared.webhook import run_webhook
 
 async def main():
     # Настройка логирования
@@ -20,6 +22,9 @@ async def main():
     
     # Инициализация клиентов
     await redis_client.initialize(settings.REDIS_URL, settings.REDIS_POOL_SIZE)
+    instrument_redis(redis_client.client)
+    await redis_client.migrate_search_queue()
+    await redis_client.backfill_active_dialogs()
     db = Database(settings.DATABASE_URL)
     await db.connect()
     
@@ -31,19 +36,49 @@ async def main():
     
     dp = Dispatcher()
     
-    # Регистрация middleware
-    dp.message.middleware(ThrottlingMiddleware(rate_limit=settings.MESSAGES_PER_SECOND))
+    # Регистрация middleware (метрики - первыми, чтобы учитывать и троттлинг)
+    dp.message.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(ThrottlingMiddleware(rate=settings.USER_RATE_LIMIT, burst=settings.USER_BURST))
     
     # Регистрация хендлеров
     register_handlers(dp, db)
     
+    # Метрики
+    REGISTRY.gauge("search_queue_depth", "Users waiting for a partner", redis_client.search_queue_size)
+    REGISTRY.gauge("active_dialogs", "Dialogs in progress", lambda: live_stat("dialogs"))
+    REGISTRY.gauge("active_topics", "Topics open for replies", lambda: live_stat("topics"))
+    REGISTRY.gauge("active_bans", "Users currently banned", lambda: live_stat("bans"))
+    REGISTRY.gauge("matches_last_minute", "Dialogs created in the current minute", lambda: live_stat("matches_last_minute"))
+    metrics_runner = None
+    if settings.METRICS_PORT:
+        metrics_runner = await serve_metrics(settings.METRICS_HOST, settings.METRICS_PORT)
+    
     try:
-        await dp.start_polling(bot)
+        if settings.WEBHOOK_URL:
+            await run_webhook(
+                dp,
+                bot,
+                settings.WEBHOOK_URL,
+                host=settings.WEBHOOK_HOST,
+                port=settings.WEBHOOK_PORT,
+                path=settings.WEBHOOK_PATH,
+                secret=settings.WEBHOOK_SECRET or None,
+                workers=settings.UPDATE_WORKERS,
+                queue_size=settings.UPDATE_QUEUE_SIZE
+            )
+        else:
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await redis_client.aclose()
         await db.disconnect()
         await bot.session.close()
 
+async def live_stat(name: str) -> float:
+    """Одно значение из счетчиков для метрик (окно - текущая минута)"""
+    return getattr(await redis_client.stats(window_minutes=1), name)
+
 if __name__ == "__main__":
     asyncio.run(main())
 
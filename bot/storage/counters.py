@@ -0,0 +1,79 @@
+﻿# bot/storage/counters.py
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+# Живые значения - размеры множеств, которые меняются в тех же атомарных
+# операциях, что и состояние (скрипты bot/storage/scripts.py, ban_user).
+# Диалоги и баны - sorted set со score = момент, после которого запись точно
+# неактуальна, поэтому пропущенная очистка не раздувает счетчик.
+SEARCH_QUEUE_KEY = "search:waiting"
+ACTIVE_DIALOGS_KEY = "dialogs:active"
+ACTIVE_TOPICS_KEY = "topics:active"
+ACTIVE_BANS_KEY = "bans:active"
+
+# Поминутные хеши (поля matches, bans, ended:<причина>), см. STATS в scripts.py
+MINUTE_KEY_PREFIX = "stats:m:"
+MINUTE_KEY_TTL = 86400
+
+
+def minute_key(now: float) -> str:
+    """Ключ поминутного хеша для момента now"""
+    return f"{MINUTE_KEY_PREFIX}{int(now // 60)}"
+
+
+@dataclass
+class Stats:
+    searching: int
+    dialogs: int
+    topics: int
+    bans: int
+    matches_last_minute: int
+    # Сумма по окну window_minutes (включая текущую минуту)
+    window_minutes: int
+    matches: int
+    ended: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def in_dialog(self) -> int:
+        return self.dialogs * 2
+
+    @property
+    def matches_per_minute(self) -> float:
+        return self.matches / self.window_minutes
+
+
+async def read_stats(client: Any, window_minutes: int = 60, now: Optional[float] = None) -> Stats:
+    """Все счетчики одним pipeline; стоимость не зависит от числа пользователей"""
+    now = time.time() if now is None else now
+    pipe = client.pipeline(transaction=False)
+    pipe.zcard(SEARCH_QUEUE_KEY)
+    pipe.zcount(ACTIVE_DIALOGS_KEY, now, "+inf")
+    pipe.scard(ACTIVE_TOPICS_KEY)
+    pipe.zremrangebyscore(ACTIVE_BANS_KEY, "-inf", now)
+    pipe.zcard(ACTIVE_BANS_KEY)
+    # Диалоги, которые так и не были очищены, удаляются через сутки после срока
+    pipe.zremrangebyscore(ACTIVE_DIALOGS_KEY, "-inf", now - MINUTE_KEY_TTL)
+    for offset in range(window_minutes):
+        pipe.hgetall(minute_key(now - offset * 60))
+    searching, dialogs, topics, _expired_bans, bans, _stale, *minutes = await pipe.execute()
+
+    matches = 0
+    ended: Dict[str, int] = {}
+    for bucket in minutes:
+        for name, value in bucket.items():
+            if name == "matches":
+                matches += int(value)
+            elif name.startswith("ended:"):
+                reason = name.split(":", 1)[1]
+                ended[reason] = ended.get(reason, 0) + int(value)
+    return Stats(
+        searching=searching,
+        dialogs=dialogs,
+        topics=topics,
+        bans=bans,
+        matches_last_minute=int(minutes[0].get("matches", 0)),
+        window_minutes=window_minutes,
+        matches=matches,
+        ended=ended,
+    )
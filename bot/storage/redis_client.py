@@ -2,10 +2,27 @@
 import redis.asyncio as redis
 from typing import Optional, Any, Dict, List, Tuple
 import json
+import time
+from datetime import datetime
+
+from bot.storage.counters import ACTIVE_BANS_KEY, ACTIVE_DIALOGS_KEY, MINUTE_KEY_TTL, SEARCH_QUEUE_KEY, Stats, minute_key, read_stats
+from bot.storage.scripts import ScriptRegistry
+from bot.config import settings
+from bot.tasks import CleanupDialogTask, CleanupTopicTask, Task, encode_task
+
+LEGACY_SEARCH_QUEUE_KEY = "search:queue"
+
+
+def delayed_member(task: Task) -> str:
+    """Элемент sorted set отложенных задач: "<type> <data>" (см. promote_due_tasks)"""
+    fields = encode_task(task)
+    return f"{fields['type']} {fields['data']}"
+
 
 class RedisClient:
     def __init__(self):
         self.client: Optional[redis.Redis] = None
+        self.scripts = ScriptRegistry()
         
     async def initialize(self, url: str, pool_size: int = 10):
         """Инициализация Redis клиента"""
@@ -14,12 +31,29 @@ class RedisClient:
             max_connections=pool_size,
             decode_responses=True
         )
+        await self.scripts.load(self.client)
         
     async def aclose(self):
         """Закрытие соединения"""
         if self.client:
             await self.client.aclose()
     
+    async def run_script(self, name: str, keys: List[str], args: Optional[List[Any]] = None) -> Any:
+        """Вызов зарегистрированного Lua-скрипта по имени (FCALL / EVALSHA)"""
+        return await self.scripts.call(self.client, name, keys, args or [])
+    
+    async def enqueue_task(self, stream: str, task: Task) -> str:
+        """Постановка задачи в поток воркеров (bot/worker.py)"""
+        return await self.client.xadd(stream, encode_task(task))
+
+    async def schedule_task(self, delayed_key: str, task: Task, run_at: float) -> None:
+        """Отложенная задача: попадет в поток воркеров в момент run_at"""
+        await self.client.zadd(delayed_key, {delayed_member(task): run_at})
+
+    async def promote_due_tasks(self, delayed_key: str, stream: str, now: float, limit: int = 500) -> int:
+        """Перенос наступивших отложенных задач в поток (атомарно, пачкой)"""
+        return await self.run_script("promote_due_tasks", [delayed_key, stream], [now, limit])
+
     # --- User State Management ---
     async def set_user_state(self, user_id: int, state: str) -> bool:
         """Установка состояния пользователя (атомарно)"""
@@ -38,67 +72,36 @@ class RedisClient:
     # --- Dialog Management ---
     async def create_dialog(self, user1_id: int, user2_id: int, topic_id: Optional[str] = None) -> Optional[str]:
         """Создание диалога (атомарная операция)"""
-        script = """
-        local user1_key = KEYS[1]
-        local user2_key = KEYS[2]
-        local search_queue = KEYS[3]
-        
-        -- Проверяем, что оба пользователя в состоянии SEARCHING
-        local state1 = redis.call('GET', user1_key)
-        local state2 = redis.call('GET', user2_key)
-        
-        if state1 ~= 'SEARCHING' or state2 ~= 'SEARCHING' then
-            return nil
-        end
-        
-        -- Удаляем пользователей из очереди поиска
-        redis.call('LREM', search_queue, 0, ARGV[1])
-        redis.call('LREM', search_queue, 0, ARGV[2])
-        
-        -- Генерируем ID диалога
-        local dialog_id = ARGV[3]
-        
-        -- Создаем запись о диалоге
-        local dialog_key = 'dialog:' .. dialog_id
-        redis.call('HSET', dialog_key,
-            'user1_id', ARGV[1],
-            'user2_id', ARGV[2],
-            'topic_id', ARGV[4] or '',
-            'created_at', ARGV[5]
-        )
-        
-        -- Устанавливаем TTL для диалога (30 минут)
-        redis.call('EXPIRE', dialog_key, 1800)
-        
-        -- Обновляем состояния пользователей
-        redis.call('SET', user1_key, 'DIALOG')
-        redis.call('SET', user2_key, 'DIALOG')
-        
-        -- Сохраняем ссылку на диалог
-        redis.call('SET', 'user:' .. ARGV[1] .. ':dialog_id', dialog_id)
-        redis.call('SET', 'user:' .. ARGV[2] .. ':dialog_id', dialog_id)
-        
-        return dialog_id
-        """
-        
         import uuid
         dialog_id = str(uuid.uuid4())
         
-        result = await self.client.eval(
-            script,
-            3,
-            f"user:{user1_id}:state",
-            f"user:{user2_id}:state",
-            "search:queue",
-            str(user1_id),
-            str(user2_id),
-            dialog_id,
-            topic_id or "",
-            str(datetime.now())
+        result = await self.run_script(
+            "create_dialog",
+            [f"user:{user1_id}:state", f"user:{user2_id}:state", SEARCH_QUEUE_KEY],
+            [
+                str(user1_id), str(user2_id), dialog_id, topic_id or "", str(datetime.now()),
+                settings.DIALOG_INACTIVITY_TTL + settings.DIALOG_CLEANUP_GRACE,
+            ]
         )
+        if result:
+            await self.schedule_task(
+                settings.DELAYED_TASKS_KEY, CleanupDialogTask(result), time.time() + settings.DIALOG_INACTIVITY_TTL
+            )
         
         return result
     
+    async def touch_dialog(self, dialog_id: str) -> bool:
+        """Продление диалога при активности: TTL записи и срок задачи очистки"""
+        result = await self.run_script(
+            "touch_dialog",
+            [f"dialog:{dialog_id}", settings.DELAYED_TASKS_KEY],
+            [
+                dialog_id, delayed_member(CleanupDialogTask(dialog_id)), time.time(),
+                settings.DIALOG_INACTIVITY_TTL, settings.DIALOG_CLEANUP_GRACE,
+            ]
+        )
+        return bool(result)
+    
     async def get_dialog_partner(self, dialog_id: str, user_id: int) -> Optional[int]:
         """Получение ID собеседника в диалоге"""
         dialog_key = f"dialog:{dialog_id}"
@@ -114,54 +117,7 @@ class RedisClient:
     
     async def end_dialog(self, dialog_id: str, reason: str = "ended_by_user") -> bool:
         """Завершение диалога (атомарно)"""
-        script = """
-        local dialog_key = KEYS[1]
-        
-        -- Получаем данные диалога
-        local dialog = redis.call('HGETALL', dialog_key)
-        if #dialog == 0 then
-            return 0
-        end
-        
-        local user1_id = nil
-        local user2_id = nil
-        
-        -- Извлекаем ID пользователей
-        for i = 1, #dialog, 2 do
-            if dialog[i] == 'user1_id' then
-                user1_id = dialog[i+1]
-            elseif dialog[i] == 'user2_id' then
-                user2_id = dialog[i+1]
-            end
-        end
-        
-        if not user1_id or not user2_id then
-            return 0
-        end
-        
-        -- Обновляем состояние пользователей
-        redis.call('SET', 'user:' .. user1_id .. ':state', 'DIALOG_ENDED')
-        redis.call('SET', 'user:' .. user2_id .. ':state', 'DIALOG_ENDED')
-        
-        -- Удаляем ссылки на диалог
-        redis.call('DEL', 'user:' .. user1_id .. ':dialog_id')
-        redis.call('DEL', 'user:' .. user2_id .. ':dialog_id')
-        
-        -- Добавляем причину завершения
-        redis.call('HSET', dialog_key, 'ended_reason', ARGV[1])
-        
-        -- Устанавливаем короткий TTL для cleanup
-        redis.call('EXPIRE', dialog_key, 60)
-        
-        return 1
-        """
-        
-        result = await self.client.eval(
-            script,
-            1,
-            f"dialog:{dialog_id}",
-            reason
-        )
+        result = await self.run_script("end_dialog", [f"dialog:{dialog_id}"], [reason])
         
         return bool(result)
     
@@ -176,8 +132,8 @@ class RedisClient:
         if not added:
             return False
             
-        # Добавляем в очередь
-        await self.client.lpush("search:queue", str(user_id))
+        # Добавляем в очередь (score - время постановки, первым идет дольше всех ждущий)
+        await self.client.zadd(SEARCH_QUEUE_KEY, {str(user_id): time.time()}, nx=True)
         return True
     
     async def remove_from_search_queue(self, user_id: int) -> bool:
@@ -185,43 +141,24 @@ class RedisClient:
         key = f"user:{user_id}:searching"
         await self.client.delete(key)
         
-        removed = await self.client.lrem("search:queue", 0, str(user_id))
+        removed = await self.client.zrem(SEARCH_QUEUE_KEY, str(user_id))
         return removed > 0
+
+    async def search_queue_size(self) -> int:
+        """Количество пользователей в очереди поиска"""
+        return await self.client.zcard(SEARCH_QUEUE_KEY)
+
+    async def migrate_search_queue(self) -> int:
+        """Перенос старой очереди-списка search:queue в sorted set (однократно)"""
+        return await self.run_script(
+            "migrate_search_queue",
+            [LEGACY_SEARCH_QUEUE_KEY, SEARCH_QUEUE_KEY],
+            [time.time()]
+        )
     
     async def find_match(self) -> Optional[Tuple[int, int]]:
         """Поиск пары собеседников (атомарная операция)"""
-        script = """
-        local queue_key = KEYS[1]
-        
-        -- Проверяем длину очереди
-        local queue_len = redis.call('LLEN', queue_key)
-        if queue_len < 2 then
-            return nil
-        end
-        
-        -- Берем двух пользователей с конца очереди (FIFO)
-        local user2_id = redis.call('RPOP', queue_key)
-        local user1_id = redis.call('RPOP', queue_key)
-        
-        if not user1_id or not user2_id then
-            -- Возвращаем обратно, если что-то пошло не так
-            if user1_id then
-                redis.call('RPUSH', queue_key, user1_id)
-            end
-            if user2_id then
-                redis.call('RPUSH', queue_key, user2_id)
-            end
-            return nil
-        end
-        
-        -- Удаляем временные ключи поиска
-        redis.call('DEL', 'user:' .. user1_id .. ':searching')
-        redis.call('DEL', 'user:' .. user2_id .. ':searching')
-        
-        return {user1_id, user2_id}
-        """
-        
-        result = await self.client.eval(script, 1, "search:queue")
+        result = await self.run_script("find_match", [SEARCH_QUEUE_KEY])
         if result:
             return int(result[0]), int(result[1])
         return None
@@ -250,6 +187,9 @@ class RedisClient:
         
         # Сохраняем связь пользователь -> тема
         await self.client.set(f"user:{user_id}:topic_id", topic_id)
+
+        # Удаление из topics:active, когда запись темы истечет
+        await self.schedule_task(settings.DELAYED_TASKS_KEY, CleanupTopicTask(topic_id), time.time() + settings.TOPIC_TTL)
         
         return topic_id
     
@@ -293,9 +233,16 @@ class RedisClient:
     async def ban_user(self, user_id: int, duration: int = 3600) -> bool:
         """Бан пользователя"""
         ban_key = f"ban:{user_id}"
+        now = time.time()
+        stats_key = minute_key(now)
         
-        # Устанавливаем бан с TTL
-        await self.client.set(ban_key, "1", ex=duration)
+        # Бан с TTL и счетчики /stats одной транзакцией
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(ban_key, "1", ex=duration)
+        pipe.zadd(ACTIVE_BANS_KEY, {str(user_id): now + duration})
+        pipe.hincrby(stats_key, "bans", 1)
+        pipe.expire(stats_key, MINUTE_KEY_TTL)
+        await pipe.execute()
         
         # Обновляем состояние пользователя
         await self.set_user_state(user_id, "BANNED")
@@ -306,5 +253,34 @@ class RedisClient:
         """Проверка, забанен ли пользователь"""
         return await self.client.exists(f"ban:{user_id}") > 0
 
+    # --- Stats ---
+    async def stats(self, window_minutes: int = 60) -> Stats:
+        """Счетчики для /stats и метрик (O(1) по числу пользователей)"""
+        return await read_stats(self.client, window_minutes)
+
+    async def backfill_active_dialogs(self, batch_size: int = 500) -> int:
+        """Однократно: живые диалоги, созданные до появления dialogs:active"""
+        now = time.time()
+        added = 0
+        async for key in self.client.scan_iter(match="dialog:*", count=batch_size):
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hexists(key, "ended_reason")
+            pipe.ttl(key)
+            ended, ttl = await pipe.execute()
+            if not ended and ttl > 0:
+                added += await self.client.zadd(ACTIVE_DIALOGS_KEY, {key.split(":", 1)[1]: now + ttl}, nx=True)
+        return added
+
+    # --- Rate Limiting ---
+    async def check_rate_limit(self, user_id: int, rate: float, burst: int) -> Tuple[int, int]:
+        """Проверка бана и лимита сообщений одним вызовом: (статус, мс до снятия ограничения)"""
+        emission_ms = max(1, int(1000 / rate))
+        status, wait_ms = await self.run_script(
+            "rate_limit",
+            [f"ban:{user_id}", f"rl:{user_id}"],
+            [emission_ms, emission_ms * (burst - 1)]
+        )
+        return int(status), int(wait_ms)
+
 redis_client = RedisClient()
 
@@ -0,0 +1,338 @@
+﻿# bot/storage/scripts.py
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Sequence
+
+from redis.exceptions import NoScriptError, ResponseError
+
+LIBRARY_NAME = "anon"
+
+# Перенос очереди-списка (LPUSH, старые в хвосте) в sorted set. Старые записи
+# получают score раньше текущего времени и раньше самой старой записи в
+# sorted set, порядок между ними сохраняется (шаг 1 мкс).
+MIGRATE_SEARCH_QUEUE = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'list' then
+    return 0
+end
+local waiting = redis.call('LRANGE', KEYS[1], 0, -1)
+local top = tonumber(ARGV[1])
+local oldest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if oldest[2] and tonumber(oldest[2]) < top then
+    top = tonumber(oldest[2])
+end
+local base = math.floor(top * 1000000) - #waiting - 1
+for idx = #waiting, 1, -1 do
+    local score = (base + #waiting - idx + 1) / 1000000
+    redis.call('ZADD', KEYS[2], 'NX', string.format('%.6f', score), waiting[idx])
+end
+redis.call('DEL', KEYS[1])
+return #waiting
+"""
+
+# GCRA: в rl:{user_id} хранится теоретическое время следующего сообщения (TAT, мс).
+# Время берется из Redis (TIME), поэтому все реплики бота считают по одним часам.
+# Ответ: {0, 0} - пропустить, {1, wait_ms} - превышен лимит, {2, ttl_ms} - бан.
+RATE_LIMIT = """
+local ban_ttl = redis.call('PTTL', KEYS[1])
+if ban_ttl ~= -2 then
+    return {2, ban_ttl}
+end
+
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[2]))
+if not tat or tat < now then
+    tat = now
+end
+
+local allow_at = tat - tolerance
+if now < allow_at then
+    return {1, allow_at - now}
+end
+
+local new_tat = tat + emission
+redis.call('SET', KEYS[2], new_tat, 'PX', new_tat - now)
+return {0, 0}
+"""
+
+# Счетчики для /stats (bot/storage/counters.py), подставляются в начало
+# скриптов, которые меняют состояние. Время берется из Redis (TIME).
+# Поминутные хеши stats:m:<минута> живут сутки.
+STATS = """
+local function stats_now()
+    return tonumber(redis.call('TIME')[1])
+end
+
+local function stats_bump(now, field)
+    local key = 'stats:m:' .. math.floor(now / 60)
+    redis.call('HINCRBY', key, field, 1)
+    redis.call('EXPIRE', key, 86400)
+end
+"""
+
+# Создание диалога для двух пользователей в состоянии SEARCHING
+CREATE_DIALOG = STATS + """
+local user1_key = KEYS[1]
+local user2_key = KEYS[2]
+local search_queue = KEYS[3]
+
+-- Проверяем, что оба пользователя в состоянии SEARCHING
+local state1 = redis.call('GET', user1_key)
+local state2 = redis.call('GET', user2_key)
+
+if state1 ~= 'SEARCHING' or state2 ~= 'SEARCHING' then
+    return nil
+end
+
+-- Удаляем пользователей из очереди поиска
+redis.call('ZREM', search_queue, ARGV[1], ARGV[2])
+
+-- Генерируем ID диалога
+local dialog_id = ARGV[3]
+
+-- Создаем запись о диалоге
+local dialog_key = 'dialog:' .. dialog_id
+redis.call('HSET', dialog_key,
+    'user1_id', ARGV[1],
+    'user2_id', ARGV[2],
+    'topic_id', ARGV[4] or '',
+    'created_at', ARGV[5]
+)
+
+-- TTL записи диалога: срок диалога плюс запас, чтобы задача очистки
+-- (cleanup_dialog) успела прочитать участников
+redis.call('EXPIRE', dialog_key, tonumber(ARGV[6]) or 1800)
+
+-- Обновляем состояния пользователей
+redis.call('SET', user1_key, 'DIALOG')
+redis.call('SET', user2_key, 'DIALOG')
+
+-- Сохраняем ссылку на диалог
+redis.call('SET', 'user:' .. ARGV[1] .. ':dialog_id', dialog_id)
+redis.call('SET', 'user:' .. ARGV[2] .. ':dialog_id', dialog_id)
+
+-- Живые диалоги: score - момент, когда запись диалога точно исчезнет
+local now = stats_now()
+redis.call('ZADD', 'dialogs:active', now + (tonumber(ARGV[6]) or 1800), dialog_id)
+stats_bump(now, 'matches')
+
+return dialog_id
+"""
+
+# Завершение диалога: состояния DIALOG_ENDED, короткий TTL на запись диалога
+END_DIALOG = STATS + """
+local dialog_key = KEYS[1]
+
+-- Получаем данные диалога
+local dialog = redis.call('HGETALL', dialog_key)
+if #dialog == 0 then
+    return 0
+end
+
+local user1_id = nil
+local user2_id = nil
+
+-- Извлекаем ID пользователей
+for i = 1, #dialog, 2 do
+    if dialog[i] == 'user1_id' then
+        user1_id = dialog[i+1]
+    elseif dialog[i] == 'user2_id' then
+        user2_id = dialog[i+1]
+    end
+end
+
+if not user1_id or not user2_id then
+    return 0
+end
+
+-- Обновляем состояние пользователей
+redis.call('SET', 'user:' .. user1_id .. ':state', 'DIALOG_ENDED')
+redis.call('SET', 'user:' .. user2_id .. ':state', 'DIALOG_ENDED')
+
+-- Удаляем ссылки на диалог
+redis.call('DEL', 'user:' .. user1_id .. ':dialog_id')
+redis.call('DEL', 'user:' .. user2_id .. ':dialog_id')
+
+-- Добавляем причину завершения
+redis.call('HSET', dialog_key, 'ended_reason', ARGV[1])
+
+-- Устанавливаем короткий TTL для cleanup
+redis.call('EXPIRE', dialog_key, 60)
+
+-- Повторное завершение того же диалога не считается
+if redis.call('ZREM', 'dialogs:active', string.sub(dialog_key, 8)) == 1 then
+    stats_bump(stats_now(), 'ended:' .. ARGV[1])
+end
+
+return 1
+"""
+
+# Два дольше всех ждущих пользователя из очереди поиска
+FIND_MATCH = """
+local queue_key = KEYS[1]
+
+-- Проверяем длину очереди
+if redis.call('ZCARD', queue_key) < 2 then
+    return nil
+end
+
+-- Берем двух дольше всех ждущих пользователей
+local popped = redis.call('ZPOPMIN', queue_key, 2)
+local user1_id = popped[1]
+local user2_id = popped[3]
+
+-- Удаляем временные ключи поиска
+redis.call('DEL', 'user:' .. user1_id .. ':searching')
+redis.call('DEL', 'user:' .. user2_id .. ':searching')
+
+return {user1_id, user2_id}
+"""
+
+# Очистка диалога по TTL (воркер)
+# Участники, которые все еще в этом диалоге, переводятся в DIALOG_ENDED (как
+# при end_dialog), запись диалога удаляется. Ответ: id сброшенных участников.
+CLEANUP_DIALOG = STATS + """
+local dialog_key = KEYS[1]
+local dialog_id = ARGV[1]
+
+if redis.call('ZREM', 'dialogs:active', dialog_id) == 1 then
+    stats_bump(stats_now(), 'ended:expired')
+end
+
+local users = redis.call('HMGET', dialog_key, 'user1_id', 'user2_id')
+redis.call('DEL', dialog_key)
+
+local reset = {}
+for i = 1, 2 do
+    local user_id = users[i]
+    if user_id and redis.call('GET', 'user:' .. user_id .. ':dialog_id') == dialog_id then
+        redis.call('SET', 'user:' .. user_id .. ':state', 'DIALOG_ENDED')
+        redis.call('DEL', 'user:' .. user_id .. ':dialog_id')
+        table.insert(reset, user_id)
+    end
+end
+return reset
+"""
+
+# Активность в диалоге: TTL записи (с запасом на очистку), срок отложенной
+# задачи очистки и score в dialogs:active сдвигаются вперед. Завершенный или
+# исчезнувший диалог не продлевается.
+TOUCH_DIALOG = """
+local dialog_key = KEYS[1]
+if redis.call('EXISTS', dialog_key) == 0 or redis.call('HEXISTS', dialog_key, 'ended_reason') == 1 then
+    return 0
+end
+local expires_at = tonumber(ARGV[3]) + tonumber(ARGV[4])
+redis.call('EXPIRE', dialog_key, tonumber(ARGV[4]) + tonumber(ARGV[5]))
+redis.call('ZADD', KEYS[2], 'XX', expires_at, ARGV[2])
+redis.call('ZADD', 'dialogs:active', 'XX', expires_at + tonumber(ARGV[5]), ARGV[1])
+return 1
+"""
+
+# Очистка темы по TTL (воркер)
+CLEANUP_TOPIC = """
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Перенос наступивших отложенных задач из sorted set (score - время запуска)
+# в поток воркеров. Элемент: "<type> <data>", повторная постановка той же
+# задачи не создает дубль.
+PROMOTE_DUE_TASKS = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+    local sep = string.find(member, ' ', 1, true)
+    redis.call('XADD', KEYS[2], '*', 'type', string.sub(member, 1, sep - 1), 'data', string.sub(member, sep + 1))
+    redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+SCRIPTS: Dict[str, str] = {
+    "migrate_search_queue": MIGRATE_SEARCH_QUEUE,
+    "rate_limit": RATE_LIMIT,
+    "create_dialog": CREATE_DIALOG,
+    "end_dialog": END_DIALOG,
+    "find_match": FIND_MATCH,
+    "cleanup_dialog": CLEANUP_DIALOG,
+    "touch_dialog": TOUCH_DIALOG,
+    "cleanup_topic": CLEANUP_TOPIC,
+    "promote_due_tasks": PROMOTE_DUE_TASKS,
+}
+
+
+def build_library(scripts: Dict[str, str], library: str = LIBRARY_NAME) -> str:
+    """Тела скриптов как одна библиотека Redis Functions (FUNCTION LOAD)"""
+    parts = [f"#!lua name={library}"]
+    for name, body in scripts.items():
+        parts.append(f"redis.register_function('{library}_{name}', function(KEYS, ARGV)\n{body}\nend)")
+    return "\n\n".join(parts)
+
+
+def library_version(scripts: Dict[str, str], library: str = LIBRARY_NAME) -> str:
+    """Имя библиотеки с хешем исходника: anon_<sha1[:8]>
+
+    Реплики разных версий при rolling deploy загружают свои библиотеки рядом
+    и не подменяют друг другу тела функций (как и EVALSHA по содержимому).
+    """
+    digest = hashlib.sha1(build_library(scripts, library).encode()).hexdigest()
+    return f"{library}_{digest[:8]}"
+
+
+class ScriptRegistry:
+    """Загружает скрипты один раз и вызывает их по имени.
+
+    На Redis 7+ скрипты загружаются библиотекой через FUNCTION LOAD и
+    вызываются FCALL; на старых версиях (и в fakeredis) - SCRIPT LOAD и
+    EVALSHA. После рестарта или failover без скриптов (NOSCRIPT / Function
+    not found) библиотека перезагружается и вызов повторяется один раз.
+    Имя библиотеки зависит от хеша исходника (library_version), поэтому она
+    загружается без REPLACE; старые версии остаются на сервере, пока их не
+    удалят FUNCTION DELETE.
+    """
+
+    def __init__(self, scripts: Dict[str, str] = SCRIPTS, library: str = LIBRARY_NAME):
+        self.scripts = scripts
+        self.library = library_version(scripts, library)
+        self.use_functions: Optional[bool] = None
+        self.shas: Dict[str, str] = {}
+
+    async def load(self, client: Any) -> None:
+        """Загрузка всех скриптов (вызывается из initialize())"""
+        try:
+            await client.function_load(build_library(self.scripts, self.library))
+            self.use_functions = True
+            return
+        except ResponseError as e:
+            if "already exists" in str(e):
+                # Та же версия уже загружена другой репликой
+                self.use_functions = True
+                return
+            logging.info(f"FUNCTION LOAD unavailable ({e}), falling back to EVALSHA")
+        self.use_functions = False
+        for name, body in self.scripts.items():
+            self.shas[name] = await client.script_load(body)
+
+    async def call(self, client: Any, name: str, keys: Sequence[Any] = (), args: Sequence[Any] = ()) -> Any:
+        """Вызов скрипта по имени"""
+        if self.use_functions is None:
+            await self.load(client)
+        try:
+            return await self._invoke(client, name, keys, args)
+        except NoScriptError:
+            pass
+        except ResponseError as e:
+            if "function not found" not in str(e).lower():
+                raise
+        logging.warning(f"Lua script {name} missing on server, reloading")
+        await self.load(client)
+        return await self._invoke(client, name, keys, args)
+
+    async def _invoke(self, client: Any, name: str, keys: Sequence[Any], args: Sequence[Any]) -> Any:
+        if self.use_functions:
+            return await client.fcall(f"{self.library}_{name}", len(keys), *keys, *args)
+        return await client.evalsha(self.shas[name], len(keys), *keys, *args)
@@ -0,0 +1,76 @@
+﻿# bot/tasks.py
+import json
+from dataclasses import asdict, dataclass
+from typing import Dict, Type, Union
+
+
+class TaskDecodeError(ValueError):
+    """Запись очереди не разбирается в известную задачу"""
+
+
+@dataclass(frozen=True)
+class SendMessageTask:
+    """Отправка сообщения пользователю"""
+    chat_id: int
+    text: str
+
+
+@dataclass(frozen=True)
+class CleanupDialogTask:
+    """Очистка диалога по TTL"""
+    dialog_id: str
+
+
+@dataclass(frozen=True)
+class CleanupTopicTask:
+    """Очистка темы по TTL"""
+    topic_id: str
+
+
+@dataclass(frozen=True)
+class NotifyTask:
+    """Отложенное уведомление"""
+    user_id: int
+    text: str
+
+
+Task = Union[SendMessageTask, CleanupDialogTask, CleanupTopicTask, NotifyTask]
+
+# Имя типа в потоке -> класс задачи. Имена совпадают со старым форматом task_type:data
+TASK_TYPES: Dict[str, Type] = {
+    "send_message": SendMessageTask,
+    "cleanup_dialog": CleanupDialogTask,
+    "cleanup_topic": CleanupTopicTask,
+    "notify": NotifyTask,
+}
+_TYPE_NAMES = {cls: name for name, cls in TASK_TYPES.items()}
+
+
+def encode_task(task: Task) -> Dict[str, str]:
+    """Поля записи потока для задачи: тип и JSON с аргументами"""
+    return {"type": _TYPE_NAMES[type(task)], "data": json.dumps(asdict(task), ensure_ascii=False)}
+
+
+def decode_task(fields: Dict[str, str]) -> Task:
+    """Задача из полей записи потока"""
+    cls = TASK_TYPES.get(fields.get("type", ""))
+    if cls is None:
+        raise TaskDecodeError(f"unknown task type {fields.get('type')!r}")
+    try:
+        return cls(**json.loads(fields["data"]))
+    except (KeyError, TypeError, ValueError) as e:
+        raise TaskDecodeError(f"bad {fields['type']} payload: {e}") from e
+
+
+def parse_legacy_task(raw: str) -> Task:
+    """Задача из строки старой очереди-списка (task_type:data)
+
+    Формат data был определен только для задач очистки; send_message и notify
+    старый воркер не выполнял, такие строки не переносятся.
+    """
+    task_type, sep, data = raw.partition(":")
+    if sep and task_type == "cleanup_dialog":
+        return CleanupDialogTask(data)
+    if sep and task_type == "cleanup_topic":
+        return CleanupTopicTask(data)
+    raise TaskDecodeError(f"legacy task {raw!r} is not migrated")
@@ -1,17 +1,32 @@
 ﻿# bot/utils/antiflood.py
-import asyncio
+import time
+from collections import OrderedDict
 from typing import Any, Callable, Dict, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message
-from datetime import datetime, timedelta
-from bot.config import settings
 from bot.storage.redis_client import redis_client
 
+RATE_LIMIT_OK = 0
+RATE_LIMIT_THROTTLED = 1
+RATE_LIMIT_BANNED = 2
+
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, rate_limit: float = 30.0):
+    def __init__(
+        self,
+        rate: float = 1.0,
+        burst: int = 3,
+        local_cache_size: int = 10_000,
+        max_local_block: float = 60.0
+    ):
         super().__init__()
-        self.rate_limit = rate_limit  # сообщений в секунду
-        self.last_processed: Dict[int, datetime] = {}
+        self.rate = rate  # сообщений в секунду на пользователя
+        self.burst = burst
+        self.local_cache_size = local_cache_size
+        self.max_local_block = max_local_block
+        # user_id -> момент (monotonic), до которого сообщения отбрасываются без
+        # похода в Redis. Кэшируются только отказы: TAT в Redis не уменьшается,
+        # поэтому другие реплики не могли бы пропустить сообщение раньше.
+        self.blocked_until: "OrderedDict[int, float]" = OrderedDict()
     
     async def __call__(
         self,
@@ -19,38 +34,29 @@ class ThrottlingMiddleware(BaseMiddleware):
         event: Message,
         data: Dict[str, Any]
     ) -> Any:
+        if event.from_user is None:
+            return await handler(event, data)
         user_id = event.from_user.id
         
-        # Проверка бана
-        is_banned = await redis_client.is_user_banned(user_id)
-        if is_banned:
-            return
-        
-        # Per-user cooldown (храним в Redis)
-        cooldown_key = f"cooldown:{user_id}"
-        last_action = await redis_client.client.get(cooldown_key)
-        
-        if last_action:
-            last_time = datetime.fromisoformat(last_action)
-            if datetime.now() - last_time < timedelta(seconds=1):
-                # Cooldown, игнорируем сообщение
+        now = time.monotonic()
+        until = self.blocked_until.get(user_id)
+        if until is not None:
+            if now < until:
                 return
+            del self.blocked_until[user_id]
         
-        # Global throttle (имитация лимитов Telegram)
-        current_time = datetime.now()
-        if user_id in self.last_processed:
-            time_diff = (current_time - self.last_processed[user_id]).total_seconds()
-            if time_diff < 1.0 / self.rate_limit:
-                # Ждем перед обработкой следующего сообщения
-                await asyncio.sleep(1.0 / self.rate_limit - time_diff)
+        # Бан и лимит проверяются одним атомарным скриптом
+        status, wait_ms = await redis_client.check_rate_limit(user_id, self.rate, self.burst)
+        if status == RATE_LIMIT_OK:
+            return await handler(event, data)
         
-        self.last_processed[user_id] = datetime.now()
-        
-        # Обновляем cooldown в Redis
-        await redis_client.client.set(
-            cooldown_key,
-            datetime.now().isoformat(),
-            ex=2
-        )
-        
-        return await handler(event, data)
+        # Сообщение отбрасывается сразу, без ожидания внутри обработчика
+        if wait_ms < 0:
+            wait_ms = self.max_local_block * 1000
+        self._block(user_id, now + min(wait_ms / 1000, self.max_local_block))
+    
+    def _block(self, user_id: int, until: float) -> None:
+        self.blocked_until[user_id] = until
+        self.blocked_until.move_to_end(user_id)
+        while len(self.blocked_until) > self.local_cache_size:
+            self.blocked_until.popitem(last=False)
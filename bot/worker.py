@@ -1,120 +1,320 @@
 ﻿# bot/worker.py
 import asyncio
 import logging
-from datetime import datetime, timedelta
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from redis.exceptions import ResponseError
+
 from bot.config import settings
 from bot.storage.redis_client import redis_client
 from bot.storage.postgres_client import Database
+from bot.tasks import (
+    CleanupDialogTask,
+    CleanupTopicTask,
+    NotifyTask,
+    SendMessageTask,
+    Task,
+    TaskDecodeError,
+    decode_task,
+    parse_legacy_task,
+)
+
+Entry = Tuple[str, Dict[str, str]]
+
 
 class Worker:
-    def __init__(self):
-        self.redis = redis_client
-        self.db = Database(settings.DATABASE_URL)
+    """Воркер задач на Redis Streams (группа потребителей)
+
+    Несколько воркеров читают один поток через общую группу, каждая запись
+    достается одному из них. Запись подтверждается (XACK) только после
+    выполнения задачи: если воркер упал, его задачи остаются в pending и через
+    claim_idle_ms их забирает другой воркер (XAUTOCLAIM). Задача, упавшая с
+    ошибкой, тоже остается в pending и повторяется так же, но не больше
+    max_deliveries доставок: после этого запись переносится в dead_stream.
+    """
+
+    def __init__(
+        self,
+        redis=None,
+        db=None,
+        bot: Optional[Bot] = None,
+        consumer: Optional[str] = None,
+        concurrency: int = settings.WORKER_CONCURRENCY,
+        batch_size: int = settings.WORKER_BATCH_SIZE,
+        claim_idle_ms: int = settings.WORKER_CLAIM_IDLE_MS,
+        stream: str = settings.QUEUE_STREAM,
+        group: str = settings.QUEUE_GROUP,
+        delayed_key: str = settings.DELAYED_TASKS_KEY,
+        max_deliveries: int = settings.WORKER_MAX_DELIVERIES,
+        dead_stream: str = settings.QUEUE_DEAD_STREAM,
+    ):
+        self.redis = redis or redis_client
+        self.db = db or Database(settings.DATABASE_URL)
+        self.bot = bot
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.claim_idle_ms = claim_idle_ms
+        self.stream = stream
+        self.group = group
+        self.delayed_key = delayed_key
+        self.max_deliveries = max_deliveries
+        self.dead_stream = dead_stream
+        # Число повторных доставок (claim) по id записи
+        self.deliveries_key = f"{stream}:deliveries"
         self.running = True
-        
+        self.processed = 0
+        self.failed = 0
+        self.dead = 0
+        self._slots = asyncio.BoundedSemaphore(concurrency)
+        self._inflight: Set[asyncio.Task] = set()
+        self._running_ids: Set[str] = set()
+        self._to_ack: List[str] = []
+        self._last_claim = 0.0
+        self._claim_cursor = "0-0"
+        self._last_promote = 0.0
+
+    async def ensure_group(self):
+        """Создание группы потребителей (если ее еще нет)"""
+        try:
+            await self.redis.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def migrate_legacy_queue(self) -> int:
+        """Перенос задач из старой очереди-списка в поток"""
+        moved = 0
+        while (raw := await self.redis.client.lpop(settings.QUEUE_NAME)) is not None:
+            try:
+                task = parse_legacy_task(raw)
+            except TaskDecodeError as e:
+                logging.warning(f"Legacy task skipped: {e}")
+                continue
+            await self.redis.enqueue_task(self.stream, task)
+            moved += 1
+        return moved
+
     async def process_queue(self):
-        """Обработка задач из очереди"""
+        """Обработка задач из потока"""
+        await self.ensure_group()
         while self.running:
             try:
-                # Блокирующее чтение из очереди
-                task = await self.redis.blpop(settings.QUEUE_NAME, timeout=1)
-                
-                if task:
-                    _, task_data = task
-                    await self.handle_task(task_data)
-                    
+                await self.run_once(block_ms=1000)
             except Exception as e:
                 logging.error(f"Queue processing error: {e}")
                 await asyncio.sleep(1)
-    
-    async def handle_task(self, task_data: str):
-        """Обработка конкретной задачи"""
-        # Парсим задачу
-        # Формат: task_type:data
-        parts = task_data.split(":", 1)
-        if len(parts) != 2:
+        await self.drain()
+
+    async def run_once(self, block_ms: Optional[int] = None) -> int:
+        """Один шаг цикла: забрать зависшие записи или прочитать новые,
+        запустить их обработку и подтвердить уже выполненные. Возвращает число
+        запущенных задач."""
+        entries: List[Entry] = []
+        if time.monotonic() - self._last_promote >= 1:
+            # Отложенные задачи (очистка диалогов и тем по TTL) - раз в секунду
+            self._last_promote = time.monotonic()
+            await self.redis.promote_due_tasks(self.delayed_key, self.stream, time.time(), self.batch_size)
+        if time.monotonic() - self._last_claim >= self.claim_idle_ms / 1000:
+            self._last_claim = time.monotonic()
+            entries = await self._claim_stale()
+        free = self.concurrency - len(self._inflight)
+        if not entries and free > 0:
+            entries = await self._read(min(free, self.batch_size), block_ms)
+        started = 0
+        for entry_id, fields in entries:
+            if entry_id in self._running_ids:
+                continue
+            await self._slots.acquire()
+            self._running_ids.add(entry_id)
+            job = asyncio.create_task(self._handle_entry(entry_id, fields))
+            self._inflight.add(job)
+            job.add_done_callback(self._inflight.discard)
+            started += 1
+        if self._inflight and len(self._inflight) >= self.concurrency:
+            # Все слоты заняты: ждем освобождения, а не читаем впустую
+            await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+        await self._ack()
+        return started
+
+    async def drain(self):
+        """Дождаться запущенных задач и подтвердить их"""
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        await self._ack()
+
+    async def _read(self, count: int, block_ms: Optional[int]) -> List[Entry]:
+        response = await self.redis.client.xreadgroup(
+            self.group, self.consumer, {self.stream: ">"}, count=count, block=block_ms
+        )
+        if not response:
+            return []
+        return response[0][1]
+
+    async def _claim_stale(self) -> List[Entry]:
+        """Записи, которые дольше claim_idle_ms не подтверждены (воркер упал
+        или задача завершилась ошибкой)"""
+        cursor, claimed, *_ = await self.redis.client.xautoclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms,
+            start_id=self._claim_cursor, count=self.batch_size
+        )
+        # Следующий вызов продолжает с курсора: иначе batch_size записей,
+        # которые падают каждый раз, заслоняли бы все pending-записи за ними.
+        # "0-0" или неполная пачка - PEL пройден, дальше снова с начала
+        self._claim_cursor = cursor if len(claimed) == self.batch_size else "0-0"
+        claimed = [(entry_id, fields) for entry_id, fields in claimed if entry_id not in self._running_ids]
+        if not claimed:
+            return []
+        pipe = self.redis.client.pipeline(transaction=False)
+        for entry_id, _fields in claimed:
+            pipe.hincrby(self.deliveries_key, entry_id, 1)
+        claims = await pipe.execute()
+        retry, dead = [], []
+        for entry, claim_count in zip(claimed, claims):
+            # Первая доставка - XREADGROUP, каждый claim - еще одна
+            if entry[1] and claim_count + 1 > self.max_deliveries:
+                dead.append(entry)
+            else:
+                retry.append(entry)
+        if dead:
+            await self._dead_letter(dead)
+        return retry
+
+    async def _dead_letter(self, entries: List[Entry]):
+        """Перенос записей в dead_stream (с исходным id) и подтверждение"""
+        ids = [entry_id for entry_id, _fields in entries]
+        pipe = self.redis.client.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            pipe.xadd(self.dead_stream, {**fields, "entry_id": entry_id})
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.hdel(self.deliveries_key, *ids)
+        await pipe.execute()
+        self.dead += len(ids)
+        logging.error(f"Tasks moved to {self.dead_stream} after {self.max_deliveries} deliveries: {ids}")
+
+    async def _ack(self):
+        if not self._to_ack:
             return
-            
-        task_type, data = parts
-        
+        ids, self._to_ack = self._to_ack, []
+        pipe = self.redis.client.pipeline(transaction=False)
+        pipe.xack(self.stream, self.group, *ids)
+        pipe.xdel(self.stream, *ids)
+        pipe.hdel(self.deliveries_key, *ids)
+        await pipe.execute()
+
+    async def _handle_entry(self, entry_id: str, fields: Optional[Dict[str, str]]):
         try:
-            if task_type == "send_message":
-                # Отправка сообщения с backoff
-                await self.send_message_with_backoff(data)
-            elif task_type == "cleanup_dialog":
-                # Очистка диалога по TTL
-                await self.cleanup_dialog(data)
-            elif task_type == "cleanup_topic":
-                # Очистка темы по TTL
-                await self.cleanup_topic(data)
-            elif task_type == "notify":
-                # Отложенное уведомление
-                await self.send_notification(data)
-        except Exception as e:
-            logging.error(f"Task handling error: {e}")
-    
-    async def send_message_with_backoff(self, data: str):
-        """Отправка сообщения с экспоненциальным backoff"""
-        # Реализация с учетом лимитов Telegram
-        pass
-    
+            if not fields:
+                # Запись удалена из потока, пока была в pending
+                self._to_ack.append(entry_id)
+                return
+            try:
+                task = decode_task(fields)
+            except TaskDecodeError as e:
+                # Повтор не поможет: подтверждаем, чтобы не забирать ее снова
+                logging.error(f"Task {entry_id} dropped: {e}")
+                self._to_ack.append(entry_id)
+                return
+            try:
+                await self.handle_task(task)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Task handling error ({entry_id}, retry after claim): {e}")
+                return
+            self.processed += 1
+            self._to_ack.append(entry_id)
+        finally:
+            self._running_ids.discard(entry_id)
+            self._slots.release()
+
+    async def handle_task(self, task: Task):
+        """Обработка конкретной задачи"""
+        if isinstance(task, SendMessageTask):
+            # Отправка сообщения с backoff
+            await self.send_message_with_backoff(task)
+        elif isinstance(task, CleanupDialogTask):
+            # Очистка диалога по TTL
+            await self.cleanup_dialog(task.dialog_id)
+        elif isinstance(task, CleanupTopicTask):
+            # Очистка темы по TTL
+            await self.cleanup_topic(task.topic_id)
+        elif isinstance(task, NotifyTask):
+            # Отложенное уведомление
+            await self.send_notification(task)
+
+    async def send_message_with_backoff(self, task: SendMessageTask):
+        """Отправка сообщения с экспоненциальным backoff
+
+        429 ждет retry_after, сетевые ошибки и 5xx повторяются с паузой 1, 2,
+        4... секунд. Если попытки кончились, ошибка уходит наверх: задача
+        остается в pending и повторяется через claim (до max_deliveries).
+        Заблокированный бот или неверный чат не повторяются.
+        """
+        delay = 1.0
+        for attempt in range(1, settings.WORKER_SEND_ATTEMPTS + 1):
+            try:
+                await self.bot.send_message(task.chat_id, task.text)
+                return
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                logging.warning(f"Message to {task.chat_id} dropped: {e}")
+                return
+            except TelegramRetryAfter as e:
+                if attempt == settings.WORKER_SEND_ATTEMPTS:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError):
+                if attempt == settings.WORKER_SEND_ATTEMPTS:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+
     async def cleanup_dialog(self, dialog_id: str):
         """Очистка диалога по истечении TTL"""
-        # Атомарные операции в Redis
-        script = """
-        local dialog_key = KEYS[1]
-        local user1_key = KEYS[2]
-        local user2_key = KEYS[3]
-        
-        -- Получаем данные диалога
-        local dialog_data = redis.call('HGETALL', dialog_key)
-        if #dialog_data == 0 then
-            return 0
-        end
-        
-        -- Очищаем состояния пользователей
-        redis.call('DEL', user1_key)
-        redis.call('DEL', user2_key)
-        
-        -- Удаляем диалог
-        redis.call('DEL', dialog_key)
-        
-        return 1
-        """
-        
-        await self.redis.eval(
-            script,
-            3,
-            f"dialog:{dialog_id}",
-            f"user:{dialog_id}:1:state",
-            f"user:{dialog_id}:2:state"
-        )
-    
+        # Атомарные операции в Redis (скрипт cleanup_dialog из bot/storage/scripts.py)
+        reset = await self.redis.run_script("cleanup_dialog", [f"dialog:{dialog_id}"], [dialog_id])
+        # Диалог, завершенный пользователем раньше, никого не сбрасывает
+        for user_id in reset:
+            await self.redis.enqueue_task(self.stream, NotifyTask(int(user_id), "Время диалога истекло"))
+
     async def cleanup_topic(self, topic_id: str):
         """Очистка темы по истечении TTL"""
         # Атомарное удаление темы
-        keys = [f"topic:{topic_id}", "topics:active"]
-        args = [topic_id]
-        
-        await self.redis.eval(
-            "redis.call('DEL', KEYS[1]); redis.call('SREM', KEYS[2], ARGV[1])",
-            len(keys),
-            *keys,
-            *args
-        )
-    
-    async def send_notification(self, data: str):
+        await self.redis.run_script("cleanup_topic", [f"topic:{topic_id}", "topics:active"], [topic_id])
+
+    async def send_notification(self, task: NotifyTask):
         """Отправка уведомления"""
-        # Реализация отправки уведомлений
-        pass
-    
+        await self.send_message_with_backoff(SendMessageTask(task.user_id, task.text))
+
     async def run(self):
         """Основной цикл воркера"""
         await self.redis.initialize(settings.REDIS_URL, settings.REDIS_POOL_SIZE)
         await self.db.connect()
-        
-        logging.info("Worker started")
-        
+        if self.bot is None:
+            self.bot = Bot(
+                token=settings.TELEGRAM_TOKEN,
+                default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+            )
+
+        await self.ensure_group()
+        moved = await self.migrate_legacy_queue()
+        if moved:
+            logging.info(f"Moved {moved} tasks from {settings.QUEUE_NAME} to {self.stream}")
+        logging.info(f"Worker {self.consumer} started")
+
         try:
             await self.process_queue()
         except KeyboardInterrupt:
@@ -122,6 +322,7 @@ class Worker:
         finally:
             await self.redis.aclose()
             await self.db.disconnect()
+            await self.bot.session.close()
 
 async def main():
     if not settings.USE_WORKERS:
@@ -133,4 +334,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-
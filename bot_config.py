@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import os
+import socket
 
 
 @dataclass(slots=True)
@@ -12,7 +13,33 @@ class Settings:
     dialog_ttl_seconds: int = 3600
     ban_ttl_seconds: int = 3600
     cooldown_seconds: int = 3
+    matchmaker_workers: int = 1
+    partner_cache_size: int = 10000
+    key_cache_size: int = 0
+    expiry_sweep_seconds: float = 300.0
+    pg_writer_consumer: str = "pg-writer"
+    pg_write_batch_size: int = 500
+    pg_flush_interval_seconds: float = 0.5
+    pg_max_pending_writes: int = 100000
+    pg_retention_months: int = 0
+    last_seen_flush_seconds: float = 60.0
+    telegram_global_rate: float = 30.0
+    telegram_per_chat_rate: float = 1.0
+    relay_linger_seconds: float = 0.02
+    relay_album_linger_seconds: float = 0.3
+    relay_max_delay_seconds: float = 1.0
+    webhook_url: str = ""
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""
+    update_workers: int = 8
+    update_queue_size: int = 1000
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9100
     log_level: str = "INFO"
+    log_format: str = "kv"
+    log_sample_rate: float = 10.0
 
 
 
@@ -26,5 +53,31 @@ def load_settings() -> Settings:
         dialog_ttl_seconds=int(os.getenv("DIALOG_TTL_SECONDS", "3600")),
         ban_ttl_seconds=int(os.getenv("BAN_TTL_SECONDS", "3600")),
         cooldown_seconds=int(os.getenv("COOLDOWN_SECONDS", "3")),
+        matchmaker_workers=int(os.getenv("MATCHMAKER_WORKERS", "1")),
+        partner_cache_size=int(os.getenv("PARTNER_CACHE_SIZE", "10000")),
+        key_cache_size=int(os.getenv("KEY_CACHE_SIZE", "0")),
+        expiry_sweep_seconds=float(os.getenv("EXPIRY_SWEEP_SECONDS", "300")),
+        pg_writer_consumer=os.getenv("PG_WRITER_CONSUMER", socket.gethostname()),
+        pg_write_batch_size=int(os.getenv("PG_WRITE_BATCH_SIZE", "500")),
+        pg_flush_interval_seconds=float(os.getenv("PG_FLUSH_INTERVAL_SECONDS", "0.5")),
+        pg_max_pending_writes=int(os.getenv("PG_MAX_PENDING_WRITES", "100000")),
+        pg_retention_months=int(os.getenv("PG_RETENTION_MONTHS", "0")),
+        last_seen_flush_seconds=float(os.getenv("LAST_SEEN_FLUSH_SECONDS", "60")),
+        telegram_global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+        telegram_per_chat_rate=float(os.getenv("TELEGRAM_PER_CHAT_RATE", "1")),
+        relay_linger_seconds=float(os.getenv("RELAY_LINGER_SECONDS", "0.02")),
+        relay_album_linger_seconds=float(os.getenv("RELAY_ALBUM_LINGER_SECONDS", "0.3")),
+        relay_max_delay_seconds=float(os.getenv("RELAY_MAX_DELAY_SECONDS", "1.0")),
+        webhook_url=os.getenv("WEBHOOK_URL", ""),
+        webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+        update_workers=int(os.getenv("UPDATE_WORKERS", "8")),
+        update_queue_size=int(os.getenv("UPDATE_QUEUE_SIZE", "1000")),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+        metrics_port=int(os.getenv("METRICS_PORT", "9100")),
         log_level=os.getenv("LOG_LEVEL", "INFO"),
+        log_format=os.getenv("LOG_FORMAT", "kv"),
+        log_sample_rate=float(os.getenv("LOG_SAMPLE_RATE", "10")),
     )
\ No newline at end of file
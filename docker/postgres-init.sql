@@ -1,4 +1,6 @@
 ﻿-- docker/postgres-init.sql
+-- Схема для bot/ (bot/storage/postgres_client.py). Схему app.py ведут
+-- миграции storage/migrations.py.
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
 CREATE TABLE IF NOT EXISTS users (
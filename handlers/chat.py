@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 import logging
 
 from aiogram import Router
@@ -29,20 +28,21 @@ from keyboards import (
 )
 from services.dialogs import DialogService
 from services.matchmaking import MatchmakingService
-from services.safe_sender import safe_copy_to, safe_reply, safe_send_message
+from services.relay import MediaRelay
+from services.safe_sender import safe_reply, safe_send_message
 from services.topics import TopicService
 from states import UserState
-from storage.postgres_store import PostgresStorage
-from storage.redis_store import RedisStorage
+from storage.last_seen import LastSeenTracker
+from storage.redis_store import RedisStorage, UserContext
 
 logger = logging.getLogger(__name__)
 router = Router()
 
 
 @router.message(CommandStart())
-async def on_start(message: Message, redis: RedisStorage, pg: PostgresStorage) -> None:
-    logger.info(f"on_start: user={message.from_user.id}, text={message.text!r}")
-    await pg.upsert_user(message.from_user.id)
+async def on_start(message: Message, redis: RedisStorage, last_seen: LastSeenTracker) -> None:
+    logger.info("start", extra={"user": message.from_user.id})
+    await last_seen.touch(message.from_user.id)
     if await redis.has_ttl_flag("ban", message.from_user.id):
         await redis.set_state(message.from_user.id, UserState.BANNED)
         await safe_reply(message, " Вы временно заблокированы", reply_markup=BANNED_KB)
@@ -58,15 +58,17 @@ async def on_message(
     matchmaking: MatchmakingService,
     dialogs: DialogService,
     topics: TopicService,
+    relay: MediaRelay,
 ) -> None:
     user_id = message.from_user.id
-    if await redis.has_ttl_flag("ban", user_id):
+    ctx = await redis.load_user_context(user_id)
+    if ctx.banned:
         await redis.set_state(user_id, UserState.BANNED)
         await safe_reply(message, " Вы временно заблокированы", reply_markup=BANNED_KB)
         return
 
-    state = await redis.get_state(user_id)
-    logger.info(f"on_message: user={user_id}, state={state}, text={message.text!r}")
+    state = ctx.state
+    logger.debug("message", extra={"user": user_id, "state": state.value})
     text = message.text or ""
     if state == UserState.IDLE:
         await handle_idle(message, text, redis, matchmaking)
@@ -79,18 +81,16 @@ async def on_message(
     elif state == UserState.BROWSING_TOPICS:
         await handle_browsing(message, text, redis, matchmaking, dialogs)
     elif state == UserState.IN_DIALOG:
-        await handle_dialog(message, text, redis, dialogs)
+        await handle_dialog(message, text, redis, dialogs, relay, ctx)
     else:
         await safe_reply(message, " Вы временно заблокированы", reply_markup=BANNED_KB)
 
 
 async def handle_idle(message: Message, text: str, redis: RedisStorage, matchmaking: MatchmakingService) -> None:
     user_id = message.from_user.id
-    logger.info(f"handle_idle: user={user_id}, text={text!r}")
     if text == BTN_FIND:
         await matchmaking.begin_search(user_id)
         await safe_reply(message, "Ищем собеседника...", reply_markup=SEARCHING_KB)
-        asyncio.create_task(search_with_timeout(message, matchmaking, redis, 20))
         return
     if text == BTN_CREATE_TOPIC:
         await redis.set_state(user_id, UserState.CREATE_TOPIC)
@@ -102,28 +102,6 @@ async def handle_idle(message: Message, text: str, redis: RedisStorage, matchmak
     await safe_reply(message, "Выберите действие", reply_markup=MAIN_MENU_KB)
 
 
-
-
-async def search_with_timeout(
-    message: Message,
-    matchmaking: MatchmakingService,
-    redis: RedisStorage,
-    timeout_seconds: int,
-) -> None:
-    user_id = message.from_user.id
-    for _ in range(timeout_seconds):
-        state = await redis.get_state(user_id)
-        if state != UserState.SEARCHING:
-            return
-        matched, _dialog_id, partner = await matchmaking.try_match(user_id)
-        if matched:
-            await safe_send_message(message.bot, user_id, "Собеседник найден!", reply_markup=DIALOG_KB)
-            await safe_send_message(message.bot, partner, "Собеседник найден!", reply_markup=DIALOG_KB)
-            return
-        await asyncio.sleep(1)
-    await matchmaking.cancel_search(user_id)
-    await safe_send_message(message.bot, user_id, "Поиск завершен по таймауту", reply_markup=MAIN_MENU_KB)
-
 async def handle_searching(message: Message, text: str, matchmaking: MatchmakingService) -> None:
     user_id = message.from_user.id
     if text == BTN_CANCEL_SEARCH:
@@ -135,7 +113,6 @@ async def handle_searching(message: Message, text: str, matchmaking: Matchmaking
         await safe_reply(message, "Собеседник найден!", reply_markup=DIALOG_KB)
         await safe_send_message(message.bot, partner, "Собеседник найден!", reply_markup=DIALOG_KB)
         return
-    await asyncio.sleep(1)
     await safe_reply(message, "Поиск продолжается... Нажмите отмену для выхода.", reply_markup=SEARCHING_KB)
 
 
@@ -176,20 +153,30 @@ async def handle_confirm_topic(message: Message, text: str, redis: RedisStorage,
 
 
 async def enter_browse_topics(message: Message, redis: RedisStorage) -> None:
-    user_id = message.from_user.id
-    topic_ids = await redis.list_topic_ids()
-    await redis.set_topic_cursor(user_id, topic_ids, 0)
-    await redis.set_state(user_id, UserState.BROWSING_TOPICS)
-    await send_current_topic(message, redis)
+    await redis.set_state(message.from_user.id, UserState.BROWSING_TOPICS)
+    await advance_topic(message, redis, None)
 
 
-async def send_current_topic(message: Message, redis: RedisStorage) -> None:
-    topic_ids, idx = await redis.get_topic_cursor(message.from_user.id)
-    if not topic_ids:
+async def advance_topic(message: Message, redis: RedisStorage, after: tuple[str, float] | None) -> None:
+    found = await redis.next_topic(after)
+    if found is None:
         await redis.set_state(message.from_user.id, UserState.IDLE)
         await safe_reply(message, "Тем пока нет", reply_markup=MAIN_MENU_KB)
         return
-    topic_id = topic_ids[idx % len(topic_ids)]
+    topic_id, score = found
+    await redis.set_topic_cursor(message.from_user.id, topic_id, score)
+    await send_topic(message, redis, topic_id)
+
+
+async def send_current_topic(message: Message, redis: RedisStorage) -> None:
+    cursor = await redis.get_topic_cursor(message.from_user.id)
+    if cursor is None:
+        await advance_topic(message, redis, None)
+        return
+    await send_topic(message, redis, cursor[0])
+
+
+async def send_topic(message: Message, redis: RedisStorage, topic_id: str) -> None:
     topic = await redis.get_topic(topic_id)
     if not topic:
         await safe_reply(message, "Тема истекла", reply_markup=BROWSE_TOPICS_KB)
@@ -210,9 +197,8 @@ async def handle_browsing(
         await safe_reply(message, "Главное меню", reply_markup=MAIN_MENU_KB)
         return
     if text == BTN_NEXT_TOPIC:
-        topic_ids, idx = await redis.get_topic_cursor(user_id)
-        await redis.set_topic_cursor(user_id, topic_ids, idx + 1)
-        await send_current_topic(message, redis)
+        cursor = await redis.get_topic_cursor(user_id)
+        await advance_topic(message, redis, cursor)
         return
     if text == BTN_REPORT:
         target = await dialogs.report_partner(user_id, "topic_report")
@@ -232,7 +218,14 @@ async def handle_browsing(
     await send_current_topic(message, redis)
 
 
-async def handle_dialog(message: Message, text: str, redis: RedisStorage, dialogs: DialogService) -> None:
+async def handle_dialog(
+    message: Message,
+    text: str,
+    redis: RedisStorage,
+    dialogs: DialogService,
+    relay: MediaRelay,
+    ctx: UserContext,
+) -> None:
     user_id = message.from_user.id
     if text == BTN_END_DIALOG:
         partner = await dialogs.finish_dialog(user_id, "user_end")
@@ -247,9 +240,8 @@ async def handle_dialog(message: Message, text: str, redis: RedisStorage, dialog
             await safe_send_message(message.bot, partner, "Вы временно заблокированы", reply_markup=BANNED_KB)
         return
 
-    _dialog_id, partner = await dialogs.get_partner(user_id)
-    if partner is None:
+    if ctx.partner is None:
         await redis.set_state(user_id, UserState.IDLE)
         await safe_reply(message, "Диалог истек", reply_markup=MAIN_MENU_KB)
         return
-    await safe_copy_to(message, partner)
\ No newline at end of file
+    relay.relay(message, ctx.partner)
\ No newline at end of file
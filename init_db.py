@@ -1,4 +1,6 @@
-﻿import asyncpg
+﻿# Схема для bot/ (bot/storage/postgres_client.py). Таблицы app.py создают
+# миграции из storage/migrations.py при старте, этот скрипт для них не нужен.
+import asyncpg
 import asyncio
 import sys
 
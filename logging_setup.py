@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import logging
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import IO
+
+# Attributes every LogRecord has; anything else on a record came from extra=.
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def record_fields(record: logging.LogRecord) -> dict[str, object]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+# logfmt-style output: fixed keys first, then the extra= fields of the call.
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        ts = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")
+        parts = [
+            f"ts={ts}",
+            f"level={record.levelname.lower()}",
+            f"logger={record.name}",
+            f"msg={_quote(record.getMessage())}",
+        ]
+        parts.extend(f"{key}={_quote(value)}" for key, value in record_fields(record).items())
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            parts.append(f"exc={_quote(record.exc_text)}")
+        return " ".join(parts)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = record_fields(record)
+        if not fields:
+            return line
+        return line + " " + " ".join(f"{key}={_quote(value)}" for key, value in fields.items())
+
+
+# Token bucket per call site (file, line) for records below WARNING: a hot
+# log line costs at most `rate` records per second however often it runs.
+# The next record let through reports how many were dropped in between.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float, burst: float | None = None, clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.clock = clock
+        self._sites: dict[tuple[str, int], list[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = self.clock()
+        site = self._sites.get((record.pathname, record.lineno))
+        if site is None:
+            # [tokens, updated_at, dropped]
+            site = self._sites[(record.pathname, record.lineno)] = [self.burst, now, 0]
+        tokens = min(self.burst, site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if tokens < 1:
+            site[0] = tokens
+            site[2] += 1
+            return False
+        site[0] = tokens - 1
+        if site[2]:
+            record.sampled_out = site[2]
+            site[2] = 0
+        return True
+
+
+# The stdlib QueueHandler renders msg % args and the traceback in prepare(),
+# on the caller's thread. The queue here stays in-process, so the record is
+# passed on untouched (args and exc_info included) and the listener thread
+# does all of the formatting. Arguments are therefore rendered as they are
+# when the listener gets to them, not at the call.
+class _RawQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Routes all records through a queue to a background writer thread: the event
+# loop only filters and enqueues, the final formatting and the blocking write
+# happen in the listener thread. Stop the returned listener at shutdown to
+# flush what is still queued.
+def setup_logging(
+    level: str | int = "INFO",
+    fmt: str = "kv",
+    sample_rate: float = 0.0,
+    stream: IO[str] | None = None,
+) -> QueueListener:
+    sink = logging.StreamHandler(stream or sys.stderr)
+    sink.setFormatter(KeyValueFormatter() if fmt == "kv" else TextFormatter())
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = _RawQueueHandler(records)
+    if sample_rate > 0:
+        handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    listener = QueueListener(records, sink, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _quote(value: object) -> str:
+    text = str(value)
+    if text and not any(ch in text for ch in ' "=\n\t'):
+        return text
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
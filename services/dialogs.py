@@ -14,14 +14,10 @@ class DialogService:
     ban_ttl_seconds: int
 
     async def get_partner(self, user_id: int) -> tuple[str, int] | tuple[None, None]:
-        dialog_id = await self.redis.get_dialog(user_id)
-        if dialog_id is None:
-            return None, None
-        payload = await self.redis.get_dialog_payload(dialog_id)
-        if payload is None:
+        ctx = await self.redis.load_user_context(user_id)
+        if ctx.partner is None:
             return None, None
-        partner = payload["user2"] if payload["user1"] == user_id else payload["user1"]
-        return dialog_id, int(partner)
+        return ctx.dialog_id, ctx.partner
 
     async def finish_dialog(self, user_id: int, reason: str) -> int | None:
         dialog_id, partner = await self.get_partner(user_id)
@@ -33,6 +29,7 @@ class DialogService:
         await self.redis.set_dialog(partner, None)
         await self.redis.set_state(user_id, UserState.IDLE)
         await self.redis.set_state(partner, UserState.IDLE)
+        await self.redis.invalidate_partners(user_id, partner)
         await self.pg.end_dialog(dialog_id, reason)
         return partner
 
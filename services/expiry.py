@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from aiogram import Bot
+
+from keyboards import MAIN_MENU_KB
+from services.safe_sender import safe_send_message
+from storage.redis_store import EXPIRED_EVENTS_PATTERN, RedisStorage
+
+logger = logging.getLogger(__name__)
+
+
+# Ends dialogs and drops topics once their expiry time has passed. Timers are
+# sorted-set scores, not asyncio tasks: every tick claims up to batch_size due
+# jobs with one script call (safe with several replicas running this loop)
+# and keeps claiming without sleeping while full batches come back.
+# Notifications are sent in the background so a large backlog of expiries is
+# not held up by Telegram rate limits.
+@dataclass(slots=True)
+class ExpiryScheduler:
+    redis: RedisStorage
+    pg: Any
+    bot: Bot
+    batch_size: int = 500
+    tick_seconds: float = 1.0
+    _notifications: set[asyncio.Task] = field(default_factory=set, init=False, repr=False)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if await self.run_once() < self.batch_size:
+                    await asyncio.sleep(self.tick_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("expiry iteration failed")
+                await asyncio.sleep(self.tick_seconds)
+
+    async def run_once(self) -> int:
+        now = time.time()
+        claimed, ended = await self.redis.expire_dialogs(now, self.batch_size)
+        await self.finish(ended, "scheduler")
+        topics = await self.redis.expire_topics(now, self.batch_size)
+        return max(claimed, topics)
+
+    async def finish(self, ended: list[tuple[str, list[int]]], source: str) -> None:
+        # Scripts only return users they actually reset, so a dialog ended by
+        # more than one path is still announced once.
+        for dialog_id, _users in ended:
+            await self.pg.end_dialog(dialog_id, "expired")
+        users = [user_id for _dialog_id, participants in ended for user_id in participants]
+        if users:
+            logger.info("dialogs expired", extra={"dialogs": len(ended), "users": len(users), "source": source})
+            task = asyncio.create_task(self.notify(users))
+            self._notifications.add(task)
+            task.add_done_callback(self._notifications.discard)
+
+    async def notify(self, users: list[int]) -> None:
+        await asyncio.gather(
+            *(safe_send_message(self.bot, user_id, "Время диалога истекло", reply_markup=MAIN_MENU_KB) for user_id in users),
+            return_exceptions=True,
+        )
+
+
+# Safety net for dialogs the scheduler never ends (it was down, or the dialog
+# predates the expiry index). Redis reports every expired dialog:{id} and
+# topic:{id} on the keyevent channel; ids are buffered and reconciled in
+# batches through the reverse index, since the hash is already gone. Keyspace
+# events are fire-and-forget (nothing is replayed after a disconnect), so
+# sweep() periodically SCANs the user:{id}:dialog_id pointers for dialogs that
+# no longer exist.
+@dataclass(slots=True)
+class ExpiryReconciler:
+    redis: RedisStorage
+    scheduler: ExpiryScheduler
+    batch_size: int = 500
+    flush_seconds: float = 0.1
+    sweep_seconds: float = 300.0
+    retry_seconds: float = 1.0
+    _dialogs: set[str] = field(default_factory=set, init=False, repr=False)
+    _topics: set[str] = field(default_factory=set, init=False, repr=False)
+
+    async def listen(self) -> None:
+        await self.redis.enable_expired_events()
+        db = self.redis.redis.connection_pool.connection_kwargs.get("db", 0)
+        channel = f"__keyevent@{db}__:expired"
+        while True:
+            pubsub = self.redis.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(EXPIRED_EVENTS_PATTERN)
+                first_pending = None
+                while True:
+                    message = await pubsub.get_message(timeout=self.flush_seconds)
+                    if message is not None and message["channel"] in (channel, channel.encode()):
+                        self.collect(message["data"])
+                    if not self._dialogs and not self._topics:
+                        first_pending = None
+                        continue
+                    now = time.monotonic()
+                    first_pending = first_pending or now
+                    full = len(self._dialogs) + len(self._topics) >= self.batch_size
+                    if full or now - first_pending >= self.flush_seconds:
+                        await self.flush()
+                        first_pending = None
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("expired keyevent stream lost, relying on sweeps until it is back", exc_info=True)
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(self.retry_seconds)
+
+    def collect(self, key: bytes | str) -> None:
+        key = key.decode() if isinstance(key, bytes) else key
+        kind, _, key_id = key.partition(":")
+        if not key_id or ":" in key_id:
+            return
+        if kind == "dialog":
+            self._dialogs.add(key_id)
+        elif kind == "topic":
+            self._topics.add(key_id)
+
+    async def flush(self) -> int:
+        dialogs, self._dialogs = list(self._dialogs), set()
+        topics, self._topics = list(self._topics), set()
+        ended: list[tuple[str, list[int]]] = []
+        for offset in range(0, len(dialogs), self.batch_size):
+            ended.extend(await self.redis.reconcile_dialogs(dialogs[offset : offset + self.batch_size]))
+        if topics:
+            await self.redis.drop_topics(topics)
+        await self.scheduler.finish(ended, "keyevent")
+        return len(ended)
+
+    async def run_sweeper(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("dialog pointer sweep failed")
+
+    async def sweep(self) -> int:
+        dangling = await self.redis.find_dangling_dialogs(self.batch_size)
+        ended: list[tuple[str, list[int]]] = []
+        for offset in range(0, len(dangling), self.batch_size):
+            ended.extend(await self.redis.reset_dangling_dialogs(dangling[offset : offset + self.batch_size]))
+        await self.scheduler.finish(ended, "sweep")
+        return len(ended)
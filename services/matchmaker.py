@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from aiogram import Bot
+
+from keyboards import DIALOG_KB, MAIN_MENU_KB
+from services.matchmaking import MatchmakingService
+from services.safe_sender import safe_send_message
+from storage.redis_store import RedisStorage
+
+logger = logging.getLogger(__name__)
+
+
+# Central search loop: reacts to queue arrivals and expires searches. Several
+# instances (in one process or across replicas) can run at once: BLPOP hands
+# each arrival to exactly one of them and the expiry script claims each
+# deadline atomically.
+@dataclass(slots=True)
+class Matchmaker:
+    matchmaking: MatchmakingService
+    redis: RedisStorage
+    bot: Bot
+    tick_seconds: float = 1.0
+    expire_batch: int = 100
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("matchmaker iteration failed")
+                await asyncio.sleep(self.tick_seconds)
+
+    async def run_once(self) -> None:
+        user_id = await self.redis.wait_search_arrival(self.tick_seconds)
+        if user_id is not None:
+            await self.handle_arrival(user_id)
+        await self.expire_searches()
+
+    async def handle_arrival(self, user_id: int) -> None:
+        matched, _dialog_id, partner = await self.matchmaking.try_match(user_id, require_searching=True)
+        if not matched:
+            return
+        await safe_send_message(self.bot, user_id, "Собеседник найден!", reply_markup=DIALOG_KB)
+        await safe_send_message(self.bot, partner, "Собеседник найден!", reply_markup=DIALOG_KB)
+
+    async def expire_searches(self) -> None:
+        expired = await self.redis.expire_searches(time.time(), self.expire_batch)
+        for user_id in expired:
+            await safe_send_message(self.bot, user_id, "Поиск завершен по таймауту", reply_markup=MAIN_MENU_KB)
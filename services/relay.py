@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from services.safe_sender import safe_copy_messages, safe_copy_to
+
+logger = logging.getLogger(__name__)
+
+# Bot API limit for one copyMessages call.
+COPY_MESSAGES_LIMIT = 100
+
+
+@dataclass(slots=True)
+class _Batch:
+    first_at: float
+    last_at: float
+    messages: list[Message] = field(default_factory=list)
+    album: bool = False
+    wakeup: asyncio.Event = field(default_factory=asyncio.Event)
+
+
+# Relays dialog messages to the partner in batches. Telegram delivers every
+# item of an album as its own update; copied one by one they arrive as single
+# photos and each costs a call against the partner's per-chat budget. Messages
+# from one sender to one partner are held briefly and copied with a single
+# copyMessages call, which keeps album grouping. A batch goes out once the
+# sender has been quiet for `linger` (`album_linger` while it contains album
+# items, whose updates trickle in further apart) and never later than
+# `max_delay` after its first message. Each (sender, partner) pair has one
+# flusher, so batches are sent in the order they were collected and message
+# ids are sorted inside a batch.
+class MediaRelay:
+    def __init__(
+        self,
+        linger: float = 0.02,
+        album_linger: float = 0.3,
+        max_delay: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.linger = linger
+        self.album_linger = album_linger
+        self.max_delay = max_delay
+        self.clock = clock
+        self._batches: dict[tuple[int, int], _Batch] = {}
+        self._flushers: dict[tuple[int, int], asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        return sum(len(batch.messages) for batch in self._batches.values())
+
+    def relay(self, message: Message, chat_id: int) -> None:
+        # Returns at once: the webhook drains a user's updates one at a time,
+        # so waiting for the flush here would keep the next album item out.
+        key = (message.chat.id, chat_id)
+        now = self.clock()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _Batch(now, now)
+        batch.messages.append(message)
+        batch.last_at = now
+        batch.album = batch.album or message.media_group_id is not None
+        batch.wakeup.set()
+        flusher = self._flushers.get(key)
+        if flusher is None or flusher.done():
+            flusher = self._flushers[key] = asyncio.create_task(self._flush_pair(key))
+            flusher.add_done_callback(lambda task: self._forget_flusher(key, task))
+
+    async def close(self) -> None:
+        # Shutdown: everything collected so far goes out without waiting.
+        self.max_delay = 0.0
+        for batch in self._batches.values():
+            batch.wakeup.set()
+        await asyncio.gather(*list(self._flushers.values()), return_exceptions=True)
+
+    def _forget_flusher(self, key: tuple[int, int], task: asyncio.Task) -> None:
+        if self._flushers.get(key) is task:
+            del self._flushers[key]
+
+    def _due_in(self, batch: _Batch, now: float) -> float:
+        if len(batch.messages) >= COPY_MESSAGES_LIMIT:
+            return 0.0
+        quiet = batch.last_at + (self.album_linger if batch.album else self.linger)
+        return min(quiet, batch.first_at + self.max_delay) - now
+
+    async def _flush_pair(self, key: tuple[int, int]) -> None:
+        while True:
+            batch = self._batches.get(key)
+            if batch is None:
+                return
+            wait = self._due_in(batch, self.clock())
+            if wait > 0:
+                batch.wakeup.clear()
+                try:
+                    await asyncio.wait_for(batch.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Messages arriving while this batch is in flight start the next
+            # one, which this loop sends afterwards.
+            del self._batches[key]
+            try:
+                await self._deliver(key[1], batch.messages)
+            except Exception:
+                logger.exception("relay failed", extra={"chat": key[1], "messages": len(batch.messages)})
+
+    async def _deliver(self, chat_id: int, messages: list[Message]) -> None:
+        messages = sorted(messages, key=lambda message: message.message_id)
+        if len(messages) == 1:
+            await safe_copy_to(messages[0], chat_id)
+            return
+        bot = messages[0].bot
+        from_chat_id = messages[0].chat.id
+        for start in range(0, len(messages), COPY_MESSAGES_LIMIT):
+            chunk = messages[start : start + COPY_MESSAGES_LIMIT]
+            try:
+                await safe_copy_messages(bot, chat_id, from_chat_id, [message.message_id for message in chunk])
+            except TelegramBadRequest:
+                # Rejected as a whole (e.g. one of the items cannot be
+                # copied): fall back to copying one by one. Other errors
+                # (blocked bot, flood wait) would fail the same way per
+                # message and go to the caller's log instead.
+                logger.warning("copyMessages rejected, copying one by one", extra={"chat": chat_id}, exc_info=True)
+                for message in chunk:
+                    await safe_copy_to(message, chat_id)
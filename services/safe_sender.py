@@ -2,36 +2,68 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from collections.abc import Awaitable, Callable
 
 from aiogram import Bot
 from aiogram.exceptions import TelegramRetryAfter
 from aiogram.types import Message
 
+from shared.metrics import TELEGRAM_RETRY_AFTER, TELEGRAM_SECONDS
+from services.send_scheduler import PRIORITY_MENU, PRIORITY_NOTIFY, PRIORITY_RELAY, SendScheduler
+
 logger = logging.getLogger(__name__)
 
+_scheduler: SendScheduler | None = None
+
+
+def install_scheduler(scheduler: SendScheduler | None) -> None:
+    # With a scheduler installed all sends share its rate budgets; without one
+    # (tests, scripts) each call retries on its own as before.
+    global _scheduler
+    _scheduler = scheduler
+
 
 async def safe_reply(message: Message, text: str, **kwargs) -> Message | None:
-    return await _retry_op(lambda: message.answer(text, **kwargs))
+    return await _send(message.chat.id, lambda: message.answer(text, **kwargs), PRIORITY_MENU)
 
 
 async def safe_send_message(bot: Bot, chat_id: int, text: str, **kwargs) -> Message | None:
-    return await _retry_op(lambda: bot.send_message(chat_id, text, **kwargs))
+    return await _send(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), PRIORITY_NOTIFY)
 
 
 async def safe_copy_to(message: Message, chat_id: int) -> Message | None:
-    return await _retry_op(lambda: message.send_copy(chat_id=chat_id))
+    return await _send(chat_id, lambda: message.send_copy(chat_id=chat_id), PRIORITY_RELAY)
+
+
+async def safe_copy_messages(bot: Bot, chat_id: int, from_chat_id: int, message_ids: list[int]):
+    # One call for the whole list; album grouping of the originals is kept.
+    return await _send(
+        chat_id,
+        lambda: bot.copy_messages(chat_id=chat_id, from_chat_id=from_chat_id, message_ids=message_ids),
+        PRIORITY_RELAY,
+    )
+
+
+async def _send(chat_id: int, operation: Callable[[], Awaitable[Message]], priority: int):
+    if _scheduler is None:
+        return await _retry_op(operation)
+    return await _scheduler.submit(chat_id, operation, priority)
 
 
 async def _retry_op(operation: Callable[[], Awaitable[Message]], retries: int = 3):
     delay = 1.0
     for _ in range(retries):
+        started = time.perf_counter()
         try:
             return await operation()
         except TelegramRetryAfter as exc:
+            TELEGRAM_RETRY_AFTER.inc()
             wait_time = max(exc.retry_after, delay)
             logger.warning("Rate limit reached, waiting %.2f sec", wait_time)
             await asyncio.sleep(wait_time)
             delay *= 2
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started)
     logger.error("Failed to execute Telegram API call after retries")
     return None
\ No newline at end of file
@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from shared.metrics import TELEGRAM_RETRY_AFTER, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RELAY = 0
+PRIORITY_NOTIFY = 1
+PRIORITY_MENU = 2
+
+
+@dataclass(slots=True)
+class TokenBucket:
+    rate: float
+    capacity: float
+    tokens: float
+    updated: float
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+@dataclass(slots=True)
+class _Job:
+    chat_id: int
+    priority: int
+    operation: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    attempts: int = 0
+
+
+# Single dispatcher for outgoing Bot API calls. Every send takes a token from
+# the global bucket and from its chat's bucket; lanes are served strictly by
+# priority, FIFO per chat inside a lane. A 429 pauses the whole scheduler for
+# retry_after instead of only the coroutine that hit it.
+# Each lane keeps a queue per chat and a round-robin queue of chats that may
+# send; a chat out of tokens moves to a heap keyed by when its next token is
+# due, so picking a job does not depend on how many are waiting.
+class SendScheduler:
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 1.0,
+        retries: int = 3,
+        max_chat_buckets: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.retries = retries
+        self.max_chat_buckets = max_chat_buckets
+        self.clock = clock
+        self.throttled = 0
+        self._global = TokenBucket(global_rate, global_rate, global_rate, clock())
+        self._chats: dict[int, TokenBucket] = {}
+        self._prune_at = max_chat_buckets
+        self._queues: list[dict[int, deque[_Job]]] = [{}, {}, {}]
+        self._ready: list[deque[int]] = [deque(), deque(), deque()]
+        self._in_ready: list[set[int]] = [set(), set(), set()]
+        self._blocked: list[tuple[float, int]] = []
+        self._blocked_chats: set[int] = set()
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._inflight: set[asyncio.Task] = set()
+        self._runner: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(jobs) for queues in self._queues for jobs in queues.values())
+
+    def start(self) -> asyncio.Task:
+        self._runner = asyncio.create_task(self.run())
+        return self._runner
+
+    async def submit(self, chat_id: int, operation: Callable[[], Awaitable[Any]], priority: int = PRIORITY_MENU) -> Any:
+        # Nothing would ever resolve the future without a live run().
+        if self._runner is None or self._runner.done():
+            raise RuntimeError("send scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(_Job(chat_id, priority, operation, future))
+        self._wakeup.set()
+        return await future
+
+    async def run(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.current_task()
+        try:
+            while True:
+                job, wait = self._next_job(self.clock())
+                if job is not None:
+                    task = asyncio.create_task(self._execute(job))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                    continue
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._fail_queued(RuntimeError("send scheduler stopped"))
+
+    def _enqueue(self, job: _Job, front: bool = False) -> None:
+        queues = self._queues[job.priority]
+        jobs = queues.get(job.chat_id)
+        if jobs is None:
+            jobs = queues[job.chat_id] = deque()
+            if job.chat_id not in self._blocked_chats:
+                self._make_ready(job.priority, job.chat_id)
+        if front:
+            jobs.appendleft(job)
+        else:
+            jobs.append(job)
+
+    def _make_ready(self, priority: int, chat_id: int) -> None:
+        if chat_id not in self._in_ready[priority]:
+            self._in_ready[priority].add(chat_id)
+            self._ready[priority].append(chat_id)
+
+    def _next_job(self, now: float) -> tuple[_Job | None, float | None]:
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        while self._blocked and self._blocked[0][0] <= now:
+            _due, chat_id = heapq.heappop(self._blocked)
+            self._blocked_chats.discard(chat_id)
+            for priority, queues in enumerate(self._queues):
+                if chat_id in queues:
+                    self._make_ready(priority, chat_id)
+        for queues, ready, in_ready in zip(self._queues, self._ready, self._in_ready):
+            while ready:
+                chat_id = ready[0]
+                jobs = queues[chat_id]
+                while jobs and jobs[0].future.done():
+                    # Submitter gave up (cancelled) before the send went out.
+                    jobs.popleft()
+                if not jobs or chat_id in self._blocked_chats:
+                    # A chat blocked while serving another lane comes back
+                    # when its next token is due.
+                    ready.popleft()
+                    in_ready.discard(chat_id)
+                    if not jobs:
+                        del queues[chat_id]
+                    continue
+                bucket = self._chat_bucket(chat_id, now)
+                chat_wait = bucket.wait_time(now)
+                if chat_wait > 0:
+                    ready.popleft()
+                    in_ready.discard(chat_id)
+                    self._blocked_chats.add(chat_id)
+                    heapq.heappush(self._blocked, (now + chat_wait, chat_id))
+                    continue
+                job = jobs.popleft()
+                bucket.tokens -= 1
+                self._global.tokens -= 1
+                # Round robin between chats of the same lane.
+                ready.rotate(-1)
+                if not jobs:
+                    ready.pop()
+                    in_ready.discard(chat_id)
+                    del queues[chat_id]
+                return job, None
+        return None, self._blocked[0][0] - now if self._blocked else None
+
+    def _fail_queued(self, exc: Exception) -> None:
+        for queues in self._queues:
+            for jobs in queues.values():
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.set_exception(exc)
+            queues.clear()
+        for ready, in_ready in zip(self._ready, self._in_ready):
+            ready.clear()
+            in_ready.clear()
+        self._blocked.clear()
+        self._blocked_chats.clear()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._prune_at:
+                self._prune_chats(now)
+            bucket = TokenBucket(self.per_chat_rate, self.per_chat_burst, self.per_chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune_chats(self, now: float) -> None:
+        # A refilled bucket carries no state worth keeping.
+        full = []
+        for chat_id, bucket in self._chats.items():
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                full.append(chat_id)
+        for chat_id in full:
+            del self._chats[chat_id]
+        # When most buckets are in use, wait for the map to double before the
+        # next full pass instead of repeating it on every new chat.
+        self._prune_at = max(self.max_chat_buckets, 2 * len(self._chats))
+
+    async def _execute(self, job: _Job) -> None:
+        started = time.perf_counter()
+        try:
+            result = await job.operation()
+        except TelegramRetryAfter as exc:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started)
+            TELEGRAM_RETRY_AFTER.inc()
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, self.clock() + exc.retry_after)
+            job.attempts += 1
+            if job.attempts >= self.retries:
+                logger.error("Failed to execute Telegram API call after retries")
+                _resolve(job.future, None)
+                return
+            logger.warning("Rate limit reached, pausing sends for %.2f sec", exc.retry_after)
+            self._enqueue(job, front=True)
+            self._wakeup.set()
+        except Exception as exc:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started)
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started)
+            _resolve(job.future, result)
+
+
+def _resolve(future: asyncio.Future, result: Any) -> None:
+    # The submitter may have been cancelled while the call was in flight.
+    if not future.done():
+        future.set_result(result)
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WAIT_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+# Commands that park on the server until data arrives; their duration is idle
+# time, not a round trip.
+BLOCKING_REDIS_COMMANDS = frozenset({"BLPOP", "BRPOP", "BZPOPMIN", "XREAD", "XREADGROUP", "SUBSCRIBE"})
+
+
+# Metrics are plain Python numbers mutated from the event loop thread only, so
+# updates need no locks; a scrape renders whatever the loop has written so far.
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.value = 0.0
+        self._children: dict[tuple[str, ...], Counter] = {}
+
+    def labels(self, *values: str) -> Counter:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Counter(self.name, self.help)
+        return child
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if not self.labelnames:
+            lines.append(f"{self.name} {_num(self.value)}")
+        for values, child in self._children.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, values)} {_num(child.value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # One slot per bucket plus +Inf; cumulated only when rendered.
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._children: dict[tuple[str, ...], Histogram] = {}
+
+    def labels(self, *values: str) -> Histogram:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Histogram(self.name, self.help, buckets=self.buckets)
+        return child
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        if not self.labelnames:
+            lines.extend(self._samples((), ()))
+        for values, child in self._children.items():
+            lines.extend(child._samples(self.labelnames, values))
+        return lines
+
+    def _samples(self, labelnames: tuple[str, ...], values: tuple[str, ...]) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else _num(bound)
+            lines.append(f"{self.name}_bucket{_labels((*labelnames, 'le'), (*values, le))} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(labelnames, values)} {_num(self.sum)}")
+        lines.append(f"{self.name}_count{_labels(labelnames, values)} {self.count}")
+        return lines
+
+
+# Sampled at scrape time; the callback may be a coroutine function (e.g. a
+# ZCARD on the search queue).
+class Gauge:
+    def __init__(self, name: str, help_text: str, callback: Callable[[], float | Awaitable[float]]):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+
+    async def collect(self) -> list[str]:
+        value = self.callback()
+        if inspect.isawaitable(value):
+            value = await value
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {_num(value)}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], float | Awaitable[float]]) -> Gauge:
+        return self.register(Gauge(name, help_text, callback))
+
+    async def render(self) -> str:
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            if isinstance(metric, Gauge):
+                try:
+                    lines.extend(await metric.collect())
+                except Exception:
+                    logger.exception("gauge %s failed", metric.name)
+            else:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES = REGISTRY.counter("bot_updates_total", "Updates handled", ("outcome",))
+UPDATE_SECONDS = REGISTRY.histogram("bot_update_seconds", "Update handling time")
+REDIS_SECONDS = REGISTRY.histogram("redis_command_seconds", "Redis round trip time", ("command",))
+PG_SECONDS = REGISTRY.histogram("postgres_query_seconds", "Postgres query time including pool wait", ("op",))
+TELEGRAM_SECONDS = REGISTRY.histogram("telegram_request_seconds", "Bot API call time")
+TELEGRAM_RETRY_AFTER = REGISTRY.counter("telegram_retry_after_total", "Bot API calls rejected with 429")
+MATCH_WAIT_SECONDS = REGISTRY.histogram(
+    "match_wait_seconds", "Time the matched partner spent in the search queue", buckets=WAIT_BUCKETS
+)
+
+
+async def timed_handler(handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await handler(event, data)
+        outcome = "ok"
+        return result
+    finally:
+        UPDATE_SECONDS.observe(time.perf_counter() - started)
+        UPDATES.labels(outcome).inc()
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        return await timed_handler(handler, event, data)
+
+
+def instrument_redis(client: Any) -> Any:
+    # Times every command and pipeline sent through this client instance.
+    execute_command = client.execute_command
+    make_pipeline = client.pipeline
+
+    async def timed_execute_command(*args: Any, **options: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await execute_command(*args, **options)
+        finally:
+            command = str(args[0]).upper()
+            if command not in BLOCKING_REDIS_COMMANDS:
+                REDIS_SECONDS.labels(command).observe(time.perf_counter() - started)
+
+    def timed_pipeline(*args: Any, **kwargs: Any) -> Any:
+        pipe = make_pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def timed_execute(*exec_args: Any, **exec_kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return await execute(*exec_args, **exec_kwargs)
+            finally:
+                REDIS_SECONDS.labels("PIPELINE").observe(time.perf_counter() - started)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+async def serve_metrics(host: str, port: int, registry: Registry = REGISTRY) -> web.AppRunner:
+    async def scrape(request: web.Request) -> web.Response:
+        return web.Response(text=await registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", scrape)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("metrics on http://%s:%d/metrics", host, port)
+    return runner
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
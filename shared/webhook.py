@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from pydantic import ValidationError
+
+from shared.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# Bounded hand-off between the webhook endpoint and the dispatcher. Updates of
+# one user always go to the same lane, and a lane is drained by one worker, so
+# a user's updates are handled in order while different users run in
+# parallel. A full lane rejects the update (the endpoint answers 503 and
+# Telegram redelivers it later) instead of buffering without limit.
+class UpdatePool:
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 8, queue_size: int = 1000, **kwargs: Any):
+        self.dp = dp
+        self.bot = bot
+        self.kwargs = kwargs
+        self.rejected = 0
+        self._lanes = [asyncio.Queue(max(1, queue_size // workers)) for _ in range(workers)]
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return sum(lane.qsize() for lane in self._lanes)
+
+    @property
+    def capacity(self) -> int:
+        return sum(lane.maxsize for lane in self._lanes)
+
+    def submit(self, update: Update) -> bool:
+        lane = self._lanes[update_lane_key(update) % len(self._lanes)]
+        try:
+            lane.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logger.warning("update lane full (depth %d/%d), rejecting update %d", self.depth, self.capacity, update.update_id)
+            return False
+        return True
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._work(lane)) for lane in self._lanes]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # Finish what was already accepted (Telegram considers it delivered).
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.join() for lane in self._lanes)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("update pool stopped with %d updates unprocessed", self.depth)
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _work(self, lane: asyncio.Queue) -> None:
+        while True:
+            update = await lane.get()
+            try:
+                await self.dp.feed_update(self.bot, update, **self.kwargs)
+            except Exception:
+                logger.exception("update %d handling failed", update.update_id)
+            finally:
+                lane.task_done()
+
+
+def update_lane_key(update: Update) -> int:
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+def build_webhook_app(pool: UpdatePool, path: str, secret: str | None = None) -> web.Application:
+    async def receive(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": pool.bot})
+        except (ValueError, ValidationError):
+            # Telegram redelivers anything but a 2xx; a body that cannot be
+            # parsed now never will be, so it is dropped instead.
+            logger.warning("malformed webhook update dropped", exc_info=True)
+            return web.Response()
+        if not pool.submit(update):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(
+            {"queue_depth": pool.depth, "queue_capacity": pool.capacity, "rejected": pool.rejected}
+        )
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    url: str,
+    host: str = "0.0.0.0",
+    port: int = 8080,
+    path: str = "/webhook",
+    secret: str | None = None,
+    workers: int = 8,
+    queue_size: int = 1000,
+    **kwargs: Any,
+) -> None:
+    pool = UpdatePool(dp, bot, workers, queue_size, **kwargs)
+    REGISTRY.gauge("update_queue_depth", "Webhook updates waiting for a worker", lambda: pool.depth)
+    runner = web.AppRunner(build_webhook_app(pool, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    pool.start()
+    await site.start()
+    await bot.set_webhook(
+        url,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=100,
+    )
+    logger.info("webhook listening on %s:%d%s", host, port, path)
+    try:
+        await dp.emit_startup(bot=bot, **kwargs)
+        await asyncio.Event().wait()
+    finally:
+        await site.stop()
+        await pool.stop()
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, **kwargs)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import json
+import struct
+from typing import Any, Protocol
+
+
+# Turns a payload dict into the fields of one Redis hash and back. decode()
+# gets HGETALL output as-is (bytes keys and values with the production client).
+class PayloadCodec(Protocol):
+    def encode(self, payload: dict[str, Any]) -> dict[str, bytes | str]: ...
+
+    def decode(self, raw: dict[Any, Any]) -> dict[str, Any]: ...
+
+
+# The original format: every field holds json.dumps(value).
+class JsonFieldCodec:
+    def encode(self, payload: dict[str, Any]) -> dict[str, bytes | str]:
+        return {key: json.dumps(value) for key, value in payload.items()}
+
+    def decode(self, raw: dict[Any, Any]) -> dict[str, Any]:
+        return {_text(key): json.loads(value) for key, value in raw.items()}
+
+
+# One field per payload key; numeric schema fields hold the bare number, so
+# Lua scripts can HMGET and compare them directly. JSON-encoded numbers are the
+# same text, so hashes written by JsonFieldCodec decode unchanged; keys outside
+# the schema stay JSON.
+class ScalarFieldCodec:
+    def __init__(self, schema: dict[str, type]):
+        self.schema = schema
+
+    def encode(self, payload: dict[str, Any]) -> dict[str, bytes | str]:
+        encoded: dict[str, bytes | str] = {}
+        for key, value in payload.items():
+            if key not in self.schema:
+                encoded[key] = json.dumps(value)
+            else:
+                encoded[key] = repr(value) if isinstance(value, float) else str(value)
+        return encoded
+
+    def decode(self, raw: dict[Any, Any]) -> dict[str, Any]:
+        decoded = {}
+        for key, value in raw.items():
+            name = _text(key)
+            kind = self.schema.get(name)
+            decoded[name] = kind(value) if kind is not None else json.loads(value)
+        return decoded
+
+
+# Fixed-layout payload in a single field: a struct-packed header followed by
+# one UTF-8 string. Needs a client that returns bytes. Payloads with other
+# keys, and hashes without the packed field (written before this codec), go
+# through `fallback`.
+class PackedCodec:
+    FIELD = "p"
+
+    def __init__(
+        self,
+        fmt: str,
+        fields: tuple[str, ...],
+        tail: str,
+        fallback: PayloadCodec | None = None,
+    ):
+        self.header = struct.Struct(fmt)
+        self.fields = fields
+        self.tail = tail
+        self.fallback = fallback or JsonFieldCodec()
+        self._keys = {*fields, tail}
+
+    def encode(self, payload: dict[str, Any]) -> dict[str, bytes | str]:
+        if payload.keys() != self._keys:
+            return self.fallback.encode(payload)
+        blob = self.header.pack(*(payload[name] for name in self.fields))
+        return {self.FIELD: blob + payload[self.tail].encode()}
+
+    def decode(self, raw: dict[Any, Any]) -> dict[str, Any]:
+        blob = raw.get(self.FIELD.encode())
+        if blob is None or len(raw) != 1:
+            return self.fallback.decode(raw)
+        decoded = dict(zip(self.fields, self.header.unpack_from(blob)))
+        decoded[self.tail] = blob[self.header.size :].decode()
+        return decoded
+
+
+# MATCH_SCRIPT writes dialog hashes and USER_CONTEXT_SCRIPT reads them, so
+# dialogs stay one plain field per value.
+DIALOG_CODEC = ScalarFieldCodec({"user1": int, "user2": int, "expires_at": float})
+TOPIC_CODEC = PackedCodec("<qd?", ("owner", "expires_at", "active"), tail="text")
+
+
+def _text(raw: bytes | str) -> str:
+    return raw.decode() if isinstance(raw, bytes) else raw
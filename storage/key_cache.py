@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+MISSING = object()
+
+
+class _Reservation:
+    __slots__ = ()
+
+
+# In-process copy of small, rarely written keys (ban flags, user state and
+# dialog pointers), kept coherent by Redis client-side tracking: the listener
+# in RedisStorage enables the cache only while its invalidation connection is
+# up and clears it whenever that connection drops.
+#
+# A read that misses reserves the key before asking Redis and fills it only if
+# its own reservation is still in place: an invalidation in between drops it,
+# and a later read reserves afresh, so a reply that raced with a write on
+# another replica is never cached, even when it arrives after the reply of a
+# read that started after the write. Entries also expire after ttl_seconds as a
+# bound on staleness should an invalidation be lost (e.g. a lazily expired
+# ban key).
+class KeyCache:
+    def __init__(self, max_size: int = 10_000, ttl_seconds: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, Any] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str) -> Any:
+        if not self.enabled:
+            return MISSING
+        entry = self._entries.get(key)
+        if entry is None or isinstance(entry, _Reservation):
+            self.misses += 1
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def reserve(self, *keys: str) -> list[Any]:
+        # One token per key, to hand back to fill(); None where there is
+        # nothing to fill (cache disabled or the key is already cached).
+        if not self.enabled:
+            return [None] * len(keys)
+        tokens: list[Any] = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None or isinstance(entry, _Reservation):
+                entry = self._entries[key] = _Reservation()
+                tokens.append(entry)
+            else:
+                tokens.append(None)
+        self._trim()
+        return tokens
+
+    def fill(self, key: str, value: Any, token: Any) -> None:
+        if token is None or self._entries.get(key) is not token:
+            return
+        self._entries[key] = (value, self.clock() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+
+    def invalidate(self, *keys: str) -> None:
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def enable(self) -> None:
+        self._entries.clear()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        self._entries.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
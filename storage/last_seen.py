@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+from redis.exceptions import ResponseError
+
+from storage.postgres_store import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "lastseen:pending"
+ACTIVE_KEY_PREFIX = "lastseen:active:"
+ACTIVE_KEY_TTL = 3 * 86400
+
+
+# Coalesces user activity in Redis and writes it to Postgres periodically.
+# touch() is a single pipelined round trip: the latest timestamp per user goes
+# to a hash (deduplicated by construction) and the user is added to a daily
+# HyperLogLog for active-user counts. flush() swaps the hash out with RENAME so
+# concurrent touches land in a fresh one, then writes it in one statement.
+class LastSeenTracker:
+    def __init__(self, redis: Any, pg: PostgresStorage, consumer: str, flush_interval: float = 60.0):
+        self.redis = redis
+        self.pg = pg
+        self.flush_interval = flush_interval
+        self.flushing_key = f"lastseen:flushing:{consumer}"
+
+    async def touch(self, user_id: int, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        active_key = ACTIVE_KEY_PREFIX + time.strftime("%Y%m%d", time.gmtime(now))
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(PENDING_KEY, user_id, now)
+        pipe.pfadd(active_key, user_id)
+        pipe.expire(active_key, ACTIVE_KEY_TTL)
+        await pipe.execute()
+
+    async def active_users(self, day: str) -> int:
+        return await self.redis.pfcount(ACTIVE_KEY_PREFIX + day)
+
+    async def flush(self) -> int:
+        # A leftover flushing hash means the previous flush did not finish;
+        # write it first so nothing is lost.
+        if not await self.redis.exists(self.flushing_key):
+            try:
+                await self.redis.rename(PENDING_KEY, self.flushing_key)
+            except ResponseError:
+                return 0
+        raw = await self.redis.hgetall(self.flushing_key)
+        seen = [
+            (int(user_id), datetime.fromtimestamp(float(ts), tz=timezone.utc))
+            for user_id, ts in raw.items()
+        ]
+        if seen:
+            await self.pg.touch_users(seen)
+        await self.redis.delete(self.flushing_key)
+        return len(seen)
+
+    async def run(self) -> None:
+        # Cancelled on shutdown; the caller then runs a final flush().
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("last-seen flush failed")
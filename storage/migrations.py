@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+
+import asyncpg
+
+from storage.partitions import convert_to_partitioned, ensure_partitions, partition_bounds
+from storage.rollups import ROLLUPS_SQL, backfill_rollups
+
+logger = logging.getLogger(__name__)
+
+# Any constant works as long as every replica uses the same one.
+MIGRATION_LOCK_ID = 0x616E6F6E
+MIGRATION_LOCK_POLL = 0.5
+
+VERSION_TABLE_SQL = """
+create table if not exists schema_migrations (
+  version integer primary key,
+  name text not null,
+  applied_at timestamptz not null default now()
+);
+"""
+
+# dialogs and reports grow by a row per match/report forever, so they are
+# range-partitioned by month (storage/partitions.py). The primary key has to
+# include the partition column.
+DIALOGS_SQL = """
+create table if not exists dialogs (
+  id text not null,
+  user1 bigint not null,
+  user2 bigint not null,
+  started_at timestamptz not null default now(),
+  ended_at timestamptz,
+  reason text,
+  primary key (id, started_at)
+) partition by range (started_at);
+"""
+
+REPORTS_SQL = """
+create sequence if not exists reports_id_seq;
+create table if not exists reports (
+  id bigint not null default nextval('reports_id_seq'),
+  from_id bigint not null,
+  target_id bigint not null,
+  reason text,
+  created_at timestamptz not null default now(),
+  primary key (id, created_at)
+) partition by range (created_at);
+alter sequence reports_id_seq owned by reports.id;
+"""
+
+BASELINE_SQL = """
+create table if not exists users (
+  telegram_id bigint primary key,
+  created_at timestamptz not null default now(),
+  last_seen_at timestamptz not null default now(),
+  ban_until timestamptz
+);
+create table if not exists topics (
+  id text primary key,
+  user_id bigint not null,
+  text text not null,
+  created_at timestamptz not null default now(),
+  expires_at timestamptz not null
+);
+""" + DIALOGS_SQL + REPORTS_SQL
+
+PARTITION_SQL = {"dialogs": DIALOGS_SQL, "reports": REPORTS_SQL}
+
+
+@dataclass(frozen=True, slots=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[Any], Awaitable[None]]
+    # Steps using CONCURRENTLY cannot run inside a transaction block; they
+    # must be safe to re-run after a crash halfway through.
+    transactional: bool = True
+
+
+def sql(statements: str) -> Callable[[Any], Awaitable[None]]:
+    async def apply(conn: Any) -> None:
+        await conn.execute(statements)
+
+    return apply
+
+
+async def create_index_concurrently(conn: Any, table: str, name: str, columns: str) -> None:
+    # CREATE INDEX CONCURRENTLY is not supported on a partitioned table: the
+    # parent index is created ON ONLY the parent (metadata only, starts
+    # invalid), each partition gets its own index concurrently, and attaching
+    # the last one makes the parent valid. Partitions created later get the
+    # index automatically.
+    partitions = [partition for partition, _upper in await partition_bounds(conn, table)]
+    if not partitions:
+        await _build_index(conn, table, name, columns)
+        return
+    await conn.execute(f"create index if not exists {name} on only {table} ({columns})")
+    suffix = name.removeprefix(table)
+    for partition in partitions:
+        await _build_index(conn, partition, f"{partition}{suffix}", columns)
+        await conn.execute(f"alter index {name} attach partition {partition}{suffix}")
+
+
+async def _build_index(conn: Any, table: str, name: str, columns: str) -> None:
+    # A CONCURRENTLY build that was interrupted leaves an invalid index behind
+    # that IF NOT EXISTS would happily skip.
+    if await conn.fetchval("select not indisvalid from pg_index where indexrelid = to_regclass($1)", name):
+        await conn.execute(f"drop index concurrently if exists {name}")
+    await conn.execute(f"create index concurrently if not exists {name} on {table} ({columns})")
+
+
+async def _partition_tables(conn: Any) -> None:
+    now = datetime.now(timezone.utc)
+    for table, create_sql in PARTITION_SQL.items():
+        await convert_to_partitioned(conn, table, create_sql, now)
+        await ensure_partitions(conn, table, now)
+
+
+async def _lookup_indexes(conn: Any) -> None:
+    await create_index_concurrently(conn, "dialogs", "dialogs_user1_idx", "user1")
+    await create_index_concurrently(conn, "dialogs", "dialogs_user2_idx", "user2")
+    await create_index_concurrently(conn, "reports", "reports_target_idx", "target_id, created_at")
+
+
+async def _dialog_rollups(conn: Any) -> None:
+    # Runs before this replica writes any dialogs, so everything started up
+    # to now is history. Chunks commit on their own and replace their hours,
+    # so a crash halfway is repaired by the retry.
+    await conn.execute(ROLLUPS_SQL)
+    hours = await backfill_rollups(conn, datetime.now(timezone.utc))
+    logger.info("rollups backfilled", extra={"hours": hours})
+
+
+# Append only: never edit a migration that has shipped. Version 1 is all
+# IF NOT EXISTS, so databases created by the old startup DDL take it as a
+# no-op and version 2 converts their plain tables.
+MIGRATIONS = [
+    Migration(1, "baseline", sql(BASELINE_SQL)),
+    Migration(2, "partition dialogs and reports", _partition_tables, transactional=False),
+    Migration(3, "dialog and report lookup indexes", _lookup_indexes, transactional=False),
+    Migration(4, "hourly dialog rollups", _dialog_rollups, transactional=False),
+]
+
+
+async def schema_version(conn: Any) -> int:
+    try:
+        return await conn.fetchval("select coalesce(max(version), 0) from schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(
+    conn: Any, migrations: list[Migration] = MIGRATIONS, lock_poll: float = MIGRATION_LOCK_POLL
+) -> list[int]:
+    # The common case is one indexed max() and no DDL at all. Otherwise the
+    # advisory lock serialises replicas starting together; whoever waited
+    # re-reads the version and usually finds nothing left to do.
+    if await schema_version(conn) >= migrations[-1].version:
+        return []
+    # Polled rather than waited for: a session blocked in pg_advisory_lock
+    # holds a snapshot, and CREATE/DROP INDEX CONCURRENTLY in the lock
+    # holder's migration waits for every older snapshot to go away.
+    while not await conn.fetchval("select pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+        await asyncio.sleep(lock_poll)
+    try:
+        await conn.execute(VERSION_TABLE_SQL)
+        current = await schema_version(conn)
+        applied = []
+        for migration in migrations:
+            if migration.version <= current:
+                continue
+            logger.info("applying migration", extra={"version": migration.version, "migration": migration.name})
+            if migration.transactional:
+                async with conn.transaction():
+                    await migration.apply(conn)
+                    await _record(conn, migration)
+            else:
+                await migration.apply(conn)
+                await _record(conn, migration)
+            applied.append(migration.version)
+        return applied
+    finally:
+        await conn.execute("select pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def _record(conn: Any, migration: Migration) -> None:
+    await conn.execute(
+        "insert into schema_migrations(version, name) values($1, $2)", migration.version, migration.name
+    )
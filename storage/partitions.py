@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import logging
+import re
+from datetime import datetime, timezone
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Append-only tables and the column they are range-partitioned on.
+PARTITIONED_TABLES = {"dialogs": "started_at", "reports": "created_at"}
+MONTHS_AHEAD = 3
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(ts: datetime) -> datetime:
+    ts = ts.astimezone(timezone.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(ts: datetime, months: int) -> datetime:
+    index = ts.year * 12 + ts.month - 1 + months
+    return ts.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    return f"{table}_p{start:%Y%m}"
+
+
+async def partition_bounds(conn: Any, table: str) -> list[tuple[str, datetime]]:
+    # (partition, exclusive upper bound) ordered by bound; monthly partitions
+    # are contiguous, so the last bound is where the next one starts.
+    rows = await conn.fetch(
+        """
+        select c.relname, pg_get_expr(c.relpartbound, c.oid) as bound
+        from pg_inherits i join pg_class c on c.oid = i.inhrelid
+        where i.inhparent = $1::regclass
+        """,
+        table,
+    )
+    bounds = []
+    for row in rows:
+        match = _UPPER_BOUND.search(row["bound"])
+        if match is not None:
+            bounds.append((row["relname"], datetime.fromisoformat(match.group(1)).astimezone(timezone.utc)))
+    return sorted(bounds, key=lambda item: item[1])
+
+
+async def ensure_partitions(conn: Any, table: str, now: datetime, months_ahead: int = MONTHS_AHEAD) -> list[str]:
+    # Creates monthly partitions up to months_ahead past the current month,
+    # starting where the existing ones end. There is no default partition: a
+    # row outside every range fails loudly instead of landing in a partition
+    # that would have to be scanned each time a new one is attached.
+    bounds = await partition_bounds(conn, table)
+    start = month_start(now)
+    if bounds and bounds[-1][1] > start:
+        start = bounds[-1][1]
+    created = []
+    until = add_months(month_start(now), months_ahead + 1)
+    while start < until:
+        end = add_months(start, 1)
+        name = partition_name(table, start)
+        await conn.execute(
+            f"create table if not exists {name} partition of {table}"
+            f" for values from ('{start.isoformat()}') to ('{end.isoformat()}')"
+        )
+        created.append(name)
+        start = end
+    return created
+
+
+async def drop_partitions_before(conn: Any, table: str, cutoff: datetime) -> list[str]:
+    # Retention: whole partitions ending at or before cutoff are detached
+    # (CONCURRENTLY, so inserts into the parent are not blocked) and dropped.
+    # The row-by-row DELETE this replaces had to vacuum what it removed.
+    dropped = []
+    for name, upper in await partition_bounds(conn, table):
+        if upper > cutoff:
+            break
+        await conn.execute(f"alter table {table} detach partition {name} concurrently")
+        await conn.execute(f"drop table {name}")
+        dropped.append(name)
+    return dropped
+
+
+async def convert_to_partitioned(conn: Any, table: str, create_sql: str, now: datetime) -> bool:
+    # Turns a plain table into a partitioned one while it keeps taking writes.
+    # The existing table becomes the partition <table>_legacy covering
+    # everything before next month; the slow steps (unique index, range check)
+    # run CONCURRENTLY / as NOT VALID + VALIDATE first, so the final swap only
+    # holds the exclusive lock for a few catalog updates.
+    relkind = await conn.fetchval("select relkind from pg_class where oid = to_regclass($1)", table)
+    if relkind != "r":
+        return False
+    column = PARTITIONED_TABLES[table]
+    legacy = f"{table}_legacy"
+    cutoff = add_months(month_start(now), 1).isoformat()
+    logger.info("partitioning table", extra={"table": table, "cutoff": cutoff})
+    await conn.execute(f"create unique index concurrently if not exists {legacy}_key on {table} (id, {column})")
+    # ATTACH PARTITION only reuses an index that backs a constraint; a bare
+    # unique index would be rebuilt under the exclusive lock below.
+    await conn.execute(
+        f"""
+        do $$ begin
+          if not exists (
+            select 1 from pg_constraint where conrelid = '{table}'::regclass and conname = '{legacy}_key'
+          ) then
+            alter table {table} add constraint {legacy}_key unique using index {legacy}_key;
+          end if;
+        end $$
+        """
+    )
+    await conn.execute(
+        f"""
+        do $$ begin
+          alter table {table} add constraint {legacy}_range check ({column} < '{cutoff}') not valid;
+        exception when duplicate_object then null;
+        end $$
+        """
+    )
+    await conn.execute(f"alter table {table} validate constraint {legacy}_range")
+    async with conn.transaction():
+        await conn.execute("set local lock_timeout = '5s'")
+        await conn.execute(f"lock table {table} in access exclusive mode")
+        await conn.execute(f"alter table {table} rename to {legacy}")
+        await conn.execute(f"alter index {table}_pkey rename to {legacy}_pkey")
+        await conn.execute(create_sql)
+        await conn.execute(
+            f"alter table {table} attach partition {legacy} for values from (minvalue) to ('{cutoff}')"
+        )
+    return True
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class PartnerEntry:
+    dialog_id: str
+    partner: int
+    expires_at: float
+
+
+# In-process user -> (dialog_id, partner) cache for the relay hot path. Entries
+# never outlive the dialog hash they were read from; RedisStorage additionally
+# checks the cached dialog id against user:{id}:dialog_id on every read.
+class PartnerCache:
+    def __init__(self, max_size: int = 10_000, ttl_seconds: float = 300.0, clock: Callable[[], float] = time.time):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[int, PartnerEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, user_id: int) -> PartnerEntry | None:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= self.clock():
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry
+
+    def put(self, user_id: int, dialog_id: str, partner: int, dialog_expires_at: float | None = None) -> None:
+        expires_at = self.clock() + self.ttl_seconds
+        if dialog_expires_at is not None:
+            expires_at = min(expires_at, dialog_expires_at)
+        self._entries[user_id] = PartnerEntry(dialog_id, partner, expires_at)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        if self._entries.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
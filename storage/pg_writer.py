@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any
+
+import asyncpg
+from redis.exceptions import ResponseError
+
+from storage.postgres_store import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "pg:writes"
+GROUP_NAME = "pg-writer"
+DEAD_LETTER_KEY = "pg:writes:dead"
+# Failures that replaying the same entries cannot fix: a payload that does not
+# parse, or a row Postgres rejects (e.g. no partition covers its timestamp).
+PERMANENT_ERRORS = (
+    ValueError,
+    KeyError,
+    IndexError,
+    asyncpg.DataError,
+    asyncpg.IntegrityConstraintViolationError,
+)
+
+
+# Write-behind front for PostgresStorage. Handlers call the same methods as on
+# PostgresStorage, but each call is only an XADD to a Redis stream; run()
+# drains the stream through a consumer group and flushes batches with
+# PostgresStorage.write_batch. Entries are acknowledged after the transaction
+# commits, so a crash between read and commit replays them (at-least-once).
+# Replicas share the consumer group, so a dialog's end can be flushed before
+# its creation; such ends stay pending and are retried every retry_idle_ms
+# until the dialog row exists (or orphan_end_seconds have passed).
+# A batch that keeps failing with a permanent error is split in halves until
+# the entry at fault is alone; that entry goes to DEAD_LETTER_KEY so the rest
+# of the stream keeps moving.
+class PostgresWriteBehind:
+    def __init__(
+        self,
+        redis: Any,
+        pg: PostgresStorage,
+        consumer: str,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        max_pending: int = 100_000,
+        claim_idle_ms: int = 60_000,
+        retry_idle_ms: int = 5_000,
+        orphan_end_seconds: float = 3600.0,
+        max_flush_attempts: int = 3,
+    ):
+        self.redis = redis
+        self.pg = pg
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.claim_idle_ms = claim_idle_ms
+        self.retry_idle_ms = retry_idle_ms
+        self.orphan_end_seconds = orphan_end_seconds
+        self.max_flush_attempts = max_flush_attempts
+        self._stopping = False
+        self._group_ready = False
+
+    async def upsert_user(self, user_id: int) -> None:
+        await self._enqueue("upsert_user", user_id)
+
+    async def create_dialog(self, dialog_id: str, user1: int, user2: int, wait_seconds: float | None = None) -> None:
+        # started_at is fixed here so a replayed insert hits the same
+        # (id, started_at) key and is skipped.
+        started_at = datetime.now(timezone.utc).isoformat()
+        await self._enqueue("create_dialog", dialog_id, user1, user2, started_at, wait_seconds)
+
+    async def end_dialog(self, dialog_id: str, reason: str) -> None:
+        # Like started_at: the event time, not whenever the flush happens.
+        await self._enqueue("end_dialog", dialog_id, reason, datetime.now(timezone.utc).isoformat())
+
+    async def create_topic(self, topic_id: str, user_id: int, text: str, expires_at: datetime) -> None:
+        await self._enqueue("create_topic", topic_id, user_id, text, expires_at.isoformat())
+
+    async def create_report(self, from_id: int, target_id: int, reason: str) -> None:
+        await self._enqueue("create_report", from_id, target_id, reason)
+
+    async def _enqueue(self, op: str, *args: Any) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xadd(STREAM_KEY, {"op": op, "args": json.dumps(args)})
+        pipe.xlen(STREAM_KEY)
+        _entry_id, backlog = await pipe.execute()
+        # Backpressure: slow producers down instead of letting the buffer grow
+        # without bound while Postgres is unavailable or behind.
+        while backlog > self.max_pending and not self._stopping:
+            logger.warning("pg write-behind backlog %d over limit, throttling producer", backlog)
+            await asyncio.sleep(self.flush_interval)
+            backlog = await self.redis.xlen(STREAM_KEY)
+
+    async def run(self) -> None:
+        await self._ensure_group()
+        # Entries read by this consumer (or a dead one) but never acknowledged.
+        await self._retry_pending(0)
+        next_retry = time.monotonic() + self.retry_idle_ms / 1000
+        while not self._stopping:
+            await self._flush_retrying(await self._read_batch())
+            if time.monotonic() >= next_retry:
+                await self._retry_pending(self.retry_idle_ms)
+                next_retry = time.monotonic() + self.retry_idle_ms / 1000
+        # Graceful shutdown: flush what is buffered right now (bounded, other
+        # replicas may keep producing). Failed entries stay pending in the
+        # stream for the next start.
+        remaining = await self.redis.xlen(STREAM_KEY)
+        while remaining > 0 and (entries := await self._read(count=self.batch_size, block_ms=None)):
+            if not await self._flush_retrying(entries):
+                return
+            remaining -= len(entries)
+
+    def close(self) -> None:
+        self._stopping = True
+
+    async def process_batch(self) -> int:
+        await self._ensure_group()
+        entries = await self._read_batch()
+        await self._flush(entries)
+        return len(entries)
+
+    async def _ensure_group(self) -> None:
+        if self._group_ready:
+            return
+        try:
+            await self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+        self._group_ready = True
+
+    async def _retry_pending(self, min_idle_ms: int) -> None:
+        # One pass over this consumer's pending entries, then over entries of
+        # consumers idle for claim_idle_ms. Both walk forward from a cursor:
+        # entries left pending by their flush are not picked up again in the
+        # same pass.
+        start = "-"
+        while not self._stopping:
+            own = await self.redis.xpending_range(
+                STREAM_KEY,
+                GROUP_NAME,
+                min=start,
+                max="+",
+                count=self.batch_size,
+                consumername=self.consumer,
+                idle=min_idle_ms or None,
+            )
+            if not own:
+                break
+            entries = await self.redis.xclaim(
+                STREAM_KEY, GROUP_NAME, self.consumer, min_idle_ms, [item["message_id"] for item in own]
+            )
+            if not await self._flush_retrying(entries):
+                return
+            start = _next_id(own[-1]["message_id"])
+        cursor = "0-0"
+        while not self._stopping:
+            cursor, claimed, *_ = await self.redis.xautoclaim(
+                STREAM_KEY, GROUP_NAME, self.consumer, self.claim_idle_ms, start_id=cursor, count=self.batch_size
+            )
+            if claimed and not await self._flush_retrying(claimed):
+                return
+            if _text(cursor) == "0-0":
+                break
+
+    async def _read_batch(self) -> list[tuple[Any, dict]]:
+        entries: list[tuple[Any, dict]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(entries) < self.batch_size and not self._stopping:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            count = self.batch_size - len(entries)
+            batch = await self._read(count=count, block_ms=None)
+            if not batch:
+                batch = await self._read(count=count, block_ms=max(1, int(remaining * 1000)))
+            entries.extend(batch)
+        return entries
+
+    async def _read(self, count: int, block_ms: int | None) -> list[tuple[Any, dict]]:
+        response = await self.redis.xreadgroup(GROUP_NAME, self.consumer, {STREAM_KEY: ">"}, count=count, block=block_ms)
+        if not response:
+            return []
+        return response[0][1]
+
+    async def _flush_retrying(self, entries: list[tuple[Any, dict]]) -> bool:
+        delay = self.flush_interval
+        attempts = 0
+        while True:
+            try:
+                await self._flush(entries)
+                return True
+            except Exception as exc:
+                attempts += 1
+                if isinstance(exc, PERMANENT_ERRORS) and attempts >= self.max_flush_attempts:
+                    return await self._isolate(entries, exc)
+                logger.exception("pg write-behind flush of %d entries failed, retrying", len(entries))
+                if self._stopping:
+                    return False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _isolate(self, entries: list[tuple[Any, dict]], exc: Exception) -> bool:
+        # Outages never get here, so nothing is dead-lettered just because
+        # Postgres was down; a half failing that way is retried as usual.
+        if len(entries) == 1:
+            await self._dead_letter(entries[0], exc)
+            return True
+        middle = len(entries) // 2
+        for half in (entries[:middle], entries[middle:]):
+            if not await self._flush_retrying(half):
+                return False
+        return True
+
+    async def _dead_letter(self, entry: tuple[Any, dict], exc: Exception) -> None:
+        entry_id, raw_fields = entry
+        logger.error(
+            "pg write-behind entry moved to dead letters",
+            extra={"entry": _text(entry_id), "error": repr(exc)},
+        )
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xadd(DEAD_LETTER_KEY, {**raw_fields, "entry_id": entry_id, "error": repr(exc)})
+        pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+        pipe.xdel(STREAM_KEY, entry_id)
+        await pipe.execute()
+
+    async def _flush(self, entries: list[tuple[Any, dict]]) -> None:
+        if not entries:
+            return
+        users: dict[int, None] = {}
+        dialogs: list[tuple[str, int, int, datetime, float | None]] = []
+        topics: list[tuple[str, int, str, datetime]] = []
+        reports: list[tuple[int, int, str]] = []
+        dialog_ends: list[tuple[str, str, datetime]] = []
+        end_entries: dict[Any, str] = {}
+        for entry_id, raw_fields in entries:
+            if not raw_fields:
+                # Trimmed or deleted while pending: only the ack is left to do.
+                continue
+            fields = {_text(k): _text(v) for k, v in raw_fields.items()}
+            op = fields["op"]
+            args = json.loads(fields["args"])
+            if op == "upsert_user":
+                users[args[0]] = None
+            elif op == "create_dialog":
+                # Entries queued before started_at was recorded get the flush time.
+                started_at = datetime.fromisoformat(args[3]) if len(args) > 3 else datetime.now(timezone.utc)
+                wait_seconds = args[4] if len(args) > 4 else None
+                dialogs.append((args[0], args[1], args[2], started_at, wait_seconds))
+            elif op == "create_topic":
+                topics.append((args[0], args[1], args[2], datetime.fromisoformat(args[3])))
+            elif op == "create_report":
+                reports.append((args[0], args[1], args[2]))
+            elif op == "end_dialog":
+                # Entries queued before ended_at was recorded get the flush time.
+                ended_at = datetime.fromisoformat(args[2]) if len(args) > 2 else datetime.now(timezone.utc)
+                dialog_ends.append((args[0], args[1], ended_at))
+                end_entries[entry_id] = args[0]
+            else:
+                logger.error("pg write-behind: unknown op %r dropped", op)
+        missing = set(await self.pg.write_batch(list(users), dialogs, topics, reports, dialog_ends))
+        ids = []
+        waiting = 0
+        for entry_id, _fields in entries:
+            dialog_id = end_entries.get(entry_id)
+            if dialog_id in missing:
+                if time.time() - _entry_time(entry_id) < self.orphan_end_seconds:
+                    waiting += 1
+                    continue
+                logger.error("pg write-behind: end of unknown dialog %s dropped", dialog_id)
+            ids.append(entry_id)
+        if waiting:
+            logger.info("pg write-behind: %d dialog ends arrived before their dialog, retrying later", waiting)
+        if not ids:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(STREAM_KEY, GROUP_NAME, *ids)
+        pipe.xdel(STREAM_KEY, *ids)
+        await pipe.execute()
+
+
+def _next_id(entry_id: bytes | str) -> str:
+    ms, seq = _text(entry_id).split("-", 1)
+    return f"{ms}-{int(seq) + 1}"
+
+
+def _entry_time(entry_id: bytes | str) -> float:
+    # Stream ids start with the enqueue time in milliseconds.
+    return int(_text(entry_id).split("-", 1)[0]) / 1000
+
+
+def _text(raw: bytes | str) -> str:
+    return raw.decode() if isinstance(raw, bytes) else raw
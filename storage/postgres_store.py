@@ -1,38 +1,21 @@
 from __future__ import annotations
 
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any
+
 import asyncpg
 
+from shared.metrics import PG_SECONDS
+from storage.migrations import migrate
+from storage.partitions import PARTITIONED_TABLES, add_months, drop_partitions_before, ensure_partitions, month_start
+from storage.rollups import RollupBatch, apply_rollups, backfill_rollups, load_rollups, summarize
 
-SCHEMA_SQL = """
-create table if not exists users (
-  telegram_id bigint primary key,
-  created_at timestamptz not null default now(),
-  last_seen_at timestamptz not null default now(),
-  ban_until timestamptz
-);
-create table if not exists dialogs (
-  id text primary key,
-  user1 bigint not null,
-  user2 bigint not null,
-  started_at timestamptz not null default now(),
-  ended_at timestamptz,
-  reason text
-);
-create table if not exists topics (
-  id text primary key,
-  user_id bigint not null,
-  text text not null,
-  created_at timestamptz not null default now(),
-  expires_at timestamptz not null
-);
-create table if not exists reports (
-  id bigserial primary key,
-  from_id bigint not null,
-  target_id bigint not null,
-  reason text,
-  created_at timestamptz not null default now()
-);
-"""
+logger = logging.getLogger(__name__)
 
 
 class PostgresStorage:
@@ -43,15 +26,60 @@ class PostgresStorage:
     async def from_dsn(cls, dsn: str) -> "PostgresStorage":
         pool = await asyncpg.create_pool(dsn=dsn, min_size=1, max_size=4)
         store = cls(pool)
-        await store.init_schema()
+        await store.migrate()
         return store
 
     async def close(self) -> None:
         await self.pool.close()
 
-    async def init_schema(self) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(SCHEMA_SQL)
+    @asynccontextmanager
+    async def _acquire(self, op: str) -> AsyncIterator[asyncpg.Connection]:
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                yield conn
+        finally:
+            PG_SECONDS.labels(op).observe(time.perf_counter() - started)
+
+    async def migrate(self) -> list[int]:
+        async with self._acquire("migrate") as conn:
+            applied = await migrate(conn)
+        if applied:
+            logger.info("schema migrated", extra={"versions": ",".join(map(str, applied))})
+        return applied
+
+    async def maintain_partitions(self, retention_months: int = 0) -> None:
+        # Keeps MONTHS_AHEAD partitions ready and, when retention is set,
+        # drops partitions that ended more than retention_months ago.
+        now = datetime.now(timezone.utc)
+        async with self._acquire("maintain_partitions") as conn:
+            for table in PARTITIONED_TABLES:
+                await ensure_partitions(conn, table, now)
+                if retention_months > 0:
+                    cutoff = add_months(month_start(now), -retention_months)
+                    dropped = await drop_partitions_before(conn, table, cutoff)
+                    if dropped:
+                        logger.info("partitions dropped", extra={"table": table, "partitions": ",".join(dropped)})
+
+    async def run_partition_maintenance(self, retention_months: int = 0, interval_seconds: float = 3600.0) -> None:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.maintain_partitions(retention_months)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("partition maintenance failed")
+
+    async def backfill_rollups(self, until: datetime) -> int:
+        async with self._acquire("backfill_rollups") as conn:
+            return await backfill_rollups(conn, until)
+
+    async def dialog_stats(self, since: datetime, until: datetime | None = None) -> dict[str, Any]:
+        # Reads at most one row per hour, however many dialogs there were.
+        until = until or datetime.now(timezone.utc)
+        async with self._acquire("dialog_stats") as conn:
+            return summarize(await load_rollups(conn, since, until))
 
     async def upsert_user(self, user_id: int) -> None:
         sql = """
@@ -60,28 +88,40 @@ class PostgresStorage:
         on conflict (telegram_id)
         do update set last_seen_at = now();
         """
-        async with self.pool.acquire() as conn:
+        async with self._acquire("upsert_user") as conn:
             await conn.execute(sql, user_id)
 
-    async def create_dialog(self, dialog_id: str, user1: int, user2: int) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "insert into dialogs(id, user1, user2) values($1, $2, $3)",
-                dialog_id,
-                user1,
-                user2,
-            )
+    async def touch_users(self, seen: list[tuple[int, datetime]]) -> None:
+        # One statement for a whole flush; rows are only rewritten when the
+        # timestamp actually moves forward.
+        sql = """
+        insert into users(telegram_id, last_seen_at)
+        select * from unnest($1::bigint[], $2::timestamptz[])
+        on conflict (telegram_id)
+        do update set last_seen_at = excluded.last_seen_at
+        where users.last_seen_at < excluded.last_seen_at;
+        """
+        async with self._acquire("touch_users") as conn:
+            await conn.execute(sql, [user_id for user_id, _ in seen], [ts for _, ts in seen])
+
+    # Without write-behind, dialogs go through write_batch too so the hourly
+    # rollups stay in step with the dialogs table.
+    async def create_dialog(
+        self,
+        dialog_id: str,
+        user1: int,
+        user2: int,
+        started_at: datetime | None = None,
+        wait_seconds: float | None = None,
+    ) -> None:
+        started_at = started_at or datetime.now(timezone.utc)
+        await self.write_batch([], [(dialog_id, user1, user2, started_at, wait_seconds)], [], [], [])
 
     async def end_dialog(self, dialog_id: str, reason: str) -> None:
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "update dialogs set ended_at=now(), reason=$2 where id=$1",
-                dialog_id,
-                reason,
-            )
+        await self.write_batch([], [], [], [], [(dialog_id, reason, datetime.now(timezone.utc))])
 
     async def create_topic(self, topic_id: str, user_id: int, text: str, expires_at) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire("create_topic") as conn:
             await conn.execute(
                 "insert into topics(id, user_id, text, expires_at) values($1, $2, $3, $4)",
                 topic_id,
@@ -91,10 +131,91 @@ class PostgresStorage:
             )
 
     async def create_report(self, from_id: int, target_id: int, reason: str) -> None:
-        async with self.pool.acquire() as conn:
+        async with self._acquire("create_report") as conn:
             await conn.execute(
                 "insert into reports(from_id, target_id, reason) values($1, $2, $3)",
                 from_id,
                 target_id,
                 reason,
-            )
\ No newline at end of file
+            )
+
+    async def write_batch(
+        self,
+        users: list[int],
+        dialogs: list[tuple[str, int, int, datetime, float | None]],
+        topics: list[tuple[str, int, str, datetime]],
+        reports: list[tuple[int, int, str]],
+        dialog_ends: list[tuple[str, str, datetime]],
+    ) -> list[str]:
+        # Inserts run before dialog ends so a dialog created and finished within
+        # one batch is updated after it exists. Replays are harmless except for
+        # reports, which may be duplicated (write-behind is at-least-once).
+        # Dialog ends cannot be pruned to one partition (only the id is known)
+        # and probe each partition's primary key index.
+        # Hourly rollups are updated in the same transaction from the rows the
+        # statements report back, so replayed entries, which insert or end
+        # nothing, are not counted twice.
+        # Returns the ids of ended dialogs that have no row (yet); the caller
+        # retries those ends later.
+        rollups = RollupBatch()
+        missing: list[str] = []
+        async with self._acquire("write_batch") as conn:
+            async with conn.transaction():
+                if users:
+                    await conn.executemany(
+                        """
+                        insert into users(telegram_id)
+                        values($1)
+                        on conflict (telegram_id)
+                        do update set last_seen_at = now();
+                        """,
+                        [(user_id,) for user_id in users],
+                    )
+                if dialogs:
+                    waits = {dialog[0]: dialog[4] for dialog in dialogs}
+                    inserted = await conn.fetch(
+                        """
+                        insert into dialogs(id, user1, user2, started_at)
+                        select * from unnest($1::text[], $2::bigint[], $3::bigint[], $4::timestamptz[])
+                        on conflict (id, started_at) do nothing
+                        returning id, started_at
+                        """,
+                        [dialog[0] for dialog in dialogs],
+                        [dialog[1] for dialog in dialogs],
+                        [dialog[2] for dialog in dialogs],
+                        [dialog[3] for dialog in dialogs],
+                    )
+                    for row in inserted:
+                        rollups.add_start(row["started_at"], waits[row["id"]])
+                if topics:
+                    await conn.executemany(
+                        "insert into topics(id, user_id, text, expires_at) values($1, $2, $3, $4)"
+                        " on conflict (id) do nothing",
+                        topics,
+                    )
+                if reports:
+                    await conn.copy_records_to_table(
+                        "reports", records=reports, columns=["from_id", "target_id", "reason"]
+                    )
+                if dialog_ends:
+                    end_ids = [dialog_id for dialog_id, _reason, _ended_at in dialog_ends]
+                    ended = await conn.fetch(
+                        """
+                        update dialogs d set ended_at = e.ended_at, reason = e.reason
+                        from unnest($1::text[], $2::text[], $3::timestamptz[]) as e(id, reason, ended_at)
+                        where d.id = e.id and d.ended_at is null
+                        returning d.id, d.started_at, d.ended_at, d.reason
+                        """,
+                        end_ids,
+                        [reason for _dialog_id, reason, _ended_at in dialog_ends],
+                        [ended_at for _dialog_id, _reason, ended_at in dialog_ends],
+                    )
+                    for row in ended:
+                        rollups.add_end(row["started_at"], row["ended_at"], row["reason"])
+                    # Not updated: either already ended (a replay) or not inserted yet.
+                    unmatched = set(end_ids) - {row["id"] for row in ended}
+                    if unmatched:
+                        known = await conn.fetch("select id from dialogs where id = any($1::text[])", list(unmatched))
+                        missing = sorted(unmatched - {row["id"] for row in known})
+                await apply_rollups(conn, rollups)
+        return missing
@@ -1,73 +1,648 @@
 from __future__ import annotations
 
+import asyncio
 import json
-from dataclasses import dataclass
+import logging
+import time
+from dataclasses import dataclass, field
 from typing import Any
 
+from shared.metrics import MATCH_WAIT_SECONDS
 from states import UserState
+from storage.codecs import DIALOG_CODEC, TOPIC_CODEC, PayloadCodec
+from storage.key_cache import MISSING, KeyCache
+from storage.partner_cache import PartnerCache
+
+logger = logging.getLogger(__name__)
+
+
+# Pops the longest-waiting SEARCHING partner for ARGV[1] from the queue and
+# creates the dialog in the same round trip. Stale entries (users that are no
+# longer SEARCHING) are dropped instead of being re-queued; the caller keeps
+# its original enqueue time when no partner is found. Returns the partner and
+# the time it was enqueued.
+MATCH_SCRIPT = """
+local queue = KEYS[1]
+local deadlines = KEYS[2]
+local expiring = KEYS[3]
+local members = KEYS[4]
+local user_id = ARGV[1]
+local dialog_id = ARGV[2]
+local user_prefix = 'user:' .. user_id
+
+local own_state = redis.call('GET', user_prefix .. ':state')
+if own_state == 'IN_DIALOG' or (ARGV[6] == '1' and own_state ~= 'SEARCHING') then
+  return false
+end
+
+local partner = false
+local partner_score = false
+local own_score = false
+while true do
+  local popped = redis.call('ZPOPMIN', queue)
+  if #popped == 0 then
+    break
+  end
+  local candidate = popped[1]
+  if candidate == user_id then
+    own_score = popped[2]
+  elseif redis.call('GET', 'user:' .. candidate .. ':state') == 'SEARCHING' then
+    partner = candidate
+    partner_score = popped[2]
+    break
+  end
+end
+
+if not partner then
+  if own_score then
+    redis.call('ZADD', queue, own_score, user_id)
+  end
+  return false
+end
+
+redis.call('ZREM', queue, user_id)
+redis.call('ZREM', deadlines, user_id, partner)
+local dialog_key = 'dialog:' .. dialog_id
+redis.call('HSET', dialog_key,
+  'user1', user_id,
+  'user2', partner,
+  'started_at', ARGV[3],
+  'expires_at', ARGV[4])
+redis.call('EXPIRE', dialog_key, ARGV[5])
+redis.call('ZADD', expiring, ARGV[4], dialog_id)
+redis.call('HSET', members, dialog_id, user_id .. ',' .. partner)
+redis.call('SET', user_prefix .. ':dialog_id', dialog_id)
+redis.call('SET', 'user:' .. partner .. ':dialog_id', dialog_id)
+redis.call('SET', user_prefix .. ':state', 'IN_DIALOG')
+redis.call('SET', 'user:' .. partner .. ':state', 'IN_DIALOG')
+return {partner, partner_score}
+"""
+
+# Claims searches whose deadline has passed and resets them to IDLE. Users that
+# already left SEARCHING (matched or cancelled) are dropped without changes.
+EXPIRE_SEARCHES_SCRIPT = """
+local queue = KEYS[1]
+local deadlines = KEYS[2]
+local due = redis.call('ZRANGEBYSCORE', deadlines, '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local expired = {}
+for _, user_id in ipairs(due) do
+  redis.call('ZREM', deadlines, user_id)
+  local state_key = 'user:' .. user_id .. ':state'
+  if redis.call('GET', state_key) == 'SEARCHING' then
+    redis.call('ZREM', queue, user_id)
+    redis.call('SET', state_key, 'IDLE')
+    table.insert(expired, user_id)
+  end
+end
+return expired
+"""
+
+# Everything on_message needs about a user in one round trip. Partner
+# resolution mirrors DialogService.get_partner: whichever side is not the user.
+# ARGV[2] is the dialog id the caller already has cached; the dialog hash is not
+# read again when it still matches the user's pointer.
+USER_CONTEXT_SCRIPT = """
+local user_id = ARGV[1]
+local user_prefix = 'user:' .. user_id
+local banned = redis.call('EXISTS', 'ban:' .. user_id)
+local state = redis.call('GET', user_prefix .. ':state')
+local dialog_id = redis.call('GET', user_prefix .. ':dialog_id')
+local partner = false
+local expires_at = false
+if dialog_id and dialog_id ~= ARGV[2] then
+  local fields = redis.call('HMGET', 'dialog:' .. dialog_id, 'user1', 'user2', 'expires_at')
+  if fields[1] then
+    if fields[1] == user_id then
+      partner = fields[2]
+    else
+      partner = fields[1]
+    end
+    expires_at = fields[3]
+  end
+end
+return {banned, state, dialog_id, partner, expires_at}
+"""
+
+# Shared by the dialog expiry scripts: ends one dialog, resetting each
+# participant still pointing at it to IDLE and appending {dialog_id, user_id...}
+# to ended. Participants come from the reverse index (KEYS[2]), which outlives
+# the hash; hashes of dialogs created before the index existed are read
+# directly. Dialogs ended by a user just lose their leftover keys.
+_END_DIALOG_LUA = """
+local function end_dialog(dialog_id, ended)
+  local dialog_key = 'dialog:' .. dialog_id
+  local users
+  local pair = redis.call('HGET', KEYS[2], dialog_id)
+  if pair then
+    local sep = string.find(pair, ',', 1, true)
+    users = {string.sub(pair, 1, sep - 1), string.sub(pair, sep + 1)}
+  else
+    users = redis.call('HMGET', dialog_key, 'user1', 'user2')
+  end
+  redis.call('HDEL', KEYS[2], dialog_id)
+  redis.call('DEL', dialog_key)
+  local entry = {dialog_id}
+  for i = 1, 2 do
+    local user_id = users[i]
+    if user_id and redis.call('GET', 'user:' .. user_id .. ':dialog_id') == dialog_id then
+      redis.call('DEL', 'user:' .. user_id .. ':dialog_id')
+      redis.call('SET', 'user:' .. user_id .. ':state', 'IDLE')
+      table.insert(entry, user_id)
+    end
+  end
+  if #entry > 1 then
+    table.insert(ended, entry)
+  end
+end
+"""
+
+# Claims dialogs whose expires_at has passed and ends them in one step.
+EXPIRE_DIALOGS_SCRIPT = _END_DIALOG_LUA + """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+local ended = {}
+for _, dialog_id in ipairs(due) do
+  redis.call('ZREM', KEYS[1], dialog_id)
+  end_dialog(dialog_id, ended)
+end
+return {#due, ended}
+"""
+
+# Ends the given dialogs (ARGV) whatever their schedule says: used for hashes
+# Redis reported as expired. Already-ended dialogs are no-ops.
+RECONCILE_DIALOGS_SCRIPT = _END_DIALOG_LUA + """
+local ended = {}
+for _, dialog_id in ipairs(ARGV) do
+  redis.call('ZREM', KEYS[1], dialog_id)
+  end_dialog(dialog_id, ended)
+end
+return ended
+"""
+
+# ARGV holds user_id, dialog_id pairs found by the sweeper. A pointer is only
+# dropped if it still names that dialog and the dialog hash is gone; users
+# still IN_DIALOG are reset to IDLE and returned.
+RESET_DANGLING_SCRIPT = """
+local reset = {}
+for i = 1, #ARGV, 2 do
+  local user_id = ARGV[i]
+  local dialog_id = ARGV[i + 1]
+  local pointer = 'user:' .. user_id .. ':dialog_id'
+  if redis.call('GET', pointer) == dialog_id and redis.call('EXISTS', 'dialog:' .. dialog_id) == 0 then
+    redis.call('DEL', pointer)
+    local state_key = 'user:' .. user_id .. ':state'
+    if redis.call('GET', state_key) == 'IN_DIALOG' then
+      redis.call('SET', state_key, 'IDLE')
+      table.insert(reset, {user_id, dialog_id})
+    end
+  end
+end
+return reset
+"""
+
+# Deletes topics whose expiry (their score in the index) has passed.
+EXPIRE_TOPICS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, topic_id in ipairs(due) do
+  redis.call('ZREM', KEYS[1], topic_id)
+  redis.call('DEL', 'topic:' .. topic_id)
+end
+return #due
+"""
+
+# Moves a pre-sorted-set search:queue list into the sorted set, oldest first.
+# Scores are spaced 1 microsecond apart ending just before ARGV[1] (now) or the
+# oldest sorted-set entry, so migrated searchers keep their order and stay
+# ahead of users who started searching after the deploy.
+MIGRATE_SEARCH_QUEUE_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'list' then
+  return 0
+end
+local waiting = redis.call('LRANGE', KEYS[1], 0, -1)
+local top = tonumber(ARGV[1])
+local oldest = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+if oldest[2] and tonumber(oldest[2]) < top then
+  top = tonumber(oldest[2])
+end
+local base = math.floor(top * 1000000) - #waiting - 1
+for idx, user_id in ipairs(waiting) do
+  redis.call('ZADD', KEYS[2], 'NX', string.format('%.6f', (base + idx) / 1000000), user_id)
+end
+redis.call('DEL', KEYS[1])
+return #waiting
+"""
+
+PARTNER_INVALIDATION_CHANNEL = "partner_cache:invalidate"
+TRACKING_CHANNEL = "__redis__:invalidate"
+# Key prefixes the key cache may hold; only ban:{id}, user:{id}:state and
+# user:{id}:dialog_id are actually cached.
+TRACKED_PREFIXES = ("ban:", "user:")
+SEARCH_QUEUE_KEY = "search:waiting"
+LEGACY_SEARCH_QUEUE_KEY = "search:queue"
+TOPIC_INDEX_KEY = "topics:index"
+# Dialog ids scored by expires_at; the dialog hash itself lives this much
+# longer so the expiry job can still read the participants.
+DIALOG_EXPIRY_KEY = "dialogs:expiring"
+DIALOG_EXPIRY_GRACE_SECONDS = 300
+# dialog_id -> "user1,user2" for every dialog not yet expired, so participants
+# are known even after the hash is gone.
+DIALOG_MEMBERS_KEY = "dialogs:members"
+DIALOG_POINTER_PATTERN = "user:*:dialog_id"
+EXPIRED_EVENTS_PATTERN = "__keyevent@*__:expired"
+
+
+@dataclass(slots=True)
+class UserContext:
+    user_id: int
+    banned: bool
+    state: UserState
+    dialog_id: str | None
+    partner: int | None
 
 
 @dataclass(slots=True)
 class RedisStorage:
     redis: Any
+    partner_cache: PartnerCache | None = None
+    key_cache: KeyCache | None = None
+    dialog_codec: PayloadCodec = DIALOG_CODEC
+    topic_codec: PayloadCodec = TOPIC_CODEC
+    _match_script: Any = field(init=False, repr=False)
+    _expire_searches_script: Any = field(init=False, repr=False)
+    _user_context_script: Any = field(init=False, repr=False)
+    _expire_dialogs_script: Any = field(init=False, repr=False)
+    _expire_topics_script: Any = field(init=False, repr=False)
+    _reconcile_dialogs_script: Any = field(init=False, repr=False)
+    _reset_dangling_script: Any = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # register_script() calls EVALSHA and reloads the source on NOSCRIPT.
+        self._match_script = self.redis.register_script(MATCH_SCRIPT)
+        self._expire_searches_script = self.redis.register_script(EXPIRE_SEARCHES_SCRIPT)
+        self._user_context_script = self.redis.register_script(USER_CONTEXT_SCRIPT)
+        self._expire_dialogs_script = self.redis.register_script(EXPIRE_DIALOGS_SCRIPT)
+        self._expire_topics_script = self.redis.register_script(EXPIRE_TOPICS_SCRIPT)
+        self._reconcile_dialogs_script = self.redis.register_script(RECONCILE_DIALOGS_SCRIPT)
+        self._reset_dangling_script = self.redis.register_script(RESET_DANGLING_SCRIPT)
 
     async def set_state(self, user_id: int, state: UserState) -> None:
         await self.redis.set(f"user:{user_id}:state", state.value)
+        self._forget(f"user:{user_id}:state")
 
     async def get_state(self, user_id: int) -> UserState:
-        raw = await self.redis.get(f"user:{user_id}:state")
+        raw = await self._cached_get(f"user:{user_id}:state")
         if raw is None:
             return UserState.IDLE
-        return UserState(raw.decode() if isinstance(raw, bytes) else raw)
+        return UserState(raw)
+
+    async def load_user_context(self, user_id: int) -> UserContext:
+        keys = (f"ban:{user_id}", f"user:{user_id}:state", f"user:{user_id}:dialog_id")
+        tokens: list = [None] * len(keys)
+        if self.key_cache is not None and self.key_cache.enabled:
+            ctx = self._cached_user_context(user_id, keys)
+            if ctx is not None:
+                return ctx
+            tokens = self.key_cache.reserve(*keys)
+        cached = self.partner_cache.get(user_id) if self.partner_cache is not None else None
+        banned, state, dialog_id, partner, expires_at = await self._user_context_script(
+            args=[user_id, cached.dialog_id if cached is not None else ""]
+        )
+        dialog_id = _text(dialog_id) if dialog_id is not None else None
+        state = _text(state) if state is not None else None
+        if self.key_cache is not None:
+            for key, value, token in zip(keys, (banned == 1, state, dialog_id), tokens):
+                self.key_cache.fill(key, value, token)
+        if cached is not None and dialog_id == cached.dialog_id:
+            partner_id: int | None = cached.partner
+        else:
+            partner_id = int(partner) if partner is not None else None
+            if self.partner_cache is not None:
+                if partner_id is None:
+                    self.partner_cache.invalidate(user_id)
+                else:
+                    expires = float(expires_at) if expires_at is not None else None
+                    self.partner_cache.put(user_id, dialog_id, partner_id, expires)
+        return UserContext(
+            user_id=user_id,
+            banned=banned == 1,
+            state=UserState(state) if state is not None else UserState.IDLE,
+            dialog_id=dialog_id,
+            partner=partner_id,
+        )
+
+    def _cached_user_context(self, user_id: int, keys: tuple[str, str, str]) -> UserContext | None:
+        # Served without a round trip only when every key is cached and the
+        # partner of the current dialog is known.
+        banned, state, dialog_id = (self.key_cache.get(key) for key in keys)
+        if banned is MISSING or state is MISSING or dialog_id is MISSING:
+            return None
+        partner = None
+        if dialog_id is not None:
+            entry = self.partner_cache.get(user_id) if self.partner_cache is not None else None
+            if entry is None or entry.dialog_id != dialog_id:
+                return None
+            partner = entry.partner
+        return UserContext(
+            user_id=user_id,
+            banned=banned,
+            state=UserState(state) if state is not None else UserState.IDLE,
+            dialog_id=dialog_id,
+            partner=partner,
+        )
+
+    async def _cached_get(self, key: str) -> str | None:
+        cache = self.key_cache
+        value = cache.get(key) if cache is not None else MISSING
+        if value is not MISSING:
+            return value
+        token = cache.reserve(key)[0] if cache is not None else None
+        raw = await self.redis.get(key)
+        value = _text(raw) if raw is not None else None
+        if cache is not None:
+            cache.fill(key, value, token)
+        return value
+
+    def _forget(self, *keys: str) -> None:
+        # Our own writes are evicted right away; the tracking message that
+        # follows covers the other replicas.
+        if self.key_cache is not None:
+            self.key_cache.invalidate(*keys)
+
+    async def listen_key_invalidations(self, retry_seconds: float = 1.0) -> None:
+        # Client-side tracking in broadcast mode: a dedicated connection
+        # subscribes to the invalidation channel and has tracking for the
+        # cached prefixes redirected to itself, so a write to one of those keys
+        # from any client evicts it here. The cache serves reads only while
+        # this connection is up; a drop clears it until the next reconnect.
+        cache = self.key_cache
+        if cache is None:
+            return
+        prefixes = [arg for prefix in TRACKED_PREFIXES for arg in ("PREFIX", prefix)]
+        while True:
+            connection = self.redis.connection_pool.make_connection()
+            try:
+                await connection.connect()
+                await connection.send_command("CLIENT", "ID")
+                client_id = await connection.read_response()
+                await connection.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST", *prefixes)
+                await connection.read_response()
+                await connection.send_command("SUBSCRIBE", TRACKING_CHANNEL)
+                await connection.read_response()
+                cache.enable()
+                logger.info("key cache enabled", extra={"prefixes": ",".join(TRACKED_PREFIXES)})
+                while True:
+                    self.apply_key_invalidation(await connection.read_response(timeout=None))
+            except Exception:
+                logger.warning("key cache invalidation stream lost, cache disabled", exc_info=True)
+            finally:
+                cache.disable()
+                await connection.disconnect()
+            await asyncio.sleep(retry_seconds)
+
+    def apply_key_invalidation(self, message: list[Any]) -> None:
+        # ["message", "__redis__:invalidate", [key, ...]]; a null key list
+        # means the whole keyspace was flushed.
+        if self.key_cache is None or message[0] not in (b"message", "message"):
+            return
+        keys = message[2]
+        if keys is None:
+            self.key_cache.clear()
+            return
+        self.key_cache.invalidate(*(_text(key) for key in keys))
+
+    async def invalidate_partners(self, *user_ids: int) -> None:
+        if self.partner_cache is not None:
+            for user_id in user_ids:
+                self.partner_cache.invalidate(user_id)
+        await self.redis.publish(PARTNER_INVALIDATION_CHANNEL, ",".join(str(u) for u in user_ids))
+
+    async def listen_partner_invalidations(self) -> None:
+        # Evicts entries dropped by other replicas. Reads stay correct without
+        # it (the cached dialog id is re-checked); this keeps memory in step.
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(PARTNER_INVALIDATION_CHANNEL)
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "message" or self.partner_cache is None:
+                    continue
+                for raw in _text(message["data"]).split(","):
+                    self.partner_cache.invalidate(int(raw))
+        finally:
+            await pubsub.aclose()
 
     async def set_dialog(self, user_id: int, dialog_id: str | None) -> None:
         key = f"user:{user_id}:dialog_id"
         if dialog_id is None:
             await self.redis.delete(key)
-            return
-        await self.redis.set(key, dialog_id)
+        else:
+            await self.redis.set(key, dialog_id)
+        self._forget(key)
 
     async def get_dialog(self, user_id: int) -> str | None:
-        raw = await self.redis.get(f"user:{user_id}:dialog_id")
-        if raw is None:
-            return None
-        return raw.decode() if isinstance(raw, bytes) else raw
+        return await self._cached_get(f"user:{user_id}:dialog_id")
 
-    async def enqueue_search(self, user_id: int) -> None:
-        await self.redis.rpush("search:queue", user_id)
+    async def enqueue_search(self, user_id: int, now: float | None = None) -> None:
+        # Re-enqueueing moves the user to the back, like remove + push did.
+        await self.redis.zadd(SEARCH_QUEUE_KEY, {user_id: time.time() if now is None else now})
 
     async def dequeue_search(self) -> int | None:
-        raw = await self.redis.lpop("search:queue")
-        if raw is None:
+        raw = await self.redis.zpopmin(SEARCH_QUEUE_KEY)
+        if not raw:
             return None
-        return int(raw)
+        return int(raw[0][0])
 
     async def remove_from_queue(self, user_id: int) -> None:
-        await self.redis.lrem("search:queue", 0, user_id)
+        await self.redis.zrem(SEARCH_QUEUE_KEY, user_id)
+
+    async def search_queue_size(self) -> int:
+        return await self.redis.zcard(SEARCH_QUEUE_KEY)
+
+    async def migrate_search_queue(self) -> int:
+        # One-off move of the pre-sorted-set list; a no-op once it is gone.
+        return await self.redis.eval(
+            MIGRATE_SEARCH_QUEUE_SCRIPT, 2, LEGACY_SEARCH_QUEUE_KEY, SEARCH_QUEUE_KEY, time.time()
+        )
+
+    async def announce_search(self, user_id: int, deadline: float) -> None:
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zadd("search:deadlines", {user_id: deadline})
+        pipe.rpush("search:arrivals", user_id)
+        await pipe.execute()
+
+    async def clear_search_deadline(self, user_id: int) -> None:
+        await self.redis.zrem("search:deadlines", user_id)
+
+    async def wait_search_arrival(self, timeout: float) -> int | None:
+        raw = await self.redis.blpop(["search:arrivals"], timeout=timeout)
+        if raw is None:
+            return None
+        return int(raw[1])
+
+    async def expire_searches(self, now: float, limit: int = 100) -> list[int]:
+        raw = await self._expire_searches_script(keys=[SEARCH_QUEUE_KEY, "search:deadlines"], args=[now, limit])
+        expired = [int(user_id) for user_id in raw]
+        self._forget(*(f"user:{user_id}:state" for user_id in expired))
+        return expired
+
+    async def match_partner(
+        self,
+        user_id: int,
+        dialog_id: str,
+        payload: dict[str, Any],
+        ttl_seconds: int,
+        require_searching: bool = False,
+    ) -> tuple[int, float] | None:
+        # Returns the partner and how long they had been waiting in the queue.
+        raw = await self._match_script(
+            keys=[SEARCH_QUEUE_KEY, "search:deadlines", DIALOG_EXPIRY_KEY, DIALOG_MEMBERS_KEY],
+            args=[
+                user_id,
+                dialog_id,
+                json.dumps(payload["started_at"]),
+                json.dumps(payload["expires_at"]),
+                ttl_seconds + DIALOG_EXPIRY_GRACE_SECONDS,
+                int(require_searching),
+            ],
+        )
+        if raw is None:
+            return None
+        partner, enqueued_at = raw
+        self._forget(*(f"user:{user}:{suffix}" for user in (user_id, _text(partner)) for suffix in ("state", "dialog_id")))
+        wait_seconds = max(0.0, time.time() - float(enqueued_at))
+        MATCH_WAIT_SECONDS.observe(wait_seconds)
+        return int(partner), wait_seconds
 
     async def create_topic(self, topic_id: str, payload: dict[str, Any], ttl_seconds: int) -> None:
-        await self.redis.hset(f"topic:{topic_id}", mapping={k: json.dumps(v) for k, v in payload.items()})
-        await self.redis.expire(f"topic:{topic_id}", ttl_seconds)
+        expires_at = payload.get("expires_at", time.time() + ttl_seconds)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(f"topic:{topic_id}", mapping=self.topic_codec.encode(payload))
+        pipe.expire(f"topic:{topic_id}", ttl_seconds)
+        pipe.zadd(TOPIC_INDEX_KEY, {topic_id: expires_at})
+        await pipe.execute()
 
     async def get_topic(self, topic_id: str) -> dict[str, Any] | None:
         raw = await self.redis.hgetall(f"topic:{topic_id}")
         if not raw:
             return None
-        decoded = {
-            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
-            for k, v in raw.items()
-        }
-        return {k: json.loads(v) for k, v in decoded.items()}
-
-
-    async def list_topic_ids(self) -> list[str]:
-        keys = await self.redis.keys("topic:*")
-        result: list[str] = []
-        for key in keys:
-            key_s = key.decode() if isinstance(key, bytes) else key
-            result.append(key_s.split(":", 1)[1])
-        result.sort()
-        return result
+        return self.topic_codec.decode(raw)
+
+
+    async def next_topic(self, after: tuple[str, float] | None = None, page: int = 20) -> tuple[str, float] | None:
+        # Topics are ordered by (expiry, id), the sorted set's own order, so
+        # topics created in the same second are all reachable. Browsing wraps
+        # around to the oldest live topic once the end of the index is reached.
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zremrangebyscore(TOPIC_INDEX_KEY, "-inf", now)
+        pipe.zrangebyscore(TOPIC_INDEX_KEY, now, "+inf", start=0, num=1, withscores=True)
+        _pruned, first = await pipe.execute()
+        if not first:
+            return None
+        if after is not None:
+            after_id, after_score = after
+            offset = 0
+            while True:
+                rows = await self.redis.zrangebyscore(
+                    TOPIC_INDEX_KEY, max(after_score, now), "+inf", start=offset, num=page, withscores=True
+                )
+                for topic_id, score in rows:
+                    if score > after_score or _text(topic_id) > after_id:
+                        return _text(topic_id), score
+                if len(rows) < page:
+                    break
+                offset += page
+        topic_id, score = first[0]
+        return _text(topic_id), score
+
+    async def expire_dialogs(self, now: float, limit: int = 500) -> tuple[int, list[tuple[str, list[int]]]]:
+        # Returns how many jobs were claimed and the dialogs that were still
+        # live, with the participants that were reset.
+        claimed, raw = await self._expire_dialogs_script(keys=[DIALOG_EXPIRY_KEY, DIALOG_MEMBERS_KEY], args=[now, limit])
+        return claimed, await self._ended_dialogs(raw)
+
+    async def reconcile_dialogs(self, dialog_ids: list[str]) -> list[tuple[str, list[int]]]:
+        raw = await self._reconcile_dialogs_script(keys=[DIALOG_EXPIRY_KEY, DIALOG_MEMBERS_KEY], args=dialog_ids)
+        return await self._ended_dialogs(raw)
+
+    async def reset_dangling_dialogs(self, pointers: list[tuple[int, str]]) -> list[tuple[str, list[int]]]:
+        raw = await self._reset_dangling_script(keys=[], args=[value for pair in pointers for value in pair])
+        by_dialog: dict[str, list[Any]] = {}
+        for user_id, dialog_id in raw:
+            by_dialog.setdefault(_text(dialog_id), [_text(dialog_id)]).append(user_id)
+        return await self._ended_dialogs(list(by_dialog.values()))
+
+    async def _ended_dialogs(self, raw: list[list[Any]]) -> list[tuple[str, list[int]]]:
+        ended = [(_text(entry[0]), [int(user_id) for user_id in entry[1:]]) for entry in raw]
+        users = [user_id for _dialog_id, participants in ended for user_id in participants]
+        if users:
+            self._forget(*(f"user:{user_id}:{suffix}" for user_id in users for suffix in ("state", "dialog_id")))
+            await self.invalidate_partners(*users)
+        return ended
+
+    async def find_dangling_dialogs(self, batch_size: int = 500) -> list[tuple[int, str]]:
+        # SCANs every dialog pointer and checks, a batch per round trip, that
+        # the dialog it names still exists. The result is only a candidate
+        # list; reset_dangling_dialogs re-checks each pair atomically.
+        dangling: list[tuple[int, str]] = []
+        keys: list[str] = []
+        async for key in self.redis.scan_iter(match=DIALOG_POINTER_PATTERN, count=batch_size):
+            keys.append(_text(key))
+            if len(keys) >= batch_size:
+                dangling.extend(await self._check_pointers(keys))
+                keys = []
+        if keys:
+            dangling.extend(await self._check_pointers(keys))
+        return dangling
+
+    async def _check_pointers(self, keys: list[str]) -> list[tuple[int, str]]:
+        dialog_ids = await self.redis.mget(keys)
+        live = [(key, _text(raw)) for key, raw in zip(keys, dialog_ids) if raw is not None]
+        pipe = self.redis.pipeline(transaction=False)
+        for _key, dialog_id in live:
+            pipe.exists(f"dialog:{dialog_id}")
+        exists = await pipe.execute()
+        return [(int(key.split(":")[1]), dialog_id) for (key, dialog_id), found in zip(live, exists) if not found]
+
+    async def drop_topics(self, topic_ids: list[str]) -> int:
+        return await self.redis.zrem(TOPIC_INDEX_KEY, *topic_ids)
+
+    async def enable_expired_events(self) -> bool:
+        # Expired keyevents are off by default. Adds "Ex" to whatever flags
+        # are set; managed Redis often disables CONFIG, in which case the
+        # caller has to rely on sweeping.
+        try:
+            current = (await self.redis.config_get("notify-keyspace-events")).get("notify-keyspace-events", "")
+            flags = _text(current)
+            if "E" not in flags or ("x" not in flags and "A" not in flags):
+                await self.redis.config_set("notify-keyspace-events", "".join(dict.fromkeys(flags + "Ex")))
+        except Exception:
+            logger.warning("cannot enable expired keyspace events", exc_info=True)
+            return False
+        return True
+
+    async def expire_topics(self, now: float, limit: int = 500) -> int:
+        return await self._expire_topics_script(keys=[TOPIC_INDEX_KEY], args=[now, limit])
+
+    async def backfill_dialog_expiry(self, batch_size: int = 500) -> int:
+        # One-off SCAN for dialogs created before expiry was scheduled.
+        scheduled = 0
+        async for key in self.redis.scan_iter(match="dialog:*", count=batch_size):
+            dialog_id = _text(key).split(":", 1)[1]
+            raw = await self.redis.hget(f"dialog:{dialog_id}", "expires_at")
+            if raw is None:
+                continue
+            scheduled += await self.redis.zadd(DIALOG_EXPIRY_KEY, {dialog_id: float(raw)}, nx=True)
+        return scheduled
+
+    async def backfill_topic_index(self, batch_size: int = 500) -> int:
+        # One-off SCAN for topics created before the index existed.
+        indexed = 0
+        async for key in self.redis.scan_iter(match="topic:*", count=batch_size):
+            topic_id = _text(key).split(":", 1)[1]
+            raw = await self.redis.hget(f"topic:{topic_id}", "expires_at")
+            if raw is None:
+                continue
+            indexed += await self.redis.zadd(TOPIC_INDEX_KEY, {topic_id: float(raw)}, nx=True)
+        return indexed
 
     async def set_topic_draft(self, user_id: int, text: str | None) -> None:
         key = f"user:{user_id}:topic_draft"
@@ -82,32 +657,44 @@ class RedisStorage:
             return None
         return raw.decode() if isinstance(raw, bytes) else raw
 
-    async def set_topic_cursor(self, user_id: int, topic_ids: list[str], idx: int = 0) -> None:
-        await self.redis.set(f"user:{user_id}:topic_cursor", json.dumps({"topic_ids": topic_ids, "idx": idx}), ex=900)
+    async def set_topic_cursor(self, user_id: int, topic_id: str, score: float) -> None:
+        await self.redis.set(f"user:{user_id}:topic_cursor", json.dumps({"topic_id": topic_id, "score": score}), ex=900)
 
-    async def get_topic_cursor(self, user_id: int) -> tuple[list[str], int]:
+    async def get_topic_cursor(self, user_id: int) -> tuple[str, float] | None:
         raw = await self.redis.get(f"user:{user_id}:topic_cursor")
         if raw is None:
-            return [], 0
+            return None
         blob = json.loads(raw.decode() if isinstance(raw, bytes) else raw)
-        return blob["topic_ids"], blob["idx"]
+        if "topic_id" not in blob:
+            return None
+        return blob["topic_id"], blob["score"]
 
     async def create_dialog(self, dialog_id: str, payload: dict[str, Any], ttl_seconds: int) -> None:
-        await self.redis.hset(f"dialog:{dialog_id}", mapping={k: json.dumps(v) for k, v in payload.items()})
+        await self.redis.hset(f"dialog:{dialog_id}", mapping=self.dialog_codec.encode(payload))
         await self.redis.expire(f"dialog:{dialog_id}", ttl_seconds)
 
     async def get_dialog_payload(self, dialog_id: str) -> dict[str, Any] | None:
         raw = await self.redis.hgetall(f"dialog:{dialog_id}")
         if not raw:
             return None
-        decoded = {
-            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
-            for k, v in raw.items()
-        }
-        return {k: json.loads(v) for k, v in decoded.items()}
+        return self.dialog_codec.decode(raw)
 
     async def set_ttl_flag(self, prefix: str, user_id: int, ttl_seconds: int) -> None:
         await self.redis.set(f"{prefix}:{user_id}", "1", ex=ttl_seconds)
+        self._forget(f"{prefix}:{user_id}")
 
     async def has_ttl_flag(self, prefix: str, user_id: int) -> bool:
-        return await self.redis.exists(f"{prefix}:{user_id}") == 1
\ No newline at end of file
+        key = f"{prefix}:{user_id}"
+        cache = self.key_cache if prefix == "ban" else None
+        value = cache.get(key) if cache is not None else MISSING
+        if value is not MISSING:
+            return value
+        token = cache.reserve(key)[0] if cache is not None else None
+        flagged = await self.redis.exists(key) == 1
+        if cache is not None:
+            cache.fill(key, flagged, token)
+        return flagged
+
+
+def _text(raw: bytes | str) -> str:
+    return raw.decode() if isinstance(raw, bytes) else raw
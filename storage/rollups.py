@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import json
+import logging
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from storage.sketch import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
+# Concurrent flushes would all lock the current hour's row; each connection
+# instead merges into one of ROLLUP_SHARDS rows per hour, and readers add the
+# shards of an hour up.
+ROLLUP_SHARDS = 8
+
+ROLLUPS_SQL = """
+create table if not exists dialog_rollups (
+  hour timestamptz not null,
+  shard smallint not null default 0,
+  started integer not null default 0,
+  ended integer not null default 0,
+  ended_by_reason jsonb not null default '{}',
+  duration_sketch bytea,
+  wait_sketch bytea,
+  updated_at timestamptz not null default now(),
+  primary key (hour, shard)
+);
+"""
+
+
+def hour_of(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+# One row per hour a dialog *started* in (a cohort): how many started, how
+# many of those have ended and why, how long they lasted and how long the
+# matched partner had waited. Keying ends by start hour means a backfilled
+# hour is fully determined by the dialogs started in it.
+@dataclass(slots=True)
+class HourRollup:
+    hour: datetime
+    started: int = 0
+    ended: int = 0
+    ended_by_reason: dict[str, int] = field(default_factory=dict)
+    duration: QuantileSketch = field(default_factory=QuantileSketch)
+    wait: QuantileSketch = field(default_factory=QuantileSketch)
+
+    def add_start(self, wait_seconds: float | None) -> None:
+        self.started += 1
+        if wait_seconds is not None:
+            self.wait.add(wait_seconds)
+
+    def add_end(self, started_at: datetime, ended_at: datetime, reason: str | None) -> None:
+        self.ended += 1
+        reason = reason or "unknown"
+        self.ended_by_reason[reason] = self.ended_by_reason.get(reason, 0) + 1
+        self.duration.add(max(0.0, (ended_at - started_at).total_seconds()))
+
+    def merge(self, other: HourRollup) -> None:
+        self.started += other.started
+        self.ended += other.ended
+        for reason, count in other.ended_by_reason.items():
+            self.ended_by_reason[reason] = self.ended_by_reason.get(reason, 0) + count
+        self.duration.merge(other.duration)
+        self.wait.merge(other.wait)
+
+    def row(self, shard: int = 0) -> tuple[Any, ...]:
+        return (
+            self.hour,
+            shard,
+            self.started,
+            self.ended,
+            json.dumps(self.ended_by_reason),
+            self.duration.to_bytes(),
+            self.wait.to_bytes(),
+        )
+
+    @classmethod
+    def from_row(cls, row: Any) -> HourRollup:
+        reasons = row["ended_by_reason"]
+        return cls(
+            hour=row["hour"],
+            started=row["started"],
+            ended=row["ended"],
+            ended_by_reason=json.loads(reasons) if isinstance(reasons, str) else dict(reasons),
+            duration=QuantileSketch.from_bytes(row["duration_sketch"]),
+            wait=QuantileSketch.from_bytes(row["wait_sketch"]),
+        )
+
+
+@dataclass(slots=True)
+class RollupBatch:
+    hours: dict[datetime, HourRollup] = field(default_factory=dict)
+
+    def _hour(self, started_at: datetime) -> HourRollup:
+        hour = hour_of(started_at)
+        rollup = self.hours.get(hour)
+        if rollup is None:
+            rollup = self.hours[hour] = HourRollup(hour)
+        return rollup
+
+    def add_start(self, started_at: datetime, wait_seconds: float | None = None) -> None:
+        self._hour(started_at).add_start(wait_seconds)
+
+    def add_end(self, started_at: datetime, ended_at: datetime, reason: str | None) -> None:
+        self._hour(started_at).add_end(started_at, ended_at, reason)
+
+
+_UPSERT_SQL = """
+insert into dialog_rollups(hour, shard, started, ended, ended_by_reason, duration_sketch, wait_sketch)
+values($1, $2, $3, $4, $5::jsonb, $6, $7)
+on conflict (hour, shard) do update set
+  started = excluded.started,
+  ended = excluded.ended,
+  ended_by_reason = excluded.ended_by_reason,
+  duration_sketch = excluded.duration_sketch,
+  wait_sketch = excluded.wait_sketch,
+  updated_at = now()
+"""
+
+
+async def apply_rollups(conn: Any, batch: RollupBatch) -> None:
+    # Runs inside the caller's transaction. Sketches cannot be merged in SQL,
+    # so the affected rows are created if missing, locked, merged here and
+    # written back. The shard follows the backend, so flushes on different
+    # pool connections take different row locks; two that share a shard
+    # serialise on it instead of overwriting each other.
+    if not batch.hours:
+        return
+    hours = sorted(batch.hours)
+    shard = conn.get_server_pid() % ROLLUP_SHARDS
+    await conn.execute(
+        "insert into dialog_rollups(hour, shard) select unnest($1::timestamptz[]), $2"
+        " on conflict (hour, shard) do nothing",
+        hours,
+        shard,
+    )
+    rows = await conn.fetch(
+        "select * from dialog_rollups where hour = any($1::timestamptz[]) and shard = $2 order by hour for update",
+        hours,
+        shard,
+    )
+    merged = []
+    for row in rows:
+        rollup = HourRollup.from_row(row)
+        rollup.merge(batch.hours[rollup.hour])
+        merged.append(rollup.row(shard))
+    await conn.executemany(_UPSERT_SQL, merged)
+
+
+async def load_rollups(conn: Any, since: datetime, until: datetime) -> list[HourRollup]:
+    rows = await conn.fetch(
+        "select * from dialog_rollups where hour >= $1 and hour < $2 order by hour", since, until
+    )
+    rollups: dict[datetime, HourRollup] = {}
+    for row in rows:
+        rollup = HourRollup.from_row(row)
+        if rollup.hour in rollups:
+            rollups[rollup.hour].merge(rollup)
+        else:
+            rollups[rollup.hour] = rollup
+    return list(rollups.values())
+
+
+async def backfill_rollups(
+    conn: Any, until: datetime, chunk: timedelta = timedelta(days=1), fetch_size: int = 10_000
+) -> int:
+    # Rebuilds the hours of dialogs started before `until` from the dialogs
+    # table, one chunk of start hours at a time: rows are streamed through a
+    # server-side cursor, only one chunk's sketches are held in memory, and
+    # each chunk replaces its hours (all shards, written back as shard 0), so
+    # re-running is safe. Match wait times
+    # are not stored on dialogs and stay empty.
+    first = await conn.fetchval("select min(started_at) from dialogs where started_at < $1", until)
+    if first is None:
+        return 0
+    written = 0
+    start = hour_of(first)
+    while start < until:
+        end = min(start + chunk, until)
+        batch = RollupBatch()
+        async with conn.transaction():
+            cursor = conn.cursor(
+                "select started_at, ended_at, reason from dialogs where started_at >= $1 and started_at < $2",
+                start,
+                end,
+                prefetch=fetch_size,
+            )
+            async for row in cursor:
+                batch.add_start(row["started_at"])
+                if row["ended_at"] is not None:
+                    batch.add_end(row["started_at"], row["ended_at"], row["reason"])
+            await conn.execute("delete from dialog_rollups where hour >= $1 and hour < $2", start, end)
+            await conn.executemany(_UPSERT_SQL, [rollup.row() for rollup in batch.hours.values()])
+        written += len(batch.hours)
+        logger.info("rollup chunk backfilled", extra={"from": start.isoformat(), "to": end.isoformat(), "hours": len(batch.hours)})
+        start = end
+    return written
+
+
+def summarize(rollups: Iterable[HourRollup]) -> dict[str, Any]:
+    # Combines hourly rows into the numbers dashboards ask for.
+    total = HourRollup(datetime.min.replace(tzinfo=timezone.utc))
+    for rollup in rollups:
+        total.merge(rollup)
+    return {
+        "started": total.started,
+        "ended": total.ended,
+        "ended_share": {reason: count / total.ended for reason, count in total.ended_by_reason.items()}
+        if total.ended
+        else {},
+        "duration_p50": total.duration.quantile(0.5),
+        "duration_p90": total.duration.quantile(0.9),
+        "wait_p50": total.wait.quantile(0.5),
+        "wait_p90": total.wait.quantile(0.9),
+    }
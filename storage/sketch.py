@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import math
+import struct
+from collections.abc import Iterable
+
+_HEADER = struct.Struct("<dQ")
+_BUCKET = struct.Struct("<iQ")
+
+
+# Mergeable quantile sketch with log-spaced buckets (the DDSketch layout, an
+# HDR-style histogram without a fixed range). Every quantile it returns is
+# within relative_accuracy of a real sample, counts only ever add up, and two
+# sketches with the same accuracy merge by adding bucket counts, so hourly
+# rows can be combined into daily or weekly answers. Serialized as a header
+# plus (bucket, count) pairs: an hour of dialog durations is a few hundred
+# buckets at most.
+class QuantileSketch:
+    __slots__ = ("relative_accuracy", "_gamma_log", "zero_count", "buckets")
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._gamma_log = math.log(gamma)
+        self.zero_count = 0
+        self.buckets: dict[int, int] = {}
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, value: float, count: int = 1) -> None:
+        # Values at or below 1ms are indistinguishable for durations and waits.
+        if value <= 1e-3:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._gamma_log)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def extend(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: QuantileSketch) -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("cannot merge sketches with different accuracy")
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q: float) -> float | None:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in the log sense.
+                return 2 * math.exp(index * self._gamma_log) / (1 + math.exp(self._gamma_log))
+        return 2 * math.exp(max(self.buckets) * self._gamma_log) / (1 + math.exp(self._gamma_log))
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(self.relative_accuracy, self.zero_count)]
+        parts.extend(_BUCKET.pack(index, count) for index, count in sorted(self.buckets.items()))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes | None, relative_accuracy: float = 0.01) -> QuantileSketch:
+        if not raw:
+            return cls(relative_accuracy)
+        accuracy, zero_count = _HEADER.unpack_from(raw)
+        sketch = cls(accuracy)
+        sketch.zero_count = zero_count
+        for index, count in _BUCKET.iter_unpack(raw[_HEADER.size :]):
+            sketch.buckets[index] = count
+        return sketch
@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fakeredis import aioredis as fake_aioredis
+
+from bot.storage.redis_client import redis_client as bot_redis
+from bot.storage.scripts import ScriptRegistry
+from bot.utils.antiflood import ThrottlingMiddleware
+
+
+@pytest.fixture
+def bot_redis_client(redis_server, monkeypatch):
+    client = fake_aioredis.FakeRedis(server=redis_server, decode_responses=True)
+    monkeypatch.setattr(bot_redis, "client", client)
+    monkeypatch.setattr(bot_redis, "scripts", ScriptRegistry())
+    return client
+
+
+def _message(user_id):
+    return SimpleNamespace(from_user=SimpleNamespace(id=user_id))
+
+
+async def _handled(middleware, user_id, count):
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.from_user.id)
+
+    for _ in range(count):
+        await middleware(handler, _message(user_id), {})
+    return len(handled)
+
+
+def test_burst_is_shared_between_replicas(bot_redis_client):
+    async def run():
+        replica_a = ThrottlingMiddleware(rate=1, burst=3)
+        replica_b = ThrottlingMiddleware(rate=1, burst=3)
+
+        assert await _handled(replica_a, 1, 2) == 2
+        assert await _handled(replica_b, 1, 5) == 1
+        assert await _handled(replica_a, 1, 1) == 0
+        assert await _handled(replica_a, 2, 3) == 3
+        assert 0 < await bot_redis_client.pttl("rl:1") <= 3000
+
+    asyncio.run(run())
+
+
+def test_throttled_user_is_dropped_locally_without_redis_call(bot_redis_client, monkeypatch):
+    async def run():
+        middleware = ThrottlingMiddleware(rate=1, burst=1)
+        calls = []
+        check = bot_redis.check_rate_limit
+
+        async def counting_check(*args):
+            calls.append(args)
+            return await check(*args)
+
+        monkeypatch.setattr(bot_redis, "check_rate_limit", counting_check)
+        await bot_redis_client.set("ban:7", "1", ex=60)
+
+        assert await _handled(middleware, 7, 3) == 0
+        assert await _handled(middleware, 8, 3) == 1
+        assert len(calls) == 3
+        assert set(middleware.blocked_until) == {7, 8}
+
+    asyncio.run(run())
+
+
+def test_local_cache_is_bounded(bot_redis_client):
+    async def run():
+        middleware = ThrottlingMiddleware(rate=1, burst=1, local_cache_size=10)
+        for user_id in range(50):
+            await _handled(middleware, user_id, 2)
+
+        assert list(middleware.blocked_until) == list(range(40, 50))
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+import pytest
+from fakeredis import aioredis as fake_aioredis
+
+from bot.storage.counters import ACTIVE_DIALOGS_KEY, read_stats
+from bot.storage.redis_client import RedisClient
+
+
+@pytest.fixture
+def bot_redis(redis_server):
+    client = RedisClient()
+    client.client = fake_aioredis.FakeRedis(server=redis_server, decode_responses=True)
+    return client
+
+
+async def searching_pair(redis, user1, user2):
+    for user_id in (user1, user2):
+        await redis.set_user_state(user_id, "SEARCHING")
+    return await redis.create_dialog(user1, user2)
+
+
+def test_counters_follow_dialog_lifecycle_and_bans(bot_redis):
+    async def run():
+        reported = await searching_pair(bot_redis, 1, 2)
+        expired = await searching_pair(bot_redis, 3, 4)
+        await searching_pair(bot_redis, 5, 6)
+        await bot_redis.client.zadd("search:waiting", {"7": time.time()})
+
+        await bot_redis.end_dialog(reported, "report")
+        # The cleanup task still fires for the reported dialog later on.
+        await bot_redis.run_script("cleanup_dialog", [f"dialog:{reported}"], [reported])
+        await bot_redis.run_script("cleanup_dialog", [f"dialog:{expired}"], [expired])
+        await bot_redis.ban_user(2, 60)
+        await bot_redis.ban_user(2, 60)
+
+        stats = await bot_redis.stats()
+
+        assert (stats.searching, stats.dialogs, stats.in_dialog, stats.bans) == (1, 1, 2, 1)
+        assert stats.matches == 3
+        assert stats.ended == {"report": 1, "expired": 1}
+
+    asyncio.run(run())
+
+
+def test_expired_bans_and_dialogs_without_cleanup_drop_out(bot_redis):
+    async def run():
+        await searching_pair(bot_redis, 1, 2)
+        await bot_redis.ban_user(9, 60)
+        later = time.time() + 7200
+
+        stats = await read_stats(bot_redis.client, window_minutes=1, now=later)
+
+        assert (stats.dialogs, stats.bans, stats.matches) == (0, 0, 0)
+
+    asyncio.run(run())
+
+
+def test_backfill_counts_live_dialogs_created_before_counters(bot_redis):
+    async def run():
+        client = bot_redis.client
+        await client.hset("dialog:old", mapping={"user1_id": "1", "user2_id": "2"})
+        await client.expire("dialog:old", 600)
+        await client.hset("dialog:done", mapping={"user1_id": "3", "user2_id": "4", "ended_reason": "report"})
+        await client.expire("dialog:done", 60)
+
+        assert await bot_redis.backfill_active_dialogs() == 1
+        assert await client.zrange(ACTIVE_DIALOGS_KEY, 0, -1) == ["old"]
+
+    asyncio.run(run())
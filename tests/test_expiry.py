@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from services.dialogs import DialogService
+from services.expiry import ExpiryReconciler, ExpiryScheduler
+from services.matchmaking import MatchmakingService
+from states import UserState
+from storage.redis_store import DIALOG_EXPIRY_KEY, DIALOG_MEMBERS_KEY
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+class EndingPG:
+    def __init__(self):
+        self.ended = []
+
+    async def create_dialog(self, dialog_id, user1, user2, wait_seconds=None):
+        return None
+
+    async def end_dialog(self, dialog_id, reason):
+        self.ended.append((dialog_id, reason))
+
+
+async def matched_pair(redis_store, pg, ttl):
+    matchmaking = MatchmakingService(redis_store, pg, ttl)
+    await matchmaking.begin_search(1)
+    await matchmaking.begin_search(2)
+    _matched, dialog_id, _partner = await matchmaking.try_match(2)
+    return dialog_id
+
+
+def test_expired_dialog_resets_both_users_and_notifies_them(redis_store, redis_client):
+    async def run():
+        pg, bot = EndingPG(), RecordingBot()
+        dialog_id = await matched_pair(redis_store, pg, ttl=0)
+        scheduler = ExpiryScheduler(redis_store, pg, bot)
+
+        assert await scheduler.run_once() == 1
+        await asyncio.gather(*scheduler._notifications)
+
+        for user_id in (1, 2):
+            ctx = await redis_store.load_user_context(user_id)
+            assert (ctx.state, ctx.dialog_id, ctx.partner) == (UserState.IDLE, None, None)
+        assert not await redis_client.exists(f"dialog:{dialog_id}")
+        assert pg.ended == [(dialog_id, "expired")]
+        assert sorted(chat_id for chat_id, _text in bot.sent) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_dialog_ended_by_user_only_loses_its_hash(redis_store, redis_client):
+    async def run():
+        pg, bot = EndingPG(), RecordingBot()
+        dialog_id = await matched_pair(redis_store, pg, ttl=60)
+        await DialogService(redis_store, pg, 3600).finish_dialog(1, "user_end")
+
+        claimed, ended = await redis_store.expire_dialogs(time.time() + 61)
+
+        assert (claimed, ended) == (1, [])
+        assert not await redis_client.exists(f"dialog:{dialog_id}")
+
+    asyncio.run(run())
+
+
+def test_due_jobs_are_claimed_in_batches(redis_store, redis_client):
+    async def run():
+        now = time.time()
+        await redis_client.zadd(DIALOG_EXPIRY_KEY, {f"d-{i}": now - 1 for i in range(1200)})
+        await redis_client.zadd(DIALOG_EXPIRY_KEY, {"later": now + 60})
+        scheduler = ExpiryScheduler(redis_store, EndingPG(), RecordingBot(), batch_size=500)
+
+        assert [await scheduler.run_once() for _ in range(4)] == [500, 500, 200, 0]
+        assert await redis_client.zrange(DIALOG_EXPIRY_KEY, 0, -1) == [b"later"]
+
+    asyncio.run(run())
+
+
+def test_expired_keyevent_resets_users_from_reverse_index_once(redis_store, redis_client):
+    async def run():
+        pg, bot = EndingPG(), RecordingBot()
+        dialog_id = await matched_pair(redis_store, pg, ttl=60)
+        # The hash expired while no scheduler was running.
+        await redis_client.delete(f"dialog:{dialog_id}")
+        scheduler = ExpiryScheduler(redis_store, pg, bot)
+        reconciler = ExpiryReconciler(redis_store, scheduler)
+
+        for key in (f"dialog:{dialog_id}".encode(), f"dialog:{dialog_id}", b"user:1:cooldown", b"topic:t-1"):
+            reconciler.collect(key)
+        assert await reconciler.flush() == 1
+        assert await reconciler.flush() == 0
+        await asyncio.gather(*scheduler._notifications)
+
+        for user_id in (1, 2):
+            assert await redis_store.get_state(user_id) == UserState.IDLE
+            assert await redis_store.get_dialog(user_id) is None
+        assert not await redis_client.hexists(DIALOG_MEMBERS_KEY, dialog_id)
+        assert not await redis_client.zscore(DIALOG_EXPIRY_KEY, dialog_id)
+        assert pg.ended == [(dialog_id, "expired")]
+        assert sorted(chat_id for chat_id, _text in bot.sent) == [1, 2]
+        # The scheduler finds nothing left to announce.
+        assert await scheduler.run_once() == 0
+
+    asyncio.run(run())
+
+
+def test_sweep_resets_pointers_to_missing_dialogs(redis_store, redis_client):
+    async def run():
+        pg, bot = EndingPG(), RecordingBot()
+        live = await matched_pair(redis_store, pg, ttl=60)
+        await redis_client.set("user:7:dialog_id", "gone")
+        await redis_client.set("user:7:state", "IN_DIALOG")
+        # Ended by a user earlier; only the stale pointer is left.
+        await redis_client.set("user:8:dialog_id", "gone")
+        await redis_client.set("user:8:state", "SEARCHING")
+        scheduler = ExpiryScheduler(redis_store, pg, bot)
+
+        assert await ExpiryReconciler(redis_store, scheduler, batch_size=2).sweep() == 1
+        await asyncio.gather(*scheduler._notifications)
+
+        assert await redis_store.get_state(7) == UserState.IDLE
+        assert await redis_store.get_state(8) == UserState.SEARCHING
+        assert not await redis_client.exists("user:7:dialog_id", "user:8:dialog_id")
+        assert await redis_store.get_dialog(1) == live
+        assert pg.ended == [("gone", "expired")]
+        assert bot.sent == [(7, "Время диалога истекло")]
+
+    asyncio.run(run())
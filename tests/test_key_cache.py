@@ -0,0 +1,152 @@
+import asyncio
+
+from fakeredis import aioredis as fake_aioredis
+
+from services.matchmaking import MatchmakingService
+from states import UserState
+from storage.key_cache import MISSING, KeyCache
+from storage.partner_cache import PartnerCache
+from storage.redis_store import RedisStorage
+
+
+def tracking_message(*keys):
+    # What Redis pushes on __redis__:invalidate for a write to these keys.
+    return [b"message", b"__redis__:invalidate", [key.encode() for key in keys]]
+
+
+def cached_store(client):
+    cache = KeyCache()
+    cache.enable()
+    return RedisStorage(client, PartnerCache(), cache), cache
+
+
+def test_reads_are_cached_until_tracking_invalidates(redis_server, redis_client):
+    async def run():
+        replica_a, cache = cached_store(redis_client)
+        replica_b = RedisStorage(fake_aioredis.FakeRedis(server=redis_server))
+        await replica_a.set_state(1, UserState.SEARCHING)
+
+        assert await replica_a.get_state(1) == UserState.SEARCHING
+        assert await replica_a.get_state(1) == UserState.SEARCHING
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        await replica_b.set_state(1, UserState.IDLE)
+        replica_a.apply_key_invalidation(tracking_message("user:1:state"))
+        assert await replica_a.get_state(1) == UserState.IDLE
+
+        assert not (await replica_a.load_user_context(1)).banned
+        await replica_b.set_ttl_flag("ban", 1, 60)
+        assert not (await replica_a.load_user_context(1)).banned
+        replica_a.apply_key_invalidation(tracking_message("ban:1"))
+        assert (await replica_a.load_user_context(1)).banned
+
+    asyncio.run(run())
+
+
+def test_reply_that_raced_with_a_write_is_not_cached(redis_server, redis_client):
+    async def run():
+        replica_a, cache = cached_store(redis_client)
+        replica_b = RedisStorage(fake_aioredis.FakeRedis(server=redis_server))
+        await replica_a.set_state(1, UserState.SEARCHING)
+        get = redis_client.get
+
+        async def get_then_concurrent_write(key):
+            # The GET is answered with the old value, then another replica
+            # writes and its invalidation lands before the reply is handled.
+            value = await get(key)
+            await replica_b.set_state(1, UserState.IN_DIALOG)
+            replica_a.apply_key_invalidation(tracking_message("user:1:state"))
+            return value
+
+        redis_client.get = get_then_concurrent_write
+        assert await replica_a.get_state(1) == UserState.SEARCHING
+        redis_client.get = get
+
+        assert cache.get("user:1:state") is MISSING
+        assert await replica_a.get_state(1) == UserState.IN_DIALOG
+
+    asyncio.run(run())
+
+
+def test_stale_reply_landing_after_a_newer_read_started_is_not_cached(redis_server, redis_client):
+    async def run():
+        replica_a, cache = cached_store(redis_client)
+        replica_b = RedisStorage(fake_aioredis.FakeRedis(server=redis_server))
+        await replica_b.set_ttl_flag("ban", 1, 60)
+        exists = redis_client.exists
+        arrived = [asyncio.Event(), asyncio.Event()]
+        release = [asyncio.Event(), asyncio.Event()]
+        calls = []
+
+        async def held_exists(key):
+            # Each reply is answered by Redis right away but handed back only
+            # when the test releases it.
+            reader = len(calls)
+            calls.append(key)
+            value = await exists(key)
+            arrived[reader].set()
+            await release[reader].wait()
+            return value
+
+        redis_client.exists = held_exists
+        first = asyncio.create_task(replica_a.has_ttl_flag("ban", 1))
+        await arrived[0].wait()
+        await replica_b.redis.delete("ban:1")
+        replica_a.apply_key_invalidation(tracking_message("ban:1"))
+        second = asyncio.create_task(replica_a.has_ttl_flag("ban", 1))
+        await arrived[1].wait()
+
+        # The reply from before the unban lands first.
+        release[0].set()
+        assert await first is True
+        release[1].set()
+        assert await second is False
+        redis_client.exists = exists
+
+        assert cache.get("ban:1") is False
+        assert await replica_a.has_ttl_flag("ban", 1) is False
+
+    asyncio.run(run())
+
+
+def test_match_on_this_replica_evicts_partner_state(redis_client, fake_pg):
+    async def run():
+        store, cache = cached_store(redis_client)
+        matchmaking = MatchmakingService(store, fake_pg, 3600)
+        await matchmaking.begin_search(1)
+        await matchmaking.begin_search(2)
+        assert (await store.load_user_context(1)).state == UserState.SEARCHING
+
+        matched, dialog_id, partner = await matchmaking.try_match(2)
+        assert (matched, partner) == (True, 1)
+
+        ctx = await store.load_user_context(1)
+        assert (ctx.state, ctx.dialog_id, ctx.partner) == (UserState.IN_DIALOG, dialog_id, 2)
+        # Fully cached now, partner included.
+        hits = cache.hits
+        assert (await store.load_user_context(1)).partner == 2
+        assert cache.hits == hits + 3
+
+    asyncio.run(run())
+
+
+def test_disabled_cache_reads_through_and_stays_bounded(redis_client):
+    async def run():
+        cache = KeyCache(max_size=2)
+        store = RedisStorage(redis_client, key_cache=cache)
+        await store.set_state(1, UserState.SEARCHING)
+        assert await store.get_state(1) == UserState.SEARCHING
+        assert len(cache) == 0
+
+        cache.enable()
+        for user_id in (1, 2, 3):
+            await store.get_state(user_id)
+        assert len(cache) == 2
+        assert cache.get("user:1:state") is MISSING
+
+        store.apply_key_invalidation([b"message", b"__redis__:invalidate", None])
+        assert len(cache) == 0
+        cache.disable()
+        assert not cache.enabled
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+
+from storage.last_seen import PENDING_KEY, LastSeenTracker
+
+
+class TouchPG:
+    def __init__(self):
+        self.flushes = []
+
+    async def touch_users(self, seen):
+        self.flushes.append(sorted((user_id, ts.timestamp()) for user_id, ts in seen))
+
+
+def test_flush_writes_latest_timestamp_once_per_user(redis_client):
+    async def run():
+        pg = TouchPG()
+        tracker = LastSeenTracker(redis_client, pg, "c1")
+        await tracker.touch(1, now=100.0)
+        await tracker.touch(2, now=101.0)
+        await tracker.touch(1, now=105.0)
+
+        assert await tracker.flush() == 2
+        assert pg.flushes == [[(1, 105.0), (2, 101.0)]]
+        assert await tracker.active_users("19700101") == 2
+        assert await tracker.flush() == 0
+        assert not await redis_client.exists(PENDING_KEY)
+
+    asyncio.run(run())
+
+
+def test_unfinished_flush_is_retried_before_new_activity(redis_client):
+    async def run():
+        pg = TouchPG()
+        tracker = LastSeenTracker(redis_client, pg, "c1")
+        await tracker.touch(1, now=100.0)
+        await redis_client.rename(PENDING_KEY, tracker.flushing_key)
+        await tracker.touch(2, now=200.0)
+
+        await tracker.flush()
+        await tracker.flush()
+
+        assert pg.flushes == [[(1, 100.0)], [(2, 200.0)]]
+
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import io
+import logging
+import threading
+
+from logging_setup import KeyValueFormatter, SamplingFilter, setup_logging
+
+
+def _record(lineno=10, level=logging.INFO, **extra):
+    record = logging.LogRecord("svc", level, "svc.py", lineno, "dialog %s", ("d-1",), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_is_per_call_site_and_reports_dropped():
+    now = [0.0]
+    sampler = SamplingFilter(rate=2, clock=lambda: now[0])
+
+    assert [sampler.filter(_record()) for _ in range(4)] == [True, True, False, False]
+    assert sampler.filter(_record(lineno=11)) is True
+    assert sampler.filter(_record(level=logging.WARNING)) is True
+
+    now[0] = 0.5
+    passed = _record()
+    assert sampler.filter(passed) is True
+    assert passed.sampled_out == 2
+
+
+def test_key_value_output_includes_extra_fields():
+    line = KeyValueFormatter().format(_record(user=7, state="IN DIALOG"))
+
+    assert " level=info logger=svc msg=\"dialog d-1\" user=7 state=\"IN DIALOG\"" in line
+
+
+def _captured(log):
+    root = logging.getLogger()
+    saved_handlers, saved_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    listener = setup_logging("INFO", "kv", stream=stream)
+    try:
+        log()
+    finally:
+        listener.stop()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in saved_handlers:
+            root.addHandler(handler)
+        root.setLevel(saved_level)
+    return stream
+
+
+def test_records_are_written_by_the_listener_thread():
+    def log():
+        logging.getLogger("services.matchmaking").info("search started", extra={"user": 5})
+        logging.getLogger("services.matchmaking").debug("hidden")
+
+    stream = _captured(log)
+
+    assert stream.getvalue().count("\n") == 1
+    assert 'logger=services.matchmaking msg="search started" user=5' in stream.getvalue()
+
+
+def test_records_reach_the_listener_unformatted():
+    threads = []
+
+    class Args:
+        def __str__(self):
+            threads.append(threading.current_thread())
+            return "d-1"
+
+    def log():
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logging.getLogger("svc").exception("dialog %s failed", Args())
+
+    line = _captured(log).getvalue()
+
+    assert 'msg="dialog d-1 failed"' in line
+    assert " exc=\"Traceback" in line and "ValueError: boom" in line
+    assert threads and threading.main_thread() not in threads
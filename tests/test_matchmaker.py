@@ -0,0 +1,51 @@
+import asyncio
+
+from services.matchmaker import Matchmaker
+from services.matchmaking import MatchmakingService
+from states import UserState
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_arrival_matches_and_notifies_both_users(redis_store, fake_pg):
+    async def run():
+        bot = FakeBot()
+        service = MatchmakingService(redis_store, fake_pg, 3600, 20)
+        matchmaker = Matchmaker(service, redis_store, bot, tick_seconds=0.01)
+        await service.begin_search(1)
+        await matchmaker.run_once()
+        assert bot.sent == []
+
+        await service.begin_search(2)
+        await matchmaker.run_once()
+
+        assert sorted(bot.sent) == [(1, "Собеседник найден!"), (2, "Собеседник найден!")]
+        assert await redis_store.get_state(1) == UserState.IN_DIALOG
+        assert await redis_store.redis.zcard("search:deadlines") == 0
+
+    asyncio.run(run())
+
+
+def test_expired_search_resets_state_once(redis_store, fake_pg):
+    async def run():
+        bot = FakeBot()
+        service = MatchmakingService(redis_store, fake_pg, 3600, 0)
+        matchmaker = Matchmaker(service, redis_store, bot, tick_seconds=0.01)
+        await service.begin_search(1)
+        await service.begin_search(2)
+        await service.cancel_search(2)
+
+        await matchmaker.expire_searches()
+        await matchmaker.expire_searches()
+
+        assert bot.sent == [(1, "Поиск завершен по таймауту")]
+        assert await redis_store.get_state(1) == UserState.IDLE
+        assert await redis_store.dequeue_search() is None
+
+    asyncio.run(run())
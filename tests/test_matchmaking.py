@@ -17,4 +17,36 @@ def test_matchmaking_pairs_two_users(redis_store, fake_pg):
         assert await redis_store.get_state(1) == UserState.IN_DIALOG
         assert await redis_store.get_state(2) == UserState.IN_DIALOG
 
-    asyncio.run(run())
\ No newline at end of file
+    asyncio.run(run())
+
+def test_match_skips_stale_entries_and_keeps_queue_order(redis_store, fake_pg):
+    async def run():
+        service = MatchmakingService(redis_store, fake_pg, 3600)
+        for user_id in (1, 2, 3, 4):
+            await service.begin_search(user_id)
+        await redis_store.set_state(1, UserState.IDLE)
+
+        matched, dialog_id, partner = await service.try_match(4)
+
+        assert matched is True
+        assert partner == 2
+        assert await redis_store.get_dialog(2) == dialog_id
+        assert fake_pg.dialogs == [(dialog_id, 4, 2)]
+        assert await redis_store.dequeue_search() == 3
+        assert await redis_store.dequeue_search() is None
+
+    asyncio.run(run())
+
+
+def test_match_without_partner_keeps_searcher_queued(redis_store, fake_pg):
+    async def run():
+        service = MatchmakingService(redis_store, fake_pg, 3600)
+        await service.begin_search(1)
+
+        matched, dialog_id, partner = await service.try_match(1)
+
+        assert (matched, dialog_id, partner) == (False, None, None)
+        assert await redis_store.get_state(1) == UserState.SEARCHING
+        assert await redis_store.dequeue_search() == 1
+
+    asyncio.run(run())
@@ -0,0 +1,54 @@
+import asyncio
+
+from shared.metrics import MATCH_WAIT_SECONDS, REDIS_SECONDS, Registry, instrument_redis
+from services.matchmaking import MatchmakingService
+
+
+def test_registry_renders_prometheus_text():
+    async def run():
+        registry = Registry()
+        hits = registry.counter("hits_total", "Hits", ("outcome",))
+        latency = registry.histogram("op_seconds", "Op time", buckets=(0.1, 1.0))
+        registry.gauge("depth", "Depth", lambda: 3)
+
+        async def async_depth():
+            return 7
+
+        registry.gauge("async_depth", "Async depth", async_depth)
+        hits.labels("ok").inc()
+        hits.labels("ok").inc()
+        latency.observe(0.05)
+        latency.observe(0.1)
+        latency.observe(5)
+
+        text = await registry.render()
+
+        assert 'hits_total{outcome="ok"} 2' in text
+        assert 'op_seconds_bucket{le="0.1"} 2' in text
+        assert 'op_seconds_bucket{le="1"} 2' in text
+        assert 'op_seconds_bucket{le="+Inf"} 3' in text
+        assert "op_seconds_count 3" in text
+        assert "depth 3" in text
+        assert "async_depth 7" in text
+
+    asyncio.run(run())
+
+
+def test_redis_commands_and_match_wait_are_observed(redis_client, redis_store, fake_pg):
+    async def run():
+        instrument_redis(redis_client)
+        zadd_before = REDIS_SECONDS.labels("ZADD").count
+        pipeline_before = REDIS_SECONDS.labels("PIPELINE").count
+        waits_before = MATCH_WAIT_SECONDS.count
+
+        service = MatchmakingService(redis_store, fake_pg, 3600)
+        await service.begin_search(1)
+        await service.begin_search(2)
+        matched, _dialog_id, partner = await service.try_match(2)
+
+        assert (matched, partner) == (True, 1)
+        assert REDIS_SECONDS.labels("ZADD").count == zadd_before + 2
+        assert REDIS_SECONDS.labels("PIPELINE").count == pipeline_before + 2
+        assert MATCH_WAIT_SECONDS.count == waits_before + 1
+
+    asyncio.run(run())
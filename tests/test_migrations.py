@@ -0,0 +1,137 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from storage.migrations import MIGRATION_LOCK_ID, Migration, create_index_concurrently, migrate, sql
+
+
+class MigrationConn:
+    # Just enough of asyncpg.Connection: a schema_migrations table, the
+    # partition catalog query and a log of statements with the transaction
+    # they ran in.
+    def __init__(self, versions=None, partitions=(), locks=None):
+        self.versions = versions
+        self.partitions = partitions
+        # Advisory locks by id -> holding connection; share to model replicas.
+        self.locks = {} if locks is None else locks
+        self.in_transaction = False
+        self.log = []
+
+    async def fetchval(self, query, *args):
+        self.log.append(("fetchval", " ".join(query.split())))
+        if "pg_try_advisory_lock" in query:
+            return self.locks.setdefault(args[0], self) is self
+        if "schema_migrations" in query:
+            if self.versions is None:
+                raise asyncpg.UndefinedTableError("relation does not exist")
+            return max(self.versions, default=0)
+        return None
+
+    async def fetch(self, query, *args):
+        return [
+            {"relname": name, "bound": f"FOR VALUES FROM (MINVALUE) TO ('2026-1{i}-01 00:00:00+00')"}
+            for i, name in enumerate(self.partitions)
+        ]
+
+    async def execute(self, query, *args):
+        query = " ".join(query.split())
+        if query.startswith("create table if not exists schema_migrations"):
+            if self.versions is None:
+                self.versions = set()
+        elif query.startswith("insert into schema_migrations"):
+            self.versions.add(args[0])
+        elif query.startswith("select pg_advisory_unlock"):
+            del self.locks[args[0]]
+        self.log.append(("tx" if self.in_transaction else "auto", query, *args))
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+
+MIGRATIONS = [
+    Migration(1, "tables", sql("create table a (id int)")),
+    Migration(2, "index", sql("create index concurrently a_id on a (id)"), transactional=False),
+]
+
+
+def test_up_to_date_schema_is_a_single_query():
+    async def run():
+        conn = MigrationConn(versions={1, 2})
+        assert await migrate(conn, MIGRATIONS) == []
+        assert conn.log == [("fetchval", "select coalesce(max(version), 0) from schema_migrations")]
+
+    asyncio.run(run())
+
+
+def test_pending_migrations_apply_in_order_under_the_advisory_lock():
+    async def run():
+        conn = MigrationConn()
+
+        assert await migrate(conn, MIGRATIONS) == [1, 2]
+
+        assert ("fetchval", "select pg_try_advisory_lock($1)") in conn.log
+        statements = [entry for entry in conn.log if entry[0] != "fetchval"]
+        assert statements[-1] == ("auto", "select pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+        assert ("tx", "create table a (id int)") in statements
+        assert ("tx", "insert into schema_migrations(version, name) values($1, $2)", 1, "tables") in statements
+        assert ("auto", "create index concurrently a_id on a (id)") in statements
+        assert conn.versions == {1, 2}
+        # A replica that waited on the lock finds nothing left.
+        assert await migrate(conn, MIGRATIONS) == []
+
+    asyncio.run(run())
+
+
+def test_partitioned_index_is_built_per_partition_and_attached():
+    async def run():
+        conn = MigrationConn(partitions=("dialogs_legacy", "dialogs_p202611"))
+
+        await create_index_concurrently(conn, "dialogs", "dialogs_user1_idx", "user1")
+
+        assert [entry[1] for entry in conn.log if entry[0] == "auto"] == [
+            "create index if not exists dialogs_user1_idx on only dialogs (user1)",
+            "create index concurrently if not exists dialogs_legacy_user1_idx on dialogs_legacy (user1)",
+            "alter index dialogs_user1_idx attach partition dialogs_legacy_user1_idx",
+            "create index concurrently if not exists dialogs_p202611_user1_idx on dialogs_p202611 (user1)",
+            "alter index dialogs_user1_idx attach partition dialogs_p202611_user1_idx",
+        ]
+
+    asyncio.run(run())
+
+
+def test_second_replica_polls_for_the_lock_during_a_concurrent_index_build():
+    async def run():
+        versions, locks = set(), {}
+        first = MigrationConn(versions=versions, locks=locks)
+        second = MigrationConn(versions=versions, locks=locks)
+        building = asyncio.Event()
+        release = asyncio.Event()
+
+        async def build_index(conn):
+            building.set()
+            await release.wait()
+
+        migrations = [*MIGRATIONS, Migration(3, "slow index", build_index, transactional=False)]
+        first_run = asyncio.create_task(migrate(first, migrations, lock_poll=0.01))
+        await building.wait()
+        second_run = asyncio.create_task(migrate(second, migrations, lock_poll=0.01))
+        await asyncio.sleep(0.05)
+
+        # Only short try-lock statements while the other replica builds.
+        assert not second_run.done()
+        polls = [entry for entry in second.log if entry[1] == "select pg_try_advisory_lock($1)"]
+        assert len(polls) > 1
+        assert not [entry for entry in second.log if entry[0] != "fetchval"]
+
+        release.set()
+        assert await first_run == [1, 2, 3]
+        assert await second_run == []
+        assert locks == {}
+
+    asyncio.run(run())
@@ -0,0 +1,145 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+
+import asyncpg
+import pytest
+
+from storage.migrations import DIALOGS_SQL
+from storage.partitions import (
+    add_months,
+    convert_to_partitioned,
+    drop_partitions_before,
+    ensure_partitions,
+    month_start,
+)
+
+# A disposable database for the tests that need a real Postgres; they are
+# skipped without it.
+POSTGRES_DSN = os.getenv("TEST_POSTGRES_DSN")
+
+
+class CatalogConn:
+    # Answers the pg_inherits query from a list of (partition, bound) rows and
+    # records every other statement.
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.executed = []
+
+    async def fetch(self, sql, table):
+        return [{"relname": name, "bound": bound} for name, bound in self.partitions]
+
+    async def execute(self, sql):
+        self.executed.append(" ".join(sql.split()))
+
+
+class PlainTableConn(CatalogConn):
+    async def fetchval(self, sql, table):
+        return "r"
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.executed.append("begin")
+        yield
+        self.executed.append("commit")
+
+
+def bound(lower, upper):
+    return f"FOR VALUES FROM ({lower}) TO ('{upper} 00:00:00+00')"
+
+
+def test_month_arithmetic_wraps_years():
+    start = month_start(datetime(2026, 12, 31, 23, 59, tzinfo=timezone.utc))
+    assert start == datetime(2026, 12, 1, tzinfo=timezone.utc)
+    assert add_months(start, 1) == datetime(2027, 1, 1, tzinfo=timezone.utc)
+    assert add_months(start, -12) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+
+
+def test_partitions_are_created_after_the_legacy_range():
+    async def run():
+        conn = CatalogConn([("dialogs_legacy", bound("MINVALUE", "2026-11-01"))])
+        now = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+        created = await ensure_partitions(conn, "dialogs", now, months_ahead=2)
+
+        assert created == ["dialogs_p202611", "dialogs_p202612"]
+        assert conn.executed[0] == (
+            "create table if not exists dialogs_p202611 partition of dialogs"
+            " for values from ('2026-11-01T00:00:00+00:00') to ('2026-12-01T00:00:00+00:00')"
+        )
+
+    asyncio.run(run())
+
+
+def test_retention_detaches_only_partitions_that_ended_before_cutoff():
+    async def run():
+        conn = CatalogConn(
+            [
+                ("reports_p202609", bound("'2026-09-01 00:00:00+00'", "2026-10-01")),
+                ("reports_legacy", bound("MINVALUE", "2026-09-01")),
+                ("reports_p202610", bound("'2026-10-01 00:00:00+00'", "2026-11-01")),
+            ]
+        )
+
+        dropped = await drop_partitions_before(conn, "reports", datetime(2026, 10, 1, tzinfo=timezone.utc))
+
+        assert dropped == ["reports_legacy", "reports_p202609"]
+        assert conn.executed == [
+            "alter table reports detach partition reports_legacy concurrently",
+            "drop table reports_legacy",
+            "alter table reports detach partition reports_p202609 concurrently",
+            "drop table reports_p202609",
+        ]
+
+    asyncio.run(run())
+
+
+def test_conversion_turns_the_unique_index_into_a_constraint_before_the_swap():
+    async def run():
+        conn = PlainTableConn([])
+
+        assert await convert_to_partitioned(conn, "dialogs", DIALOGS_SQL, datetime(2026, 10, 18, tzinfo=timezone.utc))
+
+        index = conn.executed.index(
+            "create unique index concurrently if not exists dialogs_legacy_key on dialogs (id, started_at)"
+        )
+        assert "add constraint dialogs_legacy_key unique using index dialogs_legacy_key" in conn.executed[index + 1]
+        assert conn.executed.index("begin") > index + 1
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not POSTGRES_DSN, reason="TEST_POSTGRES_DSN is not set")
+def test_conversion_attaches_the_legacy_table_with_its_prebuilt_index():
+    async def run():
+        conn = await asyncpg.connect(POSTGRES_DSN)
+        try:
+            await conn.execute("drop schema if exists test_partitions cascade; create schema test_partitions")
+            await conn.execute("set search_path = test_partitions")
+            await conn.execute(
+                "create table dialogs (id text primary key, user1 bigint not null, user2 bigint not null,"
+                " started_at timestamptz not null default now(), ended_at timestamptz, reason text)"
+            )
+            await conn.execute(
+                "insert into dialogs (id, user1, user2, started_at)"
+                " select 'd-' || n, n, n + 1, '2026-09-01'::timestamptz + n * interval '1 minute'"
+                " from generate_series(1, 1000) n"
+            )
+
+            now = datetime(2026, 10, 18, tzinfo=timezone.utc)
+            assert await convert_to_partitioned(conn, "dialogs", DIALOGS_SQL, now)
+
+            assert await conn.fetchval("select relkind from pg_class where oid = 'dialogs'::regclass") == "p"
+            # The index built concurrently is the one attached to the new
+            # primary key, not a copy rebuilt during the swap.
+            parent = await conn.fetchval(
+                "select inhparent::regclass::text from pg_inherits where inhrelid = 'dialogs_legacy_key'::regclass"
+            )
+            assert parent == "dialogs_pkey"
+            assert await conn.fetchval("select count(*) from dialogs") == 1000
+        finally:
+            await conn.execute("drop schema if exists test_partitions cascade")
+            await conn.close()
+
+    asyncio.run(run())
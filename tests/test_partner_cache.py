@@ -0,0 +1,78 @@
+import asyncio
+
+from fakeredis import aioredis as fake_aioredis
+
+from services.dialogs import DialogService
+from states import UserState
+from storage.partner_cache import PartnerCache
+from storage.redis_store import RedisStorage
+
+
+async def start_dialog(store, dialog_id, user1, user2, expires_at=4102444800):
+    await store.create_dialog(dialog_id, {"user1": user1, "user2": user2, "expires_at": expires_at}, 3600)
+    for user_id in (user1, user2):
+        await store.set_dialog(user_id, dialog_id)
+        await store.set_state(user_id, UserState.IN_DIALOG)
+
+
+def test_cache_hits_after_first_lookup(redis_client):
+    async def run():
+        cache = PartnerCache()
+        store = RedisStorage(redis_client, cache)
+        await start_dialog(store, "d-1", 1, 2)
+
+        for _ in range(3):
+            assert (await store.load_user_context(1)).partner == 2
+
+        assert (cache.hits, cache.misses) == (2, 1)
+        assert cache.hit_rate == 2 / 3
+
+    asyncio.run(run())
+
+
+def test_no_stale_partner_after_dialog_ends_on_another_replica(redis_server, redis_client, fake_pg):
+    async def run():
+        replica_a = RedisStorage(redis_client, PartnerCache())
+        replica_b = RedisStorage(fake_aioredis.FakeRedis(server=redis_server), PartnerCache())
+        await start_dialog(replica_a, "d-1", 1, 2)
+        assert (await replica_a.load_user_context(1)).partner == 2
+
+        await DialogService(replica_b, fake_pg, 3600).finish_dialog(2, "user_end")
+        assert (await replica_a.load_user_context(1)).partner is None
+
+        await start_dialog(replica_b, "d-2", 1, 3)
+        ctx = await replica_a.load_user_context(1)
+        assert (ctx.dialog_id, ctx.partner) == ("d-2", 3)
+
+    asyncio.run(run())
+
+
+def test_entry_expires_with_dialog():
+    now = [1000.0]
+    cache = PartnerCache(clock=lambda: now[0])
+    cache.put(1, "d-1", 2, dialog_expires_at=1010.0)
+    assert cache.get(1).partner == 2
+    now[0] = 1010.0
+    assert cache.get(1) is None
+
+
+def test_invalidation_channel_evicts_on_other_replicas(redis_server, redis_client):
+    async def run():
+        cache = PartnerCache()
+        replica_a = RedisStorage(redis_client, cache)
+        replica_b = RedisStorage(fake_aioredis.FakeRedis(server=redis_server), PartnerCache())
+        cache.put(1, "d-1", 2)
+        listener = asyncio.create_task(replica_a.listen_partner_invalidations())
+        await asyncio.sleep(0.05)
+
+        await replica_b.invalidate_partners(1, 2)
+        for _ in range(50):
+            if len(cache) == 0:
+                break
+            await asyncio.sleep(0.01)
+
+        listener.cancel()
+        assert len(cache) == 0
+        assert cache.invalidations == 1
+
+    asyncio.run(run())
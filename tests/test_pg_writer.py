@@ -0,0 +1,140 @@
+import asyncio
+from datetime import datetime, timezone
+
+import asyncpg
+
+from storage.pg_writer import DEAD_LETTER_KEY, GROUP_NAME, STREAM_KEY, PostgresWriteBehind
+
+
+class BatchPG:
+    def __init__(self, fail=False, reject=()):
+        self.fail = fail
+        self.reject = set(reject)
+        self.batches = []
+        self.dialog_ids = set()
+        self.attempts = 0
+
+    async def write_batch(self, users, dialogs, topics, reports, dialog_ends):
+        self.attempts += 1
+        if self.fail:
+            raise ConnectionError("postgres down")
+        if self.reject & {dialog[0] for dialog in dialogs}:
+            raise asyncpg.CheckViolationError('no partition of relation "dialogs" found for row')
+        self.batches.append((users, dialogs, topics, reports, dialog_ends))
+        self.dialog_ids.update(dialog[0] for dialog in dialogs)
+        return [end[0] for end in dialog_ends if end[0] not in self.dialog_ids]
+
+
+def test_enqueued_writes_flush_as_one_batch(redis_client):
+    async def run():
+        pg = BatchPG()
+        writer = PostgresWriteBehind(redis_client, pg, "c1", flush_interval=0.05)
+        expires_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        await writer.upsert_user(1)
+        await writer.upsert_user(1)
+        await writer.create_dialog("d-1", 1, 2, wait_seconds=1.5)
+        await writer.create_topic("t-1", 1, "hi", expires_at)
+        await writer.create_report(1, 2, "spam")
+        await writer.end_dialog("d-1", "report")
+
+        assert await writer.process_batch() == 6
+
+        [(users, dialogs, topics, reports, dialog_ends)] = pg.batches
+        assert (users, topics, reports) == ([1], [("t-1", 1, "hi", expires_at)], [(1, 2, "spam")])
+        [(ended_id, reason, ended_at)] = dialog_ends
+        assert (ended_id, reason) == ("d-1", "report")
+        assert ended_at.tzinfo is not None
+        [(dialog_id, user1, user2, started_at, wait_seconds)] = dialogs
+        assert (dialog_id, user1, user2, wait_seconds) == ("d-1", 1, 2, 1.5)
+        assert started_at.tzinfo is not None
+        assert await redis_client.xlen(STREAM_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_failed_flush_is_replayed_after_restart(redis_client):
+    async def run():
+        crashed = PostgresWriteBehind(redis_client, BatchPG(fail=True), "c1", flush_interval=0.05)
+        await crashed.create_dialog("d-1", 1, 2)
+        try:
+            await crashed.process_batch()
+        except ConnectionError:
+            pass
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 1
+
+        pg = BatchPG()
+        restarted = PostgresWriteBehind(redis_client, pg, "c1", flush_interval=0.05)
+        task = asyncio.create_task(restarted.run())
+        for _ in range(50):
+            if pg.batches:
+                break
+            await asyncio.sleep(0.01)
+        restarted.close()
+        await task
+
+        assert [dialog[:3] for dialog in pg.batches[0][1]] == [("d-1", 1, 2)]
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_end_flushed_before_its_dialog_is_retried_not_lost(redis_client):
+    async def run():
+        pg = BatchPG()
+        other_replica = PostgresWriteBehind(redis_client, pg, "c2", flush_interval=0.05)
+        writer = PostgresWriteBehind(redis_client, pg, "c1", flush_interval=0.05, retry_idle_ms=50)
+        await other_replica.create_dialog("d-1", 1, 2)
+        await other_replica._ensure_group()
+        create_entries = await other_replica._read_batch()
+        await writer.end_dialog("d-1", "user_end")
+
+        await writer.process_batch()
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 2
+
+        await other_replica._flush(create_entries)
+        await asyncio.sleep(0.06)
+        await writer._retry_pending(writer.retry_idle_ms)
+
+        assert [batch[4][0][:2] for batch in pg.batches if batch[4]] == [("d-1", "user_end")] * 2
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+        assert await redis_client.xlen(STREAM_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_entry_rejected_for_good_is_isolated_and_dead_lettered(redis_client):
+    async def run():
+        pg = BatchPG(reject={"d-bad"})
+        writer = PostgresWriteBehind(redis_client, pg, "c1", flush_interval=0.001, max_flush_attempts=2)
+        for dialog_id in ("d-1", "d-2", "d-bad", "d-3"):
+            await writer.create_dialog(dialog_id, 1, 2)
+        await writer._ensure_group()
+
+        assert await writer._flush_retrying(await writer._read_batch())
+
+        written = sorted(dialog[0] for batch in pg.batches for dialog in batch[1])
+        assert written == ["d-1", "d-2", "d-3"]
+        [(_id, fields)] = await redis_client.xrange(DEAD_LETTER_KEY)
+        assert b"d-bad" in fields[b"args"] and b"CheckViolationError" in fields[b"error"]
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 0
+        assert await redis_client.xlen(STREAM_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_outage_is_retried_not_dead_lettered(redis_client):
+    async def run():
+        pg = BatchPG(fail=True)
+        writer = PostgresWriteBehind(redis_client, pg, "c1", flush_interval=0.001, max_flush_attempts=2)
+        await writer.create_dialog("d-1", 1, 2)
+        await writer._ensure_group()
+        flushing = asyncio.create_task(writer._flush_retrying(await writer._read_batch()))
+        while pg.attempts < 5:
+            await asyncio.sleep(0.01)
+        writer.close()
+
+        assert await flushing is False
+        assert await redis_client.xlen(DEAD_LETTER_KEY) == 0
+        assert (await redis_client.xpending(STREAM_KEY, GROUP_NAME))["pending"] == 1
+
+    asyncio.run(run())
@@ -1,4 +1,5 @@
 import asyncio
+import json
 
 from states import UserState
 
@@ -20,4 +21,59 @@ def test_queue_fifo(redis_store):
         assert await redis_store.dequeue_search() == 1
         assert await redis_store.dequeue_search() == 2
 
-    asyncio.run(run())
\ No newline at end of file
+    asyncio.run(run())
+
+
+def test_queue_requeue_moves_to_back_and_remove_is_by_member(redis_store):
+    async def run():
+        for user_id in (1, 2, 3):
+            await redis_store.enqueue_search(user_id, now=100.0 + user_id)
+        await redis_store.enqueue_search(1, now=110.0)
+        await redis_store.remove_from_queue(3)
+
+        assert await redis_store.search_queue_size() == 2
+        assert await redis_store.dequeue_search() == 2
+        assert await redis_store.dequeue_search() == 1
+
+    asyncio.run(run())
+
+
+def test_legacy_list_queue_is_migrated_in_order(redis_store, redis_client):
+    async def run():
+        await redis_client.rpush("search:queue", 5, 3, 9)
+        await redis_store.enqueue_search(7)
+
+        assert await redis_store.migrate_search_queue() == 3
+        assert await redis_store.migrate_search_queue() == 0
+        assert not await redis_client.exists("search:queue")
+        assert [await redis_store.dequeue_search() for _ in range(4)] == [5, 3, 9, 7]
+
+    asyncio.run(run())
+
+def test_user_context_resolves_partner_in_one_call(redis_store):
+    async def run():
+        await redis_store.create_dialog("d-1", {"user1": 1, "user2": 2}, 3600)
+        await redis_store.set_dialog(2, "d-1")
+        await redis_store.set_state(2, UserState.IN_DIALOG)
+        await redis_store.set_ttl_flag("ban", 3, 60)
+
+        ctx = await redis_store.load_user_context(2)
+        assert (ctx.banned, ctx.state, ctx.dialog_id, ctx.partner) == (False, UserState.IN_DIALOG, "d-1", 1)
+
+        banned = await redis_store.load_user_context(3)
+        assert (banned.banned, banned.state, banned.dialog_id, banned.partner) == (True, UserState.IDLE, None, None)
+
+    asyncio.run(run())
+
+
+def test_dialog_payload_round_trips_and_reads_legacy_json(redis_store, redis_client):
+    async def run():
+        payload = {"user1": 1, "user2": 2, "started_at": "2025-01-01T00:00:00+00:00", "expires_at": 3700.25}
+        await redis_store.create_dialog("d-1", payload, 3600)
+        assert await redis_client.hget("dialog:d-1", "user1") == b"1"
+        assert await redis_store.get_dialog_payload("d-1") == payload
+
+        await redis_client.hset("dialog:d-2", mapping={k: json.dumps(v) for k, v in payload.items()})
+        assert await redis_store.get_dialog_payload("d-2") == payload
+
+    asyncio.run(run())
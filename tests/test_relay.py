@@ -0,0 +1,92 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import CopyMessages
+
+from services.relay import MediaRelay
+
+
+class RelayBot:
+    def __init__(self, reject=None):
+        self.reject = reject
+        self.calls = []
+
+    async def copy_messages(self, chat_id, from_chat_id, message_ids):
+        if self.reject is not None:
+            method = CopyMessages(chat_id=chat_id, from_chat_id=from_chat_id, message_ids=message_ids)
+            raise self.reject(method, "rejected")
+        self.calls.append(("copy_messages", chat_id, list(message_ids)))
+
+
+class RelayMessage:
+    def __init__(self, bot, message_id, media_group_id=None, chat_id=1):
+        self.bot = bot
+        self.message_id = message_id
+        self.media_group_id = media_group_id
+        self.chat = SimpleNamespace(id=chat_id)
+
+    async def send_copy(self, chat_id):
+        self.bot.calls.append(("copy_message", chat_id, [self.message_id]))
+
+
+def test_album_items_go_out_as_one_sorted_call():
+    async def run():
+        bot = RelayBot()
+        relay = MediaRelay(linger=0.01, album_linger=0.05, max_delay=1.0)
+        for message_id in (11, 10, 12):
+            relay.relay(RelayMessage(bot, message_id, media_group_id="g"), 2)
+            await asyncio.sleep(0.02)
+        relay.relay(RelayMessage(bot, 13), 2)
+        await asyncio.sleep(0.1)
+
+        assert bot.calls == [("copy_messages", 2, [10, 11, 12, 13])]
+
+        relay.relay(RelayMessage(bot, 14), 2)
+        await relay.close()
+        assert bot.calls[1:] == [("copy_message", 2, [14])]
+
+    asyncio.run(run())
+
+
+def test_max_delay_bounds_a_steady_stream_and_keeps_order():
+    async def run():
+        bot = RelayBot()
+        relay = MediaRelay(linger=0.05, max_delay=0.05)
+        for message_id in range(1, 11):
+            relay.relay(RelayMessage(bot, message_id), 2)
+            await asyncio.sleep(0.01)
+        await relay.close()
+
+        assert len(bot.calls) > 1
+        assert [message_id for _op, _chat, ids in bot.calls for message_id in ids] == list(range(1, 11))
+        assert relay.pending == 0
+
+    asyncio.run(run())
+
+
+def test_rejected_batch_falls_back_to_single_copies():
+    async def run():
+        bot = RelayBot(reject=TelegramBadRequest)
+        relay = MediaRelay(linger=0.01)
+        relay.relay(RelayMessage(bot, 5), 2)
+        relay.relay(RelayMessage(bot, 6), 2)
+        await relay.close()
+
+        assert bot.calls == [("copy_message", 2, [5]), ("copy_message", 2, [6])]
+
+    asyncio.run(run())
+
+
+def test_other_api_errors_do_not_fall_back(caplog):
+    async def run():
+        bot = RelayBot(reject=TelegramForbiddenError)
+        relay = MediaRelay(linger=0.01)
+        relay.relay(RelayMessage(bot, 5), 2)
+        relay.relay(RelayMessage(bot, 6), 2)
+        await relay.close()
+
+        assert bot.calls == []
+        assert [record.message for record in caplog.records] == ["relay failed"]
+
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from storage.rollups import ROLLUP_SHARDS, HourRollup, RollupBatch, apply_rollups, load_rollups, summarize
+from storage.sketch import QuantileSketch
+
+
+class RollupConn:
+    # Keeps dialog_rollups rows in a dict keyed by (hour, shard) and answers
+    # the statements apply_rollups and load_rollups issue. Connections made
+    # with the same rows dict but another pid model the pool.
+    def __init__(self, rows=None, pid=1):
+        self.rows = {} if rows is None else rows
+        self.pid = pid
+
+    def get_server_pid(self):
+        return self.pid
+
+    async def execute(self, sql, hours, shard):
+        for hour in hours:
+            self.rows.setdefault((hour, shard), {"hour": hour, "shard": shard, "started": 0, "ended": 0,
+                                                 "ended_by_reason": "{}", "duration_sketch": None,
+                                                 "wait_sketch": None})
+
+    async def fetch(self, sql, *args):
+        if "for update" in sql:
+            hours, shard = args
+            return [self.rows[(hour, shard)] for hour in sorted(hours)]
+        since, until = args
+        return [self.rows[key] for key in sorted(self.rows) if since <= key[0] < until]
+
+    async def executemany(self, sql, rows):
+        for hour, shard, started, ended, reasons, duration, wait in rows:
+            self.rows[(hour, shard)] = {"hour": hour, "shard": shard, "started": started, "ended": ended,
+                                        "ended_by_reason": reasons, "duration_sketch": duration,
+                                        "wait_sketch": wait}
+
+
+def test_sketch_quantiles_stay_within_relative_accuracy():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(4, 1.5) for _ in range(20_000)]
+    sketch = QuantileSketch(0.01)
+    sketch.extend(values)
+    ordered = sorted(values)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.011 * exact
+
+
+def test_sketches_merge_and_round_trip_through_bytes():
+    left, right, whole = QuantileSketch(), QuantileSketch(), QuantileSketch()
+    left.extend([0, 1, 2, 3])
+    right.extend([10, 20, 30])
+    whole.extend([0, 1, 2, 3, 10, 20, 30])
+
+    left.merge(right)
+    restored = QuantileSketch.from_bytes(left.to_bytes())
+
+    assert restored.count == 7
+    assert restored.zero_count == 1
+    assert restored.buckets == whole.buckets
+    assert QuantileSketch.from_bytes(None).quantile(0.5) is None
+
+
+def test_ends_are_counted_in_the_hour_the_dialog_started():
+    started = datetime(2026, 10, 18, 9, 59, tzinfo=timezone.utc)
+    batch = RollupBatch()
+    batch.add_start(started, wait_seconds=4.0)
+    batch.add_end(started, started + timedelta(minutes=5), "expired")
+
+    [rollup] = batch.hours.values()
+    assert rollup.hour == datetime(2026, 10, 18, 9, tzinfo=timezone.utc)
+    assert (rollup.started, rollup.ended, rollup.ended_by_reason) == (1, 1, {"expired": 1})
+    assert abs(rollup.duration.quantile(0.5) - 300) <= 3
+    assert abs(rollup.wait.quantile(0.5) - 4) <= 0.04
+
+
+def test_apply_rollups_merges_into_existing_rows():
+    async def run():
+        conn = RollupConn()
+        hour = datetime(2026, 10, 18, 9, tzinfo=timezone.utc)
+        for reason in ("ended_by_user", "expired", "ended_by_user"):
+            batch = RollupBatch()
+            batch.add_start(hour, wait_seconds=2.0)
+            batch.add_end(hour, hour + timedelta(seconds=60), reason)
+            await apply_rollups(conn, batch)
+        await apply_rollups(conn, RollupBatch())
+
+        rollup = HourRollup.from_row(conn.rows[(hour, conn.pid % ROLLUP_SHARDS)])
+        assert (rollup.started, rollup.ended) == (3, 3)
+        assert rollup.ended_by_reason == {"ended_by_user": 2, "expired": 1}
+        assert rollup.duration.count == rollup.wait.count == 3
+
+        summary = summarize([rollup])
+        assert summary["ended_share"] == {"ended_by_user": 2 / 3, "expired": 1 / 3}
+        assert abs(summary["duration_p90"] - 60) <= 0.6
+
+    asyncio.run(run())
+
+
+def test_connections_write_their_own_shard_and_reads_add_shards_up():
+    async def run():
+        rows = {}
+        hour = datetime(2026, 10, 18, 9, tzinfo=timezone.utc)
+        for pid in (1, 2, 1 + ROLLUP_SHARDS):
+            batch = RollupBatch()
+            batch.add_start(hour)
+            batch.add_end(hour, hour + timedelta(seconds=pid), "expired")
+            await apply_rollups(RollupConn(rows, pid), batch)
+
+        assert sorted(rows) == [(hour, 1), (hour, 2)]
+        [rollup] = await load_rollups(RollupConn(rows), hour, hour + timedelta(hours=1))
+        assert (rollup.hour, rollup.started, rollup.ended) == (hour, 3, 3)
+        assert rollup.duration.count == 3
+
+    asyncio.run(run())
@@ -0,0 +1,93 @@
+import asyncio
+
+from fakeredis import aioredis as fake_aioredis
+from redis.exceptions import ResponseError
+
+from bot.storage.redis_client import SEARCH_QUEUE_KEY
+from bot.storage.scripts import ScriptRegistry, build_library, library_version
+
+
+def test_evalsha_fallback_reloads_after_script_flush(redis_server):
+    async def run():
+        client = fake_aioredis.FakeRedis(server=redis_server, decode_responses=True)
+        registry = ScriptRegistry()
+        await registry.load(client)
+        assert registry.use_functions is False
+
+        await client.zadd(SEARCH_QUEUE_KEY, {"1": 1.0, "2": 2.0, "3": 3.0})
+        assert await registry.call(client, "find_match", [SEARCH_QUEUE_KEY]) == ["1", "2"]
+
+        await client.script_flush()
+        assert await registry.call(client, "find_match", [SEARCH_QUEUE_KEY]) is None
+        assert await client.zcard(SEARCH_QUEUE_KEY) == 1
+
+    asyncio.run(run())
+
+
+class FunctionsClient:
+    def __init__(self):
+        self.libraries = []
+        self.calls = []
+
+    async def function_load(self, code, replace=False):
+        self.libraries.append(code)
+
+    async def fcall(self, function, numkeys, *keys_and_args):
+        if len(self.calls) == 0 and len(self.libraries) == 1:
+            self.calls.append(None)
+            raise ResponseError("Function not found")
+        self.calls.append((function, numkeys, keys_and_args))
+        return 1
+
+
+def test_functions_library_is_reloaded_when_missing():
+    async def run():
+        client = FunctionsClient()
+        registry = ScriptRegistry({"cleanup_topic": "return 1"})
+
+        assert await registry.call(client, "cleanup_topic", ["topic:t", "topics:active"], ["t"]) == 1
+        assert registry.use_functions is True
+        assert len(client.libraries) == 2
+        assert client.calls[-1] == (f"{registry.library}_cleanup_topic", 2, ("topic:t", "topics:active", "t"))
+
+    asyncio.run(run())
+
+
+def test_library_registers_every_script():
+    code = build_library({"a": "return 1", "b": "return 2"})
+
+    assert code.startswith("#!lua name=anon\n")
+    assert "redis.register_function('anon_a', function(KEYS, ARGV)\nreturn 1\nend)" in code
+    assert "redis.register_function('anon_b', function(KEYS, ARGV)\nreturn 2\nend)" in code
+
+
+class SharedFunctionsServer:
+    # FUNCTION LOAD without REPLACE, as Redis does it: a library name loads once.
+    def __init__(self):
+        self.libraries = {}
+
+    async def function_load(self, code, replace=False):
+        name = code.split("\n", 1)[0].removeprefix("#!lua name=")
+        if name in self.libraries and not replace:
+            raise ResponseError(f"Library '{name}' already exists")
+        self.libraries[name] = code
+
+
+def test_script_versions_load_side_by_side_during_a_rolling_deploy():
+    async def run():
+        server = SharedFunctionsServer()
+        old = ScriptRegistry({"cleanup_topic": "return 1"})
+        new = ScriptRegistry({"cleanup_topic": "return 2"})
+        same_as_new = ScriptRegistry({"cleanup_topic": "return 2"})
+
+        for registry in (old, new, same_as_new):
+            await registry.load(server)
+            assert registry.use_functions is True
+
+        assert old.library != new.library == same_as_new.library
+        assert old.library == library_version({"cleanup_topic": "return 1"})
+        assert old.library.startswith("anon_") and len(old.library) == len("anon_") + 8
+        assert "return 1" in server.libraries[old.library]
+        assert "return 2" in server.libraries[new.library]
+
+    asyncio.run(run())
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from services.send_scheduler import PRIORITY_MENU, PRIORITY_RELAY, SendScheduler
+
+
+def test_relay_lane_goes_before_menu_replies():
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, per_chat_rate=1000)
+        order = []
+
+        async def send(label):
+            order.append(label)
+
+        runner = scheduler.start()
+        await asyncio.sleep(0)
+        # Both are queued before the idle runner gets to pick one.
+        menu = asyncio.create_task(scheduler.submit(1, lambda: send("menu"), PRIORITY_MENU))
+        relay = asyncio.create_task(scheduler.submit(2, lambda: send("relay"), PRIORITY_RELAY))
+        await asyncio.gather(menu, relay)
+        runner.cancel()
+
+        assert order == ["relay", "menu"]
+
+    asyncio.run(run())
+
+
+def test_per_chat_budget_does_not_hold_back_other_chats():
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, per_chat_rate=10)
+        loop = asyncio.get_running_loop()
+        done = {}
+
+        async def send(label):
+            done[label] = loop.time()
+
+        runner = scheduler.start()
+        started = loop.time()
+        await asyncio.gather(
+            scheduler.submit(1, lambda: send("a1")),
+            scheduler.submit(1, lambda: send("a2")),
+            scheduler.submit(2, lambda: send("b1")),
+        )
+        runner.cancel()
+
+        assert done["a2"] - started >= 0.09
+        assert done["b1"] - started < 0.05
+
+    asyncio.run(run())
+
+
+def test_retry_after_pauses_and_retries():
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, per_chat_rate=1000)
+        calls = []
+
+        async def send():
+            calls.append(1)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Too Many Requests", 0)
+            return "ok"
+
+        runner = scheduler.start()
+        result = await scheduler.submit(1, send)
+        runner.cancel()
+
+        assert result == "ok"
+        assert len(calls) == 2
+        assert scheduler.throttled == 1
+
+    asyncio.run(run())
+
+
+def test_chats_take_turns_and_each_chat_stays_in_order():
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10)
+        order = []
+
+        async def send(label):
+            order.append(label)
+
+        runner = scheduler.start()
+        await asyncio.sleep(0)
+        jobs = [
+            asyncio.create_task(scheduler.submit(chat, lambda label=f"{chat}{idx}": send(label)))
+            for chat, idx in (("a", 1), ("a", 2), ("a", 3), ("b", 1), ("b", 2))
+        ]
+        await asyncio.gather(*jobs)
+        runner.cancel()
+
+        assert order == ["a1", "b1", "a2", "b2", "a3"]
+        assert scheduler.pending == 0
+
+    asyncio.run(run())
+
+
+def test_submit_fails_fast_without_a_running_scheduler():
+    async def run():
+        scheduler = SendScheduler(global_rate=1000, per_chat_rate=0.001)
+
+        async def send():
+            return "ok"
+
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(1, send)
+
+        runner = scheduler.start()
+        assert await scheduler.submit(1, send) == "ok"
+        # The chat's bucket is empty now, so this one waits in the queue.
+        queued = asyncio.create_task(scheduler.submit(1, send))
+        await asyncio.sleep(0.01)
+        runner.cancel()
+        with pytest.raises(RuntimeError):
+            await queued
+        with pytest.raises(RuntimeError):
+            await scheduler.submit(1, send)
+
+    asyncio.run(run())
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import time
+
+from services.topics import TopicService
+
+
+def test_topic_index_pages_in_expiry_order_and_wraps(redis_store, fake_pg):
+    async def run():
+        service = TopicService(redis_store, fake_pg, 3600)
+        first = await service.create_topic(1, "first")
+        second = await service.create_topic(2, "second")
+
+        topic_id, score = await redis_store.next_topic()
+        assert topic_id == first
+        topic_id, score = await redis_store.next_topic((topic_id, score))
+        assert topic_id == second
+        topic_id, _score = await redis_store.next_topic((topic_id, score))
+        assert topic_id == first
+
+    asyncio.run(run())
+
+
+def test_topics_expiring_in_the_same_second_are_all_reachable(redis_store):
+    async def run():
+        expires_at = float(int(time.time()) + 60)
+        for topic_id in ("c", "a", "b"):
+            await redis_store.create_topic(topic_id, {"text": topic_id, "expires_at": expires_at}, 3600)
+
+        seen = []
+        cursor = None
+        for _ in range(4):
+            cursor = await redis_store.next_topic(cursor, page=2)
+            seen.append(cursor[0])
+        assert seen == ["a", "b", "c", "a"]
+
+    asyncio.run(run())
+
+
+def test_expired_topics_are_pruned_from_index(redis_store):
+    async def run():
+        await redis_store.create_topic("old", {"text": "x", "expires_at": time.time() - 1}, 3600)
+        assert await redis_store.next_topic() is None
+        assert await redis_store.redis.zcard("topics:index") == 0
+
+    asyncio.run(run())
+
+
+def test_cursor_stores_only_position(redis_store):
+    async def run():
+        await redis_store.set_topic_cursor(5, "t-1", 123.5)
+        assert await redis_store.get_topic_cursor(5) == ("t-1", 123.5)
+        await redis_store.redis.set("user:6:topic_cursor", '{"topic_ids": ["a"], "idx": 0}')
+        assert await redis_store.get_topic_cursor(6) is None
+
+    asyncio.run(run())
+
+
+def test_topic_payload_is_packed_and_legacy_json_still_reads(redis_store):
+    async def run():
+        payload = {"text": "Привет, мир", "owner": 7, "expires_at": time.time() + 60, "active": True}
+        await redis_store.create_topic("t-new", payload, 3600)
+        assert await redis_store.redis.hkeys("topic:t-new") == [b"p"]
+        assert await redis_store.get_topic("t-new") == payload
+
+        legacy = {"text": "старая тема", "owner": 8, "expires_at": 123.5, "active": True}
+        await redis_store.redis.hset("topic:t-old", mapping={k: json.dumps(v) for k, v in legacy.items()})
+        assert await redis_store.get_topic("t-old") == legacy
+
+    asyncio.run(run())
@@ -0,0 +1,84 @@
+import asyncio
+import random
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from shared.webhook import SECRET_HEADER, UpdatePool, build_webhook_app
+
+
+def _update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": text,
+        },
+    }
+
+
+def _dispatcher(handled):
+    router = Router()
+
+    @router.message()
+    async def record(message: Message):
+        await asyncio.sleep(random.random() / 100)
+        handled.setdefault(message.from_user.id, []).append(int(message.text))
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+def test_updates_of_one_user_are_handled_in_order():
+    async def run():
+        handled = {}
+        pool = UpdatePool(_dispatcher(handled), Bot("42:TEST"), workers=4, queue_size=400)
+        pool.start()
+        async with TestClient(TestServer(build_webhook_app(pool, "/webhook"))) as client:
+            update_id = 0
+            for seq in range(20):
+                for user_id in range(1, 9):
+                    update_id += 1
+                    response = await client.post("/webhook", json=_update(update_id, user_id, str(seq)))
+                    assert response.status == 200
+            await pool.stop()
+
+        assert handled == {user_id: list(range(20)) for user_id in range(1, 9)}
+
+    asyncio.run(run())
+
+
+def test_full_lane_answers_503_and_reports_depth():
+    async def run():
+        pool = UpdatePool(_dispatcher({}), Bot("42:TEST"), workers=1, queue_size=2)
+        async with TestClient(TestServer(build_webhook_app(pool, "/webhook", secret="s3cret"))) as client:
+            headers = {SECRET_HEADER: "s3cret"}
+            statuses = [
+                (await client.post("/webhook", json=_update(i, 1, "0"), headers=headers)).status for i in range(3)
+            ]
+            unauthorized = await client.post("/webhook", json=_update(9, 1, "0"))
+            health = await (await client.get("/healthz")).json()
+
+        assert statuses == [200, 200, 503]
+        assert unauthorized.status == 401
+        assert health == {"queue_depth": 2, "queue_capacity": 2, "rejected": 1}
+
+    asyncio.run(run())
+
+
+def test_malformed_updates_are_acknowledged_and_dropped():
+    async def run():
+        pool = UpdatePool(_dispatcher({}), Bot("42:TEST"), workers=1, queue_size=2)
+        async with TestClient(TestServer(build_webhook_app(pool, "/webhook"))) as client:
+            not_json = await client.post("/webhook", data=b"{not json")
+            not_update = await client.post("/webhook", json={"message": "hi"})
+
+        assert (not_json.status, not_update.status) == (200, 200)
+        assert pool.depth == 0
+
+    asyncio.run(run())
@@ -0,0 +1,230 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from fakeredis import aioredis as fake_aioredis
+
+from bot.config import settings
+from bot.storage.redis_client import RedisClient
+from bot.tasks import CleanupDialogTask, CleanupTopicTask, NotifyTask, SendMessageTask, TaskDecodeError, decode_task, encode_task
+from bot.worker import Worker
+
+STREAM = "tasks"
+GROUP = "workers"
+
+
+@pytest.fixture
+def tasks_redis(redis_server):
+    client = RedisClient()
+    client.client = fake_aioredis.FakeRedis(server=redis_server, decode_responses=True)
+    return client
+
+
+class RecordingWorker(Worker):
+    def __init__(self, redis, consumer, fail=(), delay=0.0, **kwargs):
+        super().__init__(redis, db=object(), consumer=consumer, stream=STREAM, group=GROUP, **kwargs)
+        self.fail = set(fail)
+        self.delay = delay
+        self.handled = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle_task(self, task):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+            if task in self.fail:
+                raise RuntimeError("boom")
+            self.handled.append(task)
+        finally:
+            self.active -= 1
+
+
+def test_task_payloads_round_trip():
+    task = SendMessageTask(chat_id=42, text="привет")
+    assert decode_task(encode_task(task)) == task
+    with pytest.raises(TaskDecodeError):
+        decode_task({"type": "reboot", "data": "{}"})
+    with pytest.raises(TaskDecodeError):
+        decode_task({"type": "notify", "data": '{"user": 1}'})
+
+
+def test_tasks_run_concurrently_within_limit_and_are_acked(tasks_redis):
+    async def run():
+        tasks = [NotifyTask(user_id, "hi") for user_id in range(10)]
+        for task in tasks:
+            await tasks_redis.enqueue_task(STREAM, task)
+        worker = RecordingWorker(tasks_redis, "w1", delay=0.01, concurrency=3)
+        await worker.ensure_group()
+
+        while worker.processed < len(tasks):
+            await worker.run_once()
+            await asyncio.sleep(0)
+        await worker.drain()
+
+        assert sorted(worker.handled, key=lambda t: t.user_id) == tasks
+        assert worker.max_active == 3
+        assert await tasks_redis.client.xlen(STREAM) == 0
+        assert (await tasks_redis.client.xpending(STREAM, GROUP))["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_failed_and_orphaned_tasks_are_reclaimed(tasks_redis):
+    async def run():
+        orphan = CleanupTopicTask("t-1")
+        flaky = CleanupTopicTask("t-2")
+        await tasks_redis.enqueue_task(STREAM, orphan)
+        await tasks_redis.enqueue_task(STREAM, flaky)
+
+        # A worker that died after reading the first entry.
+        dead = RecordingWorker(tasks_redis, "dead")
+        await dead.ensure_group()
+        await dead._read(1, None)
+        failing = RecordingWorker(tasks_redis, "w1", fail={flaky}, claim_idle_ms=10_000)
+        await failing.run_once()
+        await failing.drain()
+        assert failing.handled == [] and failing.failed == 1
+        assert (await tasks_redis.client.xpending(STREAM, GROUP))["pending"] == 2
+
+        rescuer = RecordingWorker(tasks_redis, "w2", claim_idle_ms=0)
+        await rescuer.run_once()
+        await rescuer.drain()
+        assert sorted(rescuer.handled, key=lambda t: t.topic_id) == [orphan, flaky]
+        assert (await tasks_redis.client.xpending(STREAM, GROUP))["pending"] == 0
+
+    asyncio.run(run())
+
+
+def test_due_dialog_cleanup_is_promoted_and_resets_participants(tasks_redis):
+    async def run():
+        client = tasks_redis.client
+        await client.hset("dialog:d-1", mapping={"user1_id": "1", "user2_id": "2"})
+        for user_id in ("1", "2"):
+            await client.set(f"user:{user_id}:state", "DIALOG")
+            await client.set(f"user:{user_id}:dialog_id", "d-1")
+        await tasks_redis.schedule_task("delayed", CleanupDialogTask("d-1"), time.time() - 1)
+        await tasks_redis.schedule_task("delayed", CleanupDialogTask("d-2"), time.time() + 60)
+        worker = Worker(tasks_redis, db=object(), consumer="w1", stream=STREAM, group=GROUP, delayed_key="delayed")
+        await worker.ensure_group()
+
+        await worker.run_once()
+        await worker.drain()
+
+        assert worker.processed == 1
+        assert await client.zrange("delayed", 0, -1) == ['cleanup_dialog {"dialog_id": "d-2"}']
+        assert not await client.exists("dialog:d-1", "user:1:dialog_id", "user:2:dialog_id")
+        assert await client.get("user:1:state") == "DIALOG_ENDED"
+        entries = await client.xrange(STREAM)
+        assert sorted(decode_task(fields).user_id for _id, fields in entries) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_poison_tasks_do_not_starve_others_and_are_dead_lettered(tasks_redis):
+    async def run():
+        poison = [CleanupTopicTask("p-1"), CleanupTopicTask("p-2")]
+        good = CleanupTopicTask("t-1")
+        for task in (*poison, good):
+            await tasks_redis.enqueue_task(STREAM, task)
+        dead = RecordingWorker(tasks_redis, "dead")
+        await dead.ensure_group()
+        await dead._read(3, None)
+
+        worker = RecordingWorker(
+            tasks_redis, "w1", fail=set(poison), claim_idle_ms=0, batch_size=2, max_deliveries=3, dead_stream="dead"
+        )
+        for _ in range(2):
+            await worker.run_once()
+            await worker.drain()
+        assert worker.handled == [good]
+
+        for _ in range(10):
+            await worker.run_once()
+            await worker.drain()
+        dead_letters = await tasks_redis.client.xrange("dead")
+        assert sorted((decode_task(fields) for _id, fields in dead_letters), key=lambda t: t.topic_id) == poison
+        assert all("entry_id" in fields for _id, fields in dead_letters)
+        assert worker.dead == 2
+        assert (await tasks_redis.client.xpending(STREAM, GROUP))["pending"] == 0
+        assert await tasks_redis.client.xlen(STREAM) == 0
+        assert not await tasks_redis.client.exists(worker.deliveries_key)
+
+    asyncio.run(run())
+
+
+def test_activity_moves_dialog_cleanup_forward(tasks_redis):
+    async def run():
+        client = tasks_redis.client
+        for user_id in (1, 2):
+            await tasks_redis.set_user_state(user_id, "SEARCHING")
+        dialog_id = await tasks_redis.create_dialog(1, 2)
+        member = f'cleanup_dialog {{"dialog_id": "{dialog_id}"}}'
+        scheduled = await client.zscore(settings.DELAYED_TASKS_KEY, member)
+        await client.zadd(settings.DELAYED_TASKS_KEY, {member: scheduled - 600})
+
+        assert await tasks_redis.touch_dialog(dialog_id) is True
+        assert await client.zscore(settings.DELAYED_TASKS_KEY, member) >= scheduled
+        assert await client.ttl(f"dialog:{dialog_id}") > settings.DIALOG_INACTIVITY_TTL
+
+        await tasks_redis.end_dialog(dialog_id)
+        assert await tasks_redis.touch_dialog(dialog_id) is False
+        assert await client.ttl(f"dialog:{dialog_id}") <= 60
+
+    asyncio.run(run())
+
+
+class SendingBot:
+    # Answers each send_message with the next scripted error, then succeeds.
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.errors:
+            raise self.errors.pop(0)(chat_id)
+        self.sent.append((chat_id, text))
+
+
+def flood_wait(chat_id):
+    return TelegramRetryAfter(SendMessage(chat_id=chat_id, text=""), "Too Many Requests", retry_after=0)
+
+
+def blocked(chat_id):
+    return TelegramForbiddenError(SendMessage(chat_id=chat_id, text=""), "bot was blocked by the user")
+
+
+def test_expired_dialog_notifies_both_participants(tasks_redis):
+    async def run():
+        client = tasks_redis.client
+        for user_id in (1, 2):
+            await tasks_redis.set_user_state(user_id, "SEARCHING")
+        dialog_id = await tasks_redis.create_dialog(1, 2)
+        bot = SendingBot(errors=[flood_wait])
+        worker = Worker(tasks_redis, db=object(), bot=bot, consumer="w1", stream=STREAM, group=GROUP)
+        await worker.ensure_group()
+
+        await worker.cleanup_dialog(dialog_id)
+        while worker.processed < 2:
+            await worker.run_once()
+            await worker.drain()
+
+        assert sorted(bot.sent) == [(1, "Время диалога истекло"), (2, "Время диалога истекло")]
+        assert await client.xlen(STREAM) == 0
+
+    asyncio.run(run())
+
+
+def test_message_to_a_user_who_blocked_the_bot_is_not_retried(tasks_redis):
+    async def run():
+        bot = SendingBot(errors=[blocked])
+        worker = Worker(tasks_redis, db=object(), bot=bot, consumer="w1", stream=STREAM, group=GROUP)
+
+        await worker.send_message_with_backoff(SendMessageTask(5, "hi"))
+
+        assert bot.sent == [] and bot.errors == []
+
+    asyncio.run(run())